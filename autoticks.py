@@ -0,0 +1,189 @@
+"""
+Automatic choice of nice ticks, from the spacing they get on the drawn ruler.
+github.com/mtewes/cosmicruler
+
+Instead of hand-picking the tick values of a scale, autoticks() takes its quantity (a function of redshift), the zptrans
+and the length l of the ruler, and picks nice values (multiples of 1, 5 or 2 times a power of ten) such that no two ticks
+are closer than minspacing, and no two major (labelled) ticks closer than labelspacing, in svg units.
+The density adapts along the ruler: where the quantity varies slowly, the intervals get divided further.
+
+Example:
+
+	inv = cosmoinv.Inverter.fromcosmo(cosmo, "lookback_time", u.Gyr)
+	scale.addautoticks(inv.forward, zptrans, 930.0, minspacing=4.0, labelspacing=40.0)
+
+or, in a ruler spec, a step {"auto": true} (see ruler.py).
+
+The steps form a ladder in which each step divides the previous one (10, 5, 1, 0.5, 0.1... for mantissa 5,
+or 10, 2, 1, 0.2, 0.1... for mantissa 2). The quantity is sampled once along the ruler, which gives the position of any value
+by interpolation. Going down the ladder, all current intervals are divided at once, as a 2D array of their subdivisions:
+an interval is divided if its subdivisions are at least labelspacing apart (they are then major ticks), or, if not, at least
+minspacing apart (medium ticks for the first division below the major ticks, minor ticks further down).
+Non-monotonic quantities are split into monotonic branches, which get their ticks separately.
+"""
+
+import math
+
+import numpy as np
+
+import cosmicruler
+import cosmoinv
+import profiling
+
+
+def ladder(span, mantissa=5):
+	"""Yields the nested nice steps as (step, number of divisions to the next step), starting with the largest step not above span"""
+	if mantissa not in (2, 5):
+		raise ValueError("The mantissa of the steps must be 2 or 5, not {}".format(mantissa))
+	e = math.floor(math.log10(span))
+	m = mantissa if mantissa * 10.0**e <= span else 1
+	while True:
+		if m == 1:
+			yield (10.0**e, 10 // mantissa)
+			(m, e) = (mantissa, e - 1)
+		else:
+			yield (mantissa * 10.0**e, mantissa)
+			m = 1
+
+
+def decimals(step):
+	"""Number of decimals needed to write the multiples of a step"""
+	return max(0, -math.floor(math.log10(step)) + 1)
+
+
+def sample(fct, zptrans, l, unit=None, n=None, resolution=0.5):
+	"""Evaluates fct along the ruler, every resolution svg units (or at n points), returns (x, z, value) where the value is finite"""
+	if n is None:
+		n = int(math.ceil(l / resolution)) + 1
+	x = np.linspace(0.0, l, n)
+	z = zptrans.z(x / l)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		value = cosmoinv.tovalue(fct(z), unit)
+	ok = np.isfinite(value)
+	return (x[ok], z[ok], value[ok])
+
+
+def monotonicruns(value):
+	"""List of (start, stop) slices of the monotonic runs of an array, consecutive runs share their turning point"""
+	sign = np.sign(np.diff(value))
+	nonzero = np.nonzero(sign)[0]
+	turns = nonzero[1:][sign[nonzero[1:]] != sign[nonzero[:-1]]]
+	bounds = np.concatenate(([0], turns, [len(value) - 1]))
+	return [(start, stop + 1) for (start, stop) in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+class Branch(object):
+	"""A monotonic part of the sampled quantity, giving the positions x of values (as the value increases)"""
+
+	def __init__(self, x, z, value):
+		order = np.argsort(value, kind="stable")
+		(self.x, self.z, self.value) = (x[order], z[order], value[order])
+		(self.xmin, self.xmax) = (np.min(x), np.max(x))
+		with np.errstate(divide="ignore", invalid="ignore"):
+			self.slopes = ((self.x[1] - self.x[0]) / (self.value[1] - self.value[0]),
+				(self.x[-1] - self.x[-2]) / (self.value[-1] - self.value[-2]))
+
+	def positions(self, values):
+		"""x of the values, linearly extrapolated beyond the sampled part, so that intervals keep their length"""
+		x = np.interp(values, self.value, self.x)
+		below = values < self.value[0]
+		above = values > self.value[-1]
+		x[below] = self.x[0] + (values[below] - self.value[0]) * self.slopes[0]
+		x[above] = self.x[-1] + (values[above] - self.value[-1]) * self.slopes[1]
+		return x
+
+	def visible(self, x, tol=1.0e-9):
+		return np.logical_and(x >= self.xmin - tol, x <= self.xmax + tol)
+
+	def ticks(self, minspacing, labelspacing, mantissa):
+		"""Returns the (value, class) arrays of the nice ticks of this branch"""
+		steps = ladder(self.value[-1] - self.value[0], mantissa)
+		(step, ratio) = next(steps)
+		idx = np.arange(math.floor(self.value[0] / step), math.ceil(self.value[-1] / step) + 1, dtype=np.int64)
+		values = [np.round(idx * step, decimals(step))]
+		clss = [self.thin(self.positions(values[0]), minspacing, labelspacing)]
+
+		starts = idx[:-1]
+		depth = np.zeros(len(starts), dtype=np.int64) # number of divisions below the major ticks
+		while len(starts) > 0:
+			(step, nextratio) = next(steps)
+			children = starts[:, None] * ratio + np.arange(ratio + 1)
+			x = self.positions(children * step)
+			outside = np.logical_or(np.all(x < self.xmin, axis=1), np.all(x > self.xmax, axis=1))
+			gap = np.min(np.abs(np.diff(x, axis=1)), axis=1)
+			major = np.logical_and(depth == 0, gap >= labelspacing)
+			divide = np.logical_and(np.logical_or(major, gap >= minspacing), ~outside)
+			cls = np.where(major, cosmicruler.MAJ, np.where(depth == 0, cosmicruler.MED, cosmicruler.MIN)).astype(np.uint8)
+
+			inner = children[divide, 1:-1]
+			values.append(np.round(inner.ravel() * step, decimals(step)))
+			clss.append(np.repeat(cls[divide], ratio - 1))
+			starts = children[divide, :-1].ravel()
+			depth = np.repeat(np.where(major, 0, depth + 1)[divide], ratio)
+			ratio = nextratio
+
+		(values, clss) = (np.concatenate(values), np.concatenate(clss))
+		keep = np.logical_and(self.visible(self.positions(values)), clss != 255)
+		return (values[keep], clss[keep])
+
+	def thin(self, x, minspacing, labelspacing):
+		"""Classes of the ticks of the coarsest step: major if they are labelspacing apart, else medium if minspacing apart,
+		else none (255). The ticks are taken one after the other, starting from the side where they are further apart.
+		"""
+		cls = np.full(len(x), 255, dtype=np.uint8)
+		order = np.argsort(x)
+		visible = order[self.visible(x[order])]
+		if len(visible) > 1 and x[visible[1]] - x[visible[0]] < x[visible[-1]] - x[visible[-2]]:
+			visible = visible[::-1]
+		(lastmajor, last) = (None, None)
+		for i in visible:
+			if last is not None and abs(x[i] - last) < minspacing:
+				continue
+			if lastmajor is None or abs(x[i] - lastmajor) >= labelspacing:
+				cls[i] = cosmicruler.MAJ
+				lastmajor = x[i]
+			else:
+				cls[i] = cosmicruler.MED
+			last = x[i]
+		return cls
+
+	def invert(self, fct, values, unit=None, tol=1.0e-12, maxiter=100):
+		"""Redshifts of the values, by a vectorized bisection of fct within the sampled intervals containing them"""
+		i = np.clip(np.searchsorted(self.value, values) - 1, 0, len(self.value) - 2)
+		(za, zb) = (self.z[i], self.z[i+1]) # fct(za) <= value <= fct(zb)
+		for it in range(maxiter):
+			if len(values) == 0 or np.max(np.abs(zb - za) / (1.0 + np.abs(za))) < tol:
+				break
+			zm = 0.5 * (za + zb)
+			with np.errstate(divide="ignore", invalid="ignore"):
+				low = cosmoinv.tovalue(fct(zm), unit) <= values
+			za = np.where(low, zm, za)
+			zb = np.where(low, zb, zm)
+		return 0.5 * (za + zb)
+
+
+@profiling.timed("autoticks")
+def autoticks(fct, zptrans, l, unit=None, minspacing=4.0, labelspacing=40.0, mantissa=5, resolution=0.5):
+	"""Chooses the nice ticks of a quantity on a ruler
+
+	fct : the quantity, as function of redshift accepting arrays (e.g., the forward of a cosmoinv.Inverter, which is fast,
+		or an astropy cosmology method, then with unit)
+	zptrans : the ZPTrans (or PiecewiseZPTrans) of the ruler
+	l : length of the ruler, in svg units
+	minspacing, labelspacing : minimal distances between any ticks, and between major ticks, in svg units
+	mantissa : 5 for steps 1, 5, 10, 50... or 2 for steps 1, 2, 10, 20...
+	resolution : distance between the points at which fct is sampled to find the positions, in svg units
+
+	Returns arrays (values, z, cls) with the values of the ticks, their redshifts and their classes (cosmicruler.MAJ, MED or MIN).
+	"""
+	(x, z, value) = sample(fct, zptrans, l, unit, resolution=resolution)
+	out = []
+	for (start, stop) in monotonicruns(value):
+		if value[start] == value[stop-1]:
+			continue
+		branch = Branch(x[start:stop], z[start:stop], value[start:stop])
+		(values, cls) = branch.ticks(minspacing, labelspacing, mantissa)
+		out.append((values, branch.invert(fct, values, unit), cls))
+	if len(out) == 0:
+		return (np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.uint8))
+	return tuple(np.concatenate(arrays) for arrays in zip(*out))
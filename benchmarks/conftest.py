@@ -0,0 +1,64 @@
+"""
+Benchmarks of the hot paths, run with pytest-benchmark:
+
+	python -m pytest benchmarks
+
+The results are saved to the JSON history in .benchmarks (in the current directory), compare runs with
+
+	pytest-benchmark compare --group-by=name
+
+The largest sizes (1e7 and 1e8 catalog rows) are only run with --large.
+The results of the same functions are checked (against astropy and the sorted catalog) in test_correctness.py,
+which does not need pytest-benchmark.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+TICKSIZES = [10, 1000, 100000]
+ROWSIZES = [100000, 1000000, pytest.param(10000000, marks=pytest.mark.large), pytest.param(100000000, marks=pytest.mark.large)]
+
+
+def pytest_addoption(parser):
+	parser.addoption("--large", action="store_true", help="also run the benchmarks on the largest catalogs")
+
+
+def pytest_configure(config):
+	config.addinivalue_line("markers", "large: benchmark on a large catalog, only run with --large")
+	if getattr(config.option, "benchmark_autosave", False) is None: # keeps a JSON history of all runs, as --benchmark-autosave
+		from pytest_benchmark.utils import get_tag
+		config.option.benchmark_autosave = get_tag()
+
+
+def pytest_collection_modifyitems(config, items):
+	if config.getoption("--large"):
+		return
+	skip = pytest.mark.skip(reason="needs --large")
+	for item in items:
+		if "large" in item.keywords:
+			item.add_marker(skip)
+
+
+def synthzs(n, seed=1):
+	"""Redshifts of a synthetic catalog, roughly distributed like those of a galaxy survey"""
+	return np.random.default_rng(seed).gamma(2.0, 0.5, n)
+
+
+@pytest.fixture(scope="session")
+def catalogs():
+	"""Cache of synthetic catalogs (astropy tables with redshifts and magnitudes) by number of rows"""
+	import astropy.table
+	cache = {}
+	def get(n):
+		if n not in cache:
+			cache.clear() # keeps at most one large catalog in memory
+			rng = np.random.default_rng(2)
+			cache[n] = astropy.table.Table({"true_redshift_gal": synthzs(n), "euclid_vis": rng.normal(24.0, 1.0, n)}, copy=False)
+		return cache[n]
+	return get
@@ -0,0 +1,155 @@
+"""Checks of the results of the hot paths (the other modules only time them), run with pytest:
+
+	python -m pytest benchmarks/test_correctness.py
+"""
+
+import re
+import zlib
+import struct
+
+import numpy as np
+import pytest
+
+import astropy.units as u
+from astropy.cosmology import Planck15 as cosmo, z_at_value
+
+import cosmicruler
+import cosmoinv
+import galcounts
+import layout
+import pdfrender
+import pngrender
+import svgstream
+
+from conftest import synthzs
+
+
+def test_inverter_z_at_value():
+	inv = cosmoinv.Inverter(cosmo.lookback_time, u.Gyr)
+	values = [0.01, 0.5, 1.0, 3.0, 7.5, 12.0, 13.5]
+	expected = [z_at_value(cosmo.lookback_time, value * u.Gyr).value for value in values]
+	assert np.allclose(inv(values), expected, rtol=1.0e-6, atol=0.0)
+	assert inv(3.0) == pytest.approx(expected[3], rel=1.0e-6)
+	assert np.isnan(inv([20.0])[0])
+	with pytest.raises(ValueError):
+		inv(20.0)
+
+
+def test_branchedinverter_z_at_value():
+	inv = cosmoinv.BranchedInverter(cosmo.angular_diameter_distance, u.Mpc)
+	(zpeak, peak) = inv.peak()
+	values = [600.0, 1000.0, 1700.0] # reached on both branches, up to z = 20
+	zs = inv(values)
+	assert zs.shape == (2, len(values))
+	for (value, z0, z1) in zip(values, zs[0], zs[1]):
+		assert z0 == pytest.approx(z_at_value(cosmo.angular_diameter_distance, value * u.Mpc, zmax=zpeak).value, rel=1.0e-6)
+		assert z1 == pytest.approx(z_at_value(cosmo.angular_diameter_distance, value * u.Mpc, zmin=zpeak, zmax=20.0).value, rel=1.0e-6)
+	assert np.all(np.isnan(inv([peak * 1.01])))
+
+
+@pytest.mark.parametrize("quantity", sorted(cosmoinv.GRIDUNITS))
+def test_cosmogrid_astropy(quantity):
+	grid = cosmoinv.CosmoGrid(cosmo)
+	unit = u.Unit(cosmoinv.GRIDUNITS[quantity])
+	sel = grid.z >= 0.01 # below, the volume and distmod lose relative precision (in astropy as well)
+	z = grid.z[sel]
+	values = grid.values(quantity)[sel]
+	expected = getattr(cosmo, quantity)(z)
+	assert np.allclose(values, expected.to_value(unit), rtol=1.0e-7, atol=0.0)
+
+
+def test_clean_priorities():
+	scale = cosmicruler.Scale(name="clean")
+	scale.addticks([0.5, 1.0, 2.0], "min")
+	scale.addticks([1.0 + 1.0e-9, 2.0], "med")
+	scale.addticks([2.0, np.nan], "maj")
+	scale.addlabels([1.0, 1.0 + 1.0e-9, 3.0], ["first", "second", "third"])
+	dropped = scale.clean()
+	assert scale.majticks.tolist() == [2.0]
+	assert scale.medticks.tolist() == [1.0 + 1.0e-9]
+	assert scale.minticks.tolist() == [0.5]
+	assert [text for (pos, text) in scale.labels] == ["first", "third"]
+	assert sorted(dropped["min"].tolist()) == [1.0, 2.0]
+	assert dropped["med"].tolist() == [2.0]
+
+
+def test_autosubticks():
+	(pos, cls, failed) = cosmicruler.autosubticks([2.0, 1.0, 3.0], "lin2")
+	assert pos[cls == cosmicruler.MAJ].tolist() == [1.0, 2.0, 3.0]
+	assert pos[cls == cosmicruler.MED].tolist() == [1.5, 2.5]
+	assert not np.any(failed)
+	(pos, cls, failed) = cosmicruler.autosubticks([0.1, 1.0], "log10", transf=lambda x: np.where(x < 0.55, x, np.nan))
+	assert np.allclose(pos[~failed & (cls == cosmicruler.MIN)], [0.2, 0.3, 0.4, 0.5])
+	assert np.sum(failed) == 5 # 0.6 to 0.9, and the major tick at 1
+
+
+def test_counts_to_z_sorted():
+	z = synthzs(100000)
+	counts = galcounts.CumulativeCounts()
+	for chunk in np.array_split(z, 7):
+		counts.add(chunk)
+	wanted = np.array([100.0, 1234.0, 25000.0, 50000.0, 90000.0, 99000.0])
+	zsorted = np.sort(z)
+	expected = galcounts.counts_to_z(zsorted, wanted)
+	indices = galcounts.countindices(wanted)
+	binwidth = counts.edges[1] - counts.edges[0]
+	tolerance = zsorted[indices+1] - zsorted[indices-1] + 2.0 * binwidth
+	assert np.all(np.abs(counts.counts_to_z(wanted) - expected) <= tolerance)
+	# The partitioned catalog gives the same as the sorted one
+	assert np.array_equal(galcounts.counts_to_z(galcounts.sortedz(z, [indices]), wanted), expected)
+
+
+def ruler(shift=0.0):
+	"""Layout of two scales, one with a name with spaces, the second one shifted by shift"""
+	lay = layout.RulerLayout()
+	for (i, name) in enumerate(["Lookback time", "size"]):
+		scale = cosmicruler.Scale(name=name, title=name)
+		values = np.linspace(0.0, 1.0, 11) + (shift if i == 1 else 0.0)
+		scale.addticks(values, "maj")
+		scale.addlabels(values, ["{:.1f}".format(value) for value in values])
+		lay.addscale(scale, 10, 50 + 100 * i, 500)
+	lay.rect((0, 0), (600, 300), fill="none", stroke="black")
+	return lay
+
+
+def test_svgstream_update(tmp_path):
+	filepath = str(tmp_path / "ruler.svg")
+	assert svgstream.update(filepath, ruler()) == 2
+	written = open(filepath).read()
+	assert svgstream.update(filepath, ruler()) == 0
+	assert open(filepath).read() == written
+	assert svgstream.update(filepath, ruler(0.05)) == 1
+	svgstream.renderfile(ruler(0.05), str(tmp_path / "full.svg"))
+	assert open(filepath).read() == open(str(tmp_path / "full.svg")).read()
+
+
+def test_png(tmp_path):
+	filepath = str(tmp_path / "ruler.png")
+	pngrender.renderfile(ruler(), filepath)
+	data = open(filepath, "rb").read()
+	assert data[:8] == b"\x89PNG\r\n\x1a\n"
+	(pos, chunks) = (8, {})
+	while pos < len(data):
+		(length,) = struct.unpack(">I", data[pos:pos+4])
+		(kind, body) = (data[pos+4:pos+8], data[pos+8:pos+8+length])
+		assert struct.unpack(">I", data[pos+8+length:pos+12+length])[0] == zlib.crc32(kind + body) & 0xffffffff
+		chunks[kind] = body
+		pos += 12 + length
+	(width, height) = struct.unpack(">II", chunks[b"IHDR"][:8])
+	rows = np.frombuffer(zlib.decompress(chunks[b"IDAT"]), dtype=np.uint8).reshape((height, 1 + 3 * width))
+	assert np.any(rows[:, 1:] < 128) and np.any(rows[:, 1:] == 255) # some ink on the white background
+	assert b"IEND" in chunks
+
+
+def test_pdf(tmp_path):
+	filepath = str(tmp_path / "ruler.pdf")
+	pdfrender.renderfile(ruler(), filepath, font="Helvetica")
+	data = open(filepath, "rb").read()
+	assert data.startswith(b"%PDF-1.4") and data.rstrip().endswith(b"%%EOF")
+	xref = int(re.search(rb"startxref\n(\d+)\n", data).group(1))
+	assert data[xref:xref+4] == b"xref"
+	offsets = [int(offset) for offset in re.findall(rb"(\d{10}) 00000 n ", data[xref:])]
+	for (number, offset) in enumerate(offsets, start=1):
+		assert data[offset:].startswith("{} 0 obj".format(number).encode("ascii"))
+	content = re.search(rb"4 0 obj\n<<[^>]*>>\nstream\n", data)
+	assert b"(Lookback time) Tj" in zlib.decompress(data[content.end():])
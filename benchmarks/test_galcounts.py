@@ -0,0 +1,43 @@
+"""Count scales from synthetic catalogs"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import galcounts
+
+from conftest import ROWSIZES
+
+
+def countticks(n):
+	"""Ticks and labels of counts spanning most of a catalog of n rows (with catfactor 1)"""
+	majticks = np.geomspace(100, 0.9*n, 12).tolist()
+	minticks = np.linspace(100, 0.9*n, 100).tolist()
+	labels = [(value, "{:.0f}".format(value)) for value in majticks]
+	return dict(majticks=majticks, minticks=minticks, labels=labels)
+
+
+@pytest.mark.parametrize("n", ROWSIZES)
+def test_scale_counts_to_z(benchmark, catalogs, n):
+	cat = catalogs(n)
+	benchmark.pedantic(galcounts.scale_counts_to_z, args=(cat, 1.0), kwargs=countticks(n), rounds=3)
+
+
+@pytest.mark.parametrize("n", ROWSIZES)
+def test_cumulative_counts(benchmark, catalogs, n):
+	z = np.asarray(catalogs(n)["true_redshift_gal"])
+	def run():
+		counts = galcounts.CumulativeCounts()
+		for start in range(0, n, 1000000): # as if streamed from a file
+			counts.add(z[start:start+1000000])
+		return counts.counts_to_z(countticks(n)["majticks"])
+	benchmark.pedantic(run, rounds=3)
+
+
+@pytest.mark.parametrize("n", ROWSIZES)
+def test_stream_fits(benchmark, catalogs, n, tmp_path):
+	filepath = str(tmp_path / "cat.fits")
+	catalogs(n).write(filepath)
+	benchmark.pedantic(galcounts.CumulativeCounts.fromselections, args=(filepath, "true_redshift_gal",
+		{"all": None, "vis": "euclid_vis < 24.5"}), rounds=3)
@@ -0,0 +1,55 @@
+"""Finding the redshifts of tick values, with z_at_value (the old way) and with cosmoinv"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import astropy.units as u
+from astropy.cosmology import Planck15 as cosmo, z_at_value
+
+import cosmoinv
+
+
+def test_z_at_value(benchmark):
+	values = np.linspace(0.5, 10.0, 10)
+	benchmark(lambda: [z_at_value(cosmo.lookback_time, value * u.Gyr) for value in values])
+
+
+def test_tabulate(benchmark):
+	benchmark(cosmoinv.Inverter, cosmo.lookback_time, u.Gyr)
+
+
+def test_cosmogrid(benchmark):
+	"""All distances and times from one integration, instead of one astropy tabulation per quantity"""
+	def run():
+		grid = cosmoinv.CosmoGrid(cosmo)
+		return [grid.values(quantity) for quantity in cosmoinv.GRIDUNITS]
+	benchmark(run)
+
+
+@pytest.mark.parametrize("n", [10, 1000, 100000])
+def test_invert(benchmark, n):
+	inv = cosmoinv.Inverter(cosmo.lookback_time, u.Gyr)
+	values = np.linspace(0.1, 13.0, n)
+	benchmark(inv, values)
+
+
+@pytest.mark.parametrize("n", [10, 1000, 100000])
+def test_invert_branches(benchmark, n):
+	inv = cosmoinv.BranchedInverter(cosmo.angular_diameter_distance, u.Gpc)
+	values = np.linspace(0.1, 1.7, n)
+	benchmark(inv, values)
+
+
+def test_invert_empty():
+	"""No values (e.g., subticks dividing intervals into 1 part) give no redshifts"""
+	assert cosmoinv.Inverter(cosmo.lookback_time, u.Gyr)([]).shape == (0,)
+	assert cosmoinv.BranchedInverter(cosmo.angular_diameter_distance, u.Gpc)([]).shape == (2, 0)
+
+
+def test_fromcosmo_cached(benchmark, tmp_path):
+	import cosmocache
+	cache = cosmocache.TableCache(str(tmp_path))
+	cosmoinv.Inverter.fromcosmo(cosmo, "lookback_time", u.Gyr, cache=cache) # fills the cache
+	benchmark(cosmoinv.Inverter.fromcosmo, cosmo, "lookback_time", u.Gyr, cache=cache)
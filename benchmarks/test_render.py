@@ -0,0 +1,80 @@
+"""Drawing and saving scales, with svgwrite (simpledraw), with the streaming writer, and as PNG and PDF"""
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import svgwrite
+
+import cosmicruler
+import layout
+import pdfrender
+import pngrender
+import svgstream
+
+from conftest import TICKSIZES
+from test_ticks import filledscale
+
+
+def pscale(n):
+	scale = filledscale(n)
+	scale.apply_zptrans(cosmicruler.ZPTrans(0.0, 2.0, "lin"))
+	scale.clean()
+	return scale
+
+
+@pytest.mark.parametrize("n", TICKSIZES)
+def test_simpledraw_save(benchmark, n, tmp_path):
+	scale = pscale(n)
+	filepath = str(tmp_path / "bench.svg")
+	def run():
+		dwg = svgwrite.Drawing(filepath, profile="full", debug=True)
+		scale.simpledraw(dwg, 10, 50, 1000)
+		dwg.save()
+	benchmark.pedantic(run, rounds=3 if n > 10000 else 10)
+
+
+@pytest.mark.parametrize("n", TICKSIZES)
+def test_layout(benchmark, n):
+	scale = pscale(n)
+	benchmark(lambda: layout.RulerLayout().addscale(scale, 10, 50, 1000))
+
+
+@pytest.mark.parametrize("n", TICKSIZES)
+def test_svgstream(benchmark, n, tmp_path):
+	lay = layout.RulerLayout()
+	lay.addscale(pscale(n), 10, 50, 1000)
+	filepath = str(tmp_path / "bench.svg")
+	def run():
+		with svgstream.SVGStream(filepath) as svg:
+			svg.drawlayout(lay)
+	benchmark(run)
+
+
+@pytest.mark.parametrize("n", TICKSIZES)
+def test_pngrender(benchmark, n, tmp_path):
+	lay = layout.RulerLayout(size=(1020, 200))
+	lay.addscale(pscale(n), 10, 150, 1000)
+	filepath = str(tmp_path / "bench.png")
+	benchmark(lambda: pngrender.renderfile(lay, filepath, dpi=150))
+
+
+@pytest.mark.parametrize("n", TICKSIZES)
+def test_pdfrender(benchmark, n, tmp_path):
+	lay = layout.RulerLayout(size=(1020, 200))
+	lay.addscale(pscale(n), 10, 150, 1000)
+	filepath = str(tmp_path / "bench.pdf")
+	benchmark(lambda: pdfrender.renderfile(lay, filepath))
+
+
+def test_placelabels_chain(benchmark):
+	"""30k labels along the scale, each overlapping only its neighbours, with increasing rank along the chain"""
+	n = 30000
+	scale = cosmicruler.Scale(name="chain", title="Chain")
+	values = [i / n for i in range(n)]
+	scale.addlabels(values, ["{:05d}".format(i) for i in range(n)])
+	def setup():
+		lay = layout.RulerLayout()
+		lay.addscale(scale, 10, 50, 20.0 * n) # 20 units between labels about 30 units wide
+		return ((lay,), {})
+	benchmark.pedantic(lambda lay: lay.placelabels(), setup=setup, rounds=3)
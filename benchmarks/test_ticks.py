@@ -0,0 +1,54 @@
+"""Tick generation and the operations on Scales"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import cosmicruler
+
+from conftest import TICKSIZES
+
+
+def majors(n):
+	"""n major tick positions between 0.1 and 2, so that log10 steps stay possible"""
+	return np.linspace(0.1, 2.0, n).tolist()
+
+
+def filledscale(n):
+	"""A scale with about n ticks (in redshift), with duplicates between the classes, and labels"""
+	a = majors(max(2, n // 6))
+	scale = cosmicruler.Scale(name="bench", title="Bench")
+	scale.addlabels(a, ["{:.3f}".format(value) for value in a])
+	scale.addautosubticks(a, "lin5")
+	scale.addautosubticks(a[::2], "lin2")
+	return scale
+
+
+@pytest.mark.parametrize("n", TICKSIZES)
+@pytest.mark.parametrize("type", ["lin2", "lin3", "lin210"])
+def test_autosubtickmaker(benchmark, n, type):
+	a = majors(max(2, n // 10))
+	def run():
+		(majticks, medticks, minticks) = ([], [], [])
+		cosmicruler.autosubtickmaker(a, majticks, medticks, minticks, type=type, transf=None)
+	benchmark(run)
+
+
+@pytest.mark.parametrize("n", TICKSIZES)
+def test_clean(benchmark, n):
+	benchmark.pedantic(lambda scale: scale.clean(), setup=lambda: ((filledscale(n),), {}), rounds=20)
+
+
+@pytest.mark.parametrize("n", TICKSIZES)
+def test_apply_zptrans(benchmark, n):
+	zptrans = cosmicruler.ZPTrans(0.0, 2.0, "sqrt")
+	benchmark.pedantic(lambda scale: scale.apply_zptrans(zptrans), setup=lambda: ((filledscale(n),), {}), rounds=20)
+
+
+@pytest.mark.parametrize("l", [1000.0, 10000.0, 100000.0])
+def test_autoticks(benchmark, l):
+	import autoticks
+	zptrans = cosmicruler.ZPTrans(0.0, 2.0, "sqrt")
+	lookback = lambda z: 13.8 * (1.0 - 1.0 / (1.0 + z)**1.5) # smooth stand-in for a lookback time, without astropy
+	benchmark(autoticks.autoticks, lookback, zptrans, l)
@@ -1,49 +1,204 @@
 """
 Writes a cosmic ruler in SVG
 github.com/mtewes/cosmicruler
+
+Only numpy is imported with this module: astropy, svgwrite and the other modules get imported when they are
+first needed. Cosmologies and renderers are looked up by name in registries (see registercosmology and
+registerrenderer), whose entries can be "module:attribute" strings, so that registering costs no import.
 """
 
-import svgwrite
-import astropy.units as u
-from astropy.cosmology import Planck15 as cosmo
-from astropy.cosmology import z_at_value
 import numpy as np
 
+import os
 import logging
+import importlib
+
+import profiling
+
+
+def identity(x):
+	return x
+
+
+def resolve(target):
+	"""Object designated by a "module:attribute" string (imported now), anything else is returned as it is"""
+	if not isinstance(target, str):
+		return target
+	(modulename, attribute) = target.split(":")
+	return getattr(importlib.import_module(modulename), attribute)
+
+
+# Cosmologies, by name. Names that are not registered are looked up in the astropy realizations (Planck15, WMAP9...)
+COSMOLOGIES = {}
+
+def registercosmology(name, target):
+	"""Registers a cosmology: an astropy cosmology, a function returning one, or a "module:attribute" string of either"""
+	COSMOLOGIES[name] = target
+
+def getcosmology(name="Planck15"):
+	"""Cosmology registered under name, or astropy realization of that name
+	
+	name can also be a dict such as {"base": "Planck15", "Om0": 0.3, "w0": -0.9}, giving the base cosmology
+	(default Planck15) with some parameters changed, see derivecosmology.
+	"""
+	if isinstance(name, dict):
+		params = dict(name)
+		return derivecosmology(getcosmology(params.pop("base", "Planck15")), **params)
+	if name in COSMOLOGIES:
+		cosmo = resolve(COSMOLOGIES[name])
+		if callable(cosmo) and not hasattr(cosmo, "H0"): # a factory
+			cosmo = cosmo()
+		return cosmo
+	import astropy.cosmology
+	if name not in astropy.cosmology.realizations.available:
+		raise ValueError("Unknown cosmology {}, registered are {} and astropy has {}".format(
+			name, sorted(COSMOLOGIES), astropy.cosmology.realizations.available))
+	return getattr(astropy.cosmology, name)
+
+def derivecosmology(base, **params):
+	"""Copy of an astropy FLRW cosmology with some parameters changed, w0 and wa turn a LambdaCDM into a w0waCDM"""
+	names = getattr(base, "parameters", None) or getattr(base, "__parameters__", ())
+	if all(param in names for param in params):
+		return base.clone(**params)
+	import astropy.cosmology
+	flat = isinstance(base, astropy.cosmology.FlatFLRWMixin)
+	kwargs = dict(H0=base.H0, Om0=base.Om0, Tcmb0=base.Tcmb0, Neff=base.Neff, m_nu=base.m_nu,
+		w0=getattr(base, "w0", -1.0), wa=getattr(base, "wa", 0.0))
+	if base.Ob0 is not None:
+		kwargs["Ob0"] = base.Ob0
+	if not flat:
+		kwargs["Ode0"] = base.Ode0
+	kwargs.update(params)
+	return (astropy.cosmology.Flatw0waCDM if flat else astropy.cosmology.w0waCDM)(**kwargs)
+
+
+# Renderers of a layout.RulerLayout to a file, called as renderer(lay, filepath, **kwargs), by name
+RENDERERS = {
+	"svg": "svgstream:renderfile",
+	"svgwrite": "layout:svgwritefile",
+	"png": "pngrender:renderfile",
+	"pdf": "pdfrender:renderfile",
+}
+RENDEREREXTENSIONS = {".svg": "svg", ".svgz": "svg", ".png": "png", ".pdf": "pdf"} # default renderer by file extension
+
+def registerrenderer(name, target, extensions=()):
+	"""Registers a renderer (a function or a "module:function" string), optionally as default for the given file extensions"""
+	RENDERERS[name] = target
+	for extension in extensions:
+		RENDEREREXTENSIONS[extension] = name
+
+def render(lay, filepath, backend=None, **kwargs):
+	"""Writes a layout.RulerLayout to filepath, with the renderer backend (by default chosen from the file extension)"""
+	if backend is None:
+		extension = os.path.splitext(filepath)[1].lower()
+		if extension not in RENDEREREXTENSIONS:
+			raise ValueError("No renderer for {} files, known are {}".format(extension, sorted(RENDEREREXTENSIONS)))
+		backend = RENDEREREXTENSIONS[extension]
+	if backend not in RENDERERS:
+		raise ValueError("Unknown renderer {}, known are {}".format(backend, sorted(RENDERERS)))
+	with profiling.stage("render." + backend):
+		return resolve(RENDERERS[backend])(lay, filepath, **kwargs)
 
 
 class ZPTrans(object):
 	"""Class defining the transformation between redshift z and the relative position p.
+
+	The kernels are resolved once at construction: p is an affine function of fct(z / a), where fct
+	depends on the type. Both z() and p() take and return float64 arrays (or scalars).
 	"""
-	def __init__(self, zmin=0.0, zmax=2.0, type="lin"):
+	def __init__(self, zmin=0.0, zmax=2.0, type="lin", fct=None, invfct=None, a=1.0):
 		"""
-		zmax : redshift is linear from 0 (p=0) to zmax (p=1)
+		zmin, zmax : redshifts at p=0 and p=1
+		type :
+			"lin" : p is linear in z
+			"log" : p is linear in log(z) (zmin must be positive)
+			"sqrt" : p is linear in sqrt(z)
+			"asinh" : p is linear in asinh(z/a), so linear for z << a and logarithmic for z >> a
+			"fct" : p is linear in fct(z), where fct is any monotonic function with an analytic inverse invfct
+		a : scale of the "asinh" type
+		
+		To combine several types, see PiecewiseZPTrans.
 		"""
 		self.zmin = zmin
 		self.zmax = zmax
 		self.type = type
+		self.zscale = 1.0
 		
+		if type == "lin":
+			(fct, invfct) = (identity, identity)
+		elif type == "log":
+			(fct, invfct) = (np.log, np.exp)
+		elif type == "sqrt":
+			(fct, invfct) = (np.sqrt, np.square)
+		elif type == "asinh":
+			(fct, invfct) = (np.arcsinh, np.sinh)
+			self.zscale = 1.0 / a
+		elif type == "fct":
+			if fct is None or invfct is None:
+				raise ValueError("The fct type needs both fct and invfct")
+		else:
+			raise ValueError("Unknown ZPTrans type '{}'".format(type))
+		
+		self.fct = fct
+		self.invfct = invfct
+		self.f0 = float(fct(zmin * self.zscale))
+		self.span = float(fct(zmax * self.zscale)) - self.f0
+		if not np.isfinite(self.f0) or not np.isfinite(self.span) or self.span == 0.0:
+			raise ValueError("Invalid range [{}, {}] for ZPTrans type '{}'".format(zmin, zmax, type))
+
+	def z(self, p):
+		"""redshift z corresponding to p"""
+		return self.invfct(np.asarray(p, dtype=np.float64) * self.span + self.f0) / self.zscale
 	
-		self.fct = np.sqrt
-		self.invfct = np.square
+	def p(self, z):
+		"""relative position p corresponding to redshift z"""
+		return (self.fct(np.asarray(z, dtype=np.float64) * self.zscale) - self.f0) / self.span
 
+
+class PiecewiseZPTrans(object):
+	"""Transformation between z and p made of consecutive ZPTrans, e.g. linear at low redshift and logarithmic above.
+	
+	It has the same interface as ZPTrans.
+	"""
+	def __init__(self, zbreaks, types, pbreaks=None):
+		"""
+		zbreaks : increasing redshifts delimiting the pieces, from zmin to zmax
+		types : the ZPTrans type of each piece (one less than zbreaks)
+		pbreaks : positions p of the zbreaks, from 0 to 1. By default, all pieces get the same length.
+		"""
+		if len(types) != len(zbreaks) - 1:
+			raise ValueError("Need one type per piece, so one less than zbreaks")
+		if pbreaks is None:
+			pbreaks = np.linspace(0.0, 1.0, len(zbreaks))
+		if len(pbreaks) != len(zbreaks):
+			raise ValueError("pbreaks and zbreaks must have the same length")
+		self.zbreaks = np.asarray(zbreaks, dtype=np.float64)
+		self.pbreaks = np.asarray(pbreaks, dtype=np.float64)
+		self.types = types
+		self.zmin = self.zbreaks[0]
+		self.zmax = self.zbreaks[-1]
+		self.pieces = [ZPTrans(zbreaks[i], zbreaks[i+1], type) for (i, type) in enumerate(types)]
+	
+	def _apply(self, x, breaks, fctname, outbreaks):
+		x = np.asarray(x, dtype=np.float64)
+		i = np.clip(np.searchsorted(breaks, x, side="right") - 1, 0, len(self.pieces) - 1)
+		out = np.empty_like(x)
+		for (k, piece) in enumerate(self.pieces):
+			sel = i == k
+			local = getattr(piece, fctname)
+			if fctname == "p":
+				out[sel] = outbreaks[k] + local(x[sel]) * (outbreaks[k+1] - outbreaks[k])
+			else:
+				out[sel] = local((x[sel] - breaks[k]) / (breaks[k+1] - breaks[k]))
+		return out
+	
 	def z(self, p):
 		"""redshift z corresponding to p"""
-		if self.type == "lin":
-			return np.asarray(p) * (self.zmax - self.zmin) + self.zmin
-		if self.type == "log":
-			return np.exp( np.asarray(p) * (np.log(self.zmax / self.zmin)) + np.log(self.zmin) )
-		if self.type == "sqrt":
-			return self.invfct(np.asarray(p) * (self.fct(self.zmax) - self.fct(self.zmin)) + self.fct(self.zmin))
+		return self._apply(p, self.pbreaks, "z", self.zbreaks)
 	
 	def p(self, z):
 		"""relative position p corresponding to redshift z"""
-		if self.type == "lin":
-			return (np.asarray(z) - self.zmin) / (self.zmax - self.zmin)
-		if self.type == "log":
-			return np.log(np.asarray(z) / self.zmin) / np.log(self.zmax / self.zmin)
-		if self.type == "sqrt":
-			return (self.fct(np.asarray(z)) - self.fct(self.zmin)) / (self.fct(self.zmax) - self.fct(self.zmin))
+		return self._apply(z, self.zbreaks, "p", self.pbreaks)
 
 
 def subticks(a, n=2):
@@ -51,90 +206,348 @@ def subticks(a, n=2):
 	
 	Example: a = [1, 2, 3], n=2 returns [1.5, 2.5]
 	"""
-	output = []
-	asorted = sorted(a)
-	for i in range(len(a)-1):
-		output.extend(np.linspace(asorted[i], asorted[i+1], n+1)[1:-1])
-	#return np.array(output)	
-	return output
+	asorted = np.sort(np.asarray(a, dtype=np.float64))
+	step = np.diff(asorted) / n
+	# Same values as np.linspace(a[i], a[i+1], n+1)[1:-1] for each interval, all at once
+	return (asorted[:-1, np.newaxis] + np.arange(1, n) * step[:, np.newaxis]).ravel().tolist()
+
+
+# Subtick types of autosubticks: (scaling, fractions of the medticks, fractions of the minticks).
+# For "lin", the fractions are of each interval, for "log" they are factors of the lower end of each decade.
+SUBTICKTYPES = {
+	"lin2": ("lin", [0.5], []),
+	"lin3": ("lin", [1.0/3.0, 2.0/3.0], []),
+	"lin5": ("lin", [0.2, 0.4, 0.6, 0.8], []),
+	"lin210": ("lin", [0.2, 0.4, 0.5, 0.6, 0.8], [0.1, 0.2, 0.3, 0.4, 0.6, 0.7, 0.8, 0.9]),
+	"log2": ("log", [5.0], []),
+	"log10": ("log", [], [2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 9.0]),
+	"log210": ("log", [5.0], [2.0, 3.0, 4.0, 6.0, 7.0, 8.0, 9.0]),
+}
+
+
+def subticktype(type):
+	"""(scaling, medfractions, minfractions) of a subtick type, which is a name of SUBTICKTYPES, None (no subticks),
+	a list of fractions of the intervals for medticks, or a dict with lists "med" and "min" of such fractions"""
+	if type is None:
+		return ("lin", [], [])
+	if isinstance(type, str):
+		if type not in SUBTICKTYPES:
+			raise ValueError("Unknown subtick type {}, known are {}".format(type, ", ".join(SUBTICKTYPES)))
+		return SUBTICKTYPES[type]
+	if isinstance(type, dict):
+		return ("lin", list(type.get("med", [])), list(type.get("min", [])))
+	return ("lin", list(type), [])
+
+
+def applytransf(transf, values):
+	"""Calls transf once on the array of values, or once per value if transf only takes scalars.
+	Returns (results, failed), with NaN results where the boolean mask failed is True."""
+	values = np.asarray(values, dtype=np.float64)
+	try:
+		out = np.asarray(transf(values), dtype=np.float64)
+		if out.shape != values.shape:
+			raise ValueError("transf gave shape {} for {}".format(out.shape, values.shape))
+	except Exception:
+		out = np.empty(len(values))
+		for (i, value) in enumerate(values.tolist()):
+			try:
+				out[i] = transf(value)
+			except Exception:
+				out[i] = np.nan
+	return (out, ~np.isfinite(out))
+
+
+def autosubticks(a, type="lin2", transf=None):
+	"""Major ticks at the values of a and subticks in their intervals, according to type (see subticktype), as arrays
 	
+	Returns (pos, cls, failed): the positions transformed by transf (called once on all of them), their classes
+	(MAJ, MED or MIN), and the boolean mask of the positions where transf failed (whose pos are NaN).
+	Subticks on top of each other or on the values of a are left to Scale.clean.
+	"""
+	(scaling, medfracs, minfracs) = subticktype(type)
+	asorted = np.sort(np.asarray(a, dtype=np.float64))
+	(lo, hi) = (asorted[:-1, np.newaxis], asorted[1:, np.newaxis])
+	fracs = np.asarray(list(medfracs) + list(minfracs), dtype=np.float64)
+	
+	if scaling == "log":
+		if len(fracs) > 0 and not np.all(np.isclose(hi, 10.0 * lo)):
+			raise RuntimeError("Fishy log auto subticks")
+		sub = lo * fracs
+	else:
+		sub = lo * (1.0 - fracs) + hi * fracs # exact at the ends of the intervals, and halves are exactly 0.5*(lo + hi)
+	subcls = np.repeat(np.array([MED, MIN], dtype=np.uint8), [len(medfracs), len(minfracs)])
+	
+	values = np.concatenate((asorted, sub.ravel()))
+	cls = np.concatenate((np.full(len(asorted), MAJ, dtype=np.uint8), np.tile(subcls, len(sub))))
+	if transf is None:
+		return (values, cls, np.zeros(len(values), dtype=bool))
+	(pos, failed) = applytransf(profiling.wrap(transf, "autosubtickmaker.transf"), values)
+	return (pos, cls, failed)
+
 
 def autosubtickmaker(a, majticks, medticks, minticks, type="lin2", transf=None):
 	"""For each interval between the major ticks in array a, I append medticks and minticks to the given lists, according to type.
 	
-	I also add elements of a to the majticks
-	
-	The function pays attention not to place subticks on top of each other or on positions of a.
+	I also add elements of a to the majticks. Ticks on which transf fails are skipped (with a warning).
+	Returns the mask of the failed ticks (see autosubticks).
+	"""
+	(pos, cls, failed) = autosubticks(a, type, transf)
+	if np.any(failed):
+		logging.warning("transf failed on {} of {} auto ticks, they are skipped".format(np.sum(failed), len(failed)))
+	for (ticks, tickcls) in ((majticks, MAJ), (medticks, MED), (minticks, MIN)):
+		ticks.extend(pos[(cls == tickcls) & ~failed].tolist())
+	return failed
+		
+
+def dedupmask(pos, priority=None, atol=1.0e-8, rtol=1.0e-5):
 	"""
+	Returns a boolean mask of the positions to keep, so that no two kept positions are "close" (in the sense of np.isclose).
 	
+	The positions are sorted once and grouped into clusters of neighbours closer than the tolerance.
+	In each cluster, the entry with the lowest priority number (e.g., the tick class, so that major ticks win)
+	is kept, and among equals the one that comes first in pos. Non-finite positions are never kept.
+	"""
+	pos = np.asarray(pos, dtype=np.float64)
+	n = len(pos)
+	if priority is None:
+		priority = np.zeros(n, dtype=np.uint8)
+	keep = np.zeros(n, dtype=bool)
+	if n == 0:
+		return keep
+	
+	order = np.argsort(pos, kind="stable")
+	spos = pos[order]
+	newcluster = np.ones(n, dtype=bool)
+	newcluster[1:] = np.abs(np.diff(spos)) > atol + rtol * np.abs(spos[1:])
+	cluster = np.cumsum(newcluster)
+	
+	# Sort by cluster, then priority, then original index, and keep the first of each cluster
+	best = np.lexsort((order, np.asarray(priority)[order], cluster))
+	first = np.ones(n, dtype=bool)
+	first[1:] = cluster[best][1:] != cluster[best][:-1]
+	keep[order[best[first]]] = True
+	keep[~np.isfinite(pos)] = False
+	return keep
+
+
+def remove_duplicates(l, atol=1.0e-8, rtol=1.0e-5):
+	"""
+	Returns a sorted list of the values of l, without (close) duplicates
+	"""
+	l = np.asarray(l, dtype=np.float64)
+	return np.sort(l[dedupmask(l, atol=atol, rtol=rtol)]).tolist()
+
+def remove_duplicate_labels(labels, atol=1.0e-8, rtol=1.0e-5):
+	"""
+	Similar, but for (pos, label) tuples, keeping the first label at each position, in the original order.
+	We can't use the label text for identifactino, as they might appear several times on non-monotonous scales...
+	"""
+	keep = dedupmask([pos for (pos, text) in labels], atol=atol, rtol=rtol)
+	return [label for (label, k) in zip(labels, keep) if k]
+
+
+# Classes of the entries of a TickTable
+MAJ = 0
+MED = 1
+MIN = 2
+LABEL = 3
+TICKCLASSES = {"maj":MAJ, "med":MED, "min":MIN, "label":LABEL}
+
+
+class TickTable(object):
+	"""Columnar storage of the ticks and labels of a Scale
 	
-	if transf is None: # We set it to identity
-		transf = lambda x: x
+	All entries are in one float64 position array, with a uint8 array giving their class (MAJ, MED, MIN or LABEL)
+	and an int32 array giving, for labels, the index of their text in the string table texts (-1 for ticks).
+	The arrays are kept sorted by class (stably, so within a class the order of insertion is preserved),
+	so that the positions of each class are a zero-copy view. Such views get invalid when the table is modified.
+	"""
+	__slots__ = ("pos", "cls", "labelidx", "n", "texts", "textindex", "sortedbyclass")
 	
-	asorted = sorted(a)
+	def __init__(self, capacity=64):
+		self.pos = np.empty(capacity, dtype=np.float64)
+		self.cls = np.empty(capacity, dtype=np.uint8)
+		self.labelidx = np.empty(capacity, dtype=np.int32)
+		self.n = 0
+		self.texts = []
+		self.textindex = {}
+		self.sortedbyclass = True
 	
-	for aitem in asorted:
-		try:
-			majticks.append(transf(aitem))
-		except:
-			logging.warning("transf failed on a majtick, but no prob")
-			pass
+	def __len__(self):
+		return self.n
 	
-	for i in range(len(asorted)-1):
-		
-		if type is "lin2" or type is "lin210": # medtick at half step
-			medticks.append(transf(0.5 * (asorted[i] +  asorted[i+1])))
-			
-		if type is "lin210": # minticks at tenth of step
-			for s in [0.1, 0.2, 0.3, 0.4, 0.6, 0.7, 0.8, 0.9]:
-				minticks.append(transf(asorted[i] + s * (asorted[i+1] - asorted[i])))
-
-		if type is "lin5" or type is "lin210": # minticks at fifths of step
-			for s in [0.2, 0.4, 0.6, 0.8]:
-				medticks.append(transf(asorted[i] + s * (asorted[i+1] - asorted[i])))
-
-		if type is "log10": # minticks at 8 positions equispaced between the two (not the extrema, so 2, 3, 4, 5, 6, 7, 8, 9)
-			if not np.isclose(asorted[i+1], 10*asorted[i]):
-				raise RuntimeError("Fishy log auto subticks")
-			for s in np.linspace(2.0, 9.0, 8):		
-				minticks.append(transf(s * asorted[i]))
-		
+	@classmethod
+	def fromarrays(cls, pos, clss, labelidx, texts):
+		"""Table holding copies of the given arrays (as returned by arrays()) and string table"""
+		table = cls(capacity=len(pos))
+		table.pos[:] = pos
+		table.cls[:] = clss
+		table.labelidx[:] = labelidx
+		table.n = len(pos)
+		table.texts = list(texts)
+		table.textindex = dict((text, i) for (i, text) in enumerate(table.texts))
+		table.sortedbyclass = bool(np.all(np.diff(table.cls) >= 0))
+		return table
+	
+	def reserve(self, n):
+		"""Makes room for n entries, growing the buffers geometrically"""
+		if n <= len(self.pos):
+			return
+		capacity = max(n, 2 * len(self.pos))
+		for name in ("pos", "cls", "labelidx"):
+			old = getattr(self, name)
+			new = np.empty(capacity, dtype=old.dtype)
+			new[:self.n] = old[:self.n]
+			setattr(self, name, new)
+	
+	def textid(self, text):
+		"""Index of text in the string table, adding it if needed"""
+		if text not in self.textindex:
+			self.textindex[text] = len(self.texts)
+			self.texts.append(text)
+		return self.textindex[text]
+	
+	def extend(self, cls, positions, texts=None):
+		"""Appends entries of class cls at the given positions. For labels, texts gives their texts."""
+		positions = np.asarray(positions, dtype=np.float64).ravel()
+		k = len(positions)
+		if k == 0:
+			return
+		self.reserve(self.n + k)
+		(a, b) = (self.n, self.n + k)
+		self.pos[a:b] = positions
+		self.cls[a:b] = cls
+		if texts is None:
+			if cls == LABEL:
+				raise ValueError("Labels need texts")
+			self.labelidx[a:b] = -1
+		else:
+			if len(texts) != k:
+				raise ValueError("Got {} positions but {} texts".format(k, len(texts)))
+			self.labelidx[a:b] = [self.textid(text) for text in texts]
+		if a > 0 and cls < self.cls[a-1]:
+			self.sortedbyclass = False
+		self.n = b
+	
+	def sort(self):
+		"""Stable sort of the entries by class"""
+		if self.sortedbyclass:
+			return
+		order = np.argsort(self.cls[:self.n], kind="stable")
+		for name in ("pos", "cls", "labelidx"):
+			array = getattr(self, name)
+			array[:self.n] = array[:self.n][order]
+		self.sortedbyclass = True
+	
+	def slice(self, cls):
+		"""Index range (a, b) of the entries of class cls"""
+		self.sort()
+		cls = np.uint8(cls)
+		used = self.cls[:self.n]
+		return (np.searchsorted(used, cls, side="left"), np.searchsorted(used, cls, side="right"))
+	
+	def positions(self, cls):
+		"""Zero-copy view of the positions of class cls"""
+		(a, b) = self.slice(cls)
+		return self.pos[a:b]
+	
+	def labeltexts(self):
+		"""List of the texts of the labels, in the same order as positions(LABEL)"""
+		(a, b) = self.slice(LABEL)
+		return [self.texts[i] for i in self.labelidx[a:b]]
+	
+	def arrays(self):
+		"""Views (pos, cls, labelidx) on all entries, sorted by class"""
+		self.sort()
+		return (self.pos[:self.n], self.cls[:self.n], self.labelidx[:self.n])
+	
+	def keep(self, mask):
+		"""Keeps only the entries for which the boolean mask (over all entries, sorted by class) is True"""
+		self.sort()
+		mask = np.asarray(mask, dtype=bool)
+		k = int(np.count_nonzero(mask))
+		for name in ("pos", "cls", "labelidx"):
+			array = getattr(self, name)
+			array[:k] = array[:self.n][mask]
+		self.n = k
+	
+	def clear(self, cls):
+		"""Removes all entries of class cls"""
+		(a, b) = self.slice(cls)
+		mask = np.ones(self.n, dtype=bool)
+		mask[a:b] = False
+		self.keep(mask)
+	
+	def transform(self, fct):
+		"""Applies fct (e.g., zptrans.p) to all positions at once, in place"""
+		self.pos[:self.n] = fct(self.pos[:self.n])
 
-def remove_duplicates(l):
-	"""
+
+def tickextent(y0, lw=0.5, tickl=8.0, switchside=False, ticktype=1):
+	"""Vertical extent of the ticks of a scale drawn at y0, for all renderers
 	
+	Returns a dict giving, for MAJ, MED and MIN, the tuple (ya, yb) of svg y coordinates of the tick ends.
 	"""
-	if len(l) < 2:
-		return l
-	s = sorted(l)
-	out = []
-	out.append(s[0])
-	for item in s[1:]:
-		if not np.isclose(item, out[-1]):
-			out.append(item)
-	return out
-
-def remove_duplicate_labels(labels):
-	"""
-	Similar, but for (pos, label) tuples
-	We can't use the label text for identifactino, as they might appear several times on non-monotonous scales...
+	if switchside:
+		signedtickl = - tickl
+	else:
+		signedtickl = tickl
+	
+	if ticktype == 1:
+		fractions = (1.0, 0.75, 0.5)
+	elif ticktype == 2:
+		fractions = (1.0, 0.666, 0.333)
+	else:
+		raise RuntimeError("Unknown ticktype")
+	
+	ya = y0-lw/2.0
+	return dict((cls, (ya, y0+fraction*signedtickl)) for (cls, fraction) in zip((MAJ, MED, MIN), fractions))
+
+
+def labelplacement(y0, tickl=8.0, labelspace=3.0, rotatelabels=False, switchside=False):
+	"""svg y position and text-anchor of the labels of a scale drawn at y0
+	
+	Rotated labels have alignment-baseline "central" and get rotated by -90 degrees around their insertion point,
+	the others are centered with alignment-baseline "hanging".
 	"""
-	out = []
-	out.append(labels[0])
-	for item in labels[1:]:
-		isnew = True
-		for outitem in out:
-			if np.isclose(item[0], outitem[0]):
-				isnew = False
-		if isnew:
-			out.append(item)
-	return out
+	if switchside:
+		y = y0-tickl-labelspace
+	else:
+		y = y0+tickl+labelspace
+	if not rotatelabels:
+		return (y, "middle")
+	if switchside:
+		return (y, "start")
+	return (y, "end")
 
 
+def titleplacement(y0, titlespace=5.0, switchside=False, textshifty=0.0):
+	"""svg y position and alignment-baseline of the title of a scale drawn at y0"""
+	if switchside:
+		return (y0+titlespace + textshifty, "hanging")
+	return (y0-titlespace + textshifty, "auto")
+
+
+def tickclassproperty(cls):
+	"""Property giving the array of positions of the ticks of class cls of a Scale (setting it replaces them)"""
+	def get(self):
+		return self.ticks.positions(cls)
+	def set(self, values):
+		self.ticks.clear(cls)
+		self.ticks.extend(cls, values)
+	return property(get, set)
+
 
 class Scale(object):
-	"""Object to group all the information needed to draw a scale"""
+	"""Object to group all the information needed to draw a scale
 	
+	The ticks and labels are stored in a TickTable, the attributes majticks, medticks and minticks give
+	(zero-copy) arrays of their positions, and labels gives a tuple of (position, text) tuples.
+	To add ticks or labels, use addticks(), addlabels() or addautosubticks().
+	"""
+	__slots__ = ("name", "title", "extras", "ticks")
+	
+	@profiling.timed("Scale.__init__")
 	def __init__(self, name="scale", majticks=None, medticks=None, minticks=None, labels=None, title="Scale", extras=None):
 		"""
 		Object to store what is needed to draw a scale.
@@ -155,21 +568,18 @@ class Scale(object):
 		"""
 		
 		self.name = name
-		self.majticks = majticks
-		self.medticks = medticks
-		self.minticks = minticks
-		self.labels = labels
 		self.title = title
 		self.extras = extras
+		self.ticks = TickTable()
 		
-		if self.majticks is None:
-			self.majticks = []
-		if self.medticks is None:
-			self.medticks = []
-		if self.minticks is None:
-			self.minticks = []
-		if self.labels is None:
-			self.labels = []
+		if majticks is not None:
+			self.addticks(majticks, "maj")
+		if medticks is not None:
+			self.addticks(medticks, "med")
+		if minticks is not None:
+			self.addticks(minticks, "min")
+		if labels is not None:
+			self.labels = labels
 	
 	
 	def __str__(self):
@@ -182,23 +592,71 @@ class Scale(object):
 		""".format(self=self)
 	
 	
+	def addticks(self, values, kind="maj"):
+		"""Adds ticks at the given positions, kind is "maj", "med" or "min" """
+		self.ticks.extend(TICKCLASSES[kind], values)
+	
+	def addlabels(self, values, texts):
+		"""Adds labels with the given texts at the given positions"""
+		self.ticks.extend(LABEL, values, list(texts))
+	
+	
+	majticks = tickclassproperty(MAJ)
+	medticks = tickclassproperty(MED)
+	minticks = tickclassproperty(MIN)
+	
+	@property
+	def labels(self):
+		return tuple(zip(self.ticks.positions(LABEL).tolist(), self.ticks.labeltexts()))
+	
+	@labels.setter
+	def labels(self, labels):
+		self.ticks.clear(LABEL)
+		self.ticks.extend(LABEL, [value for (value, text) in labels], [text for (value, text) in labels])
+	
+	
 	def apply_zptrans(self, zptrans):
 		"""
-		Transforms all "positions" from z to p
+		Transforms all "positions" from z to p, in one call of zptrans.p on the position array
 		"""
-		self.majticks = [zptrans.p(value) for value in self.majticks]
-		self.medticks = [zptrans.p(value) for value in self.medticks]
-		self.minticks = [zptrans.p(value) for value in self.minticks]
-		self.labels = [(zptrans.p(value), text) for (value, text) in self.labels]
-		
+		self.ticks.transform(zptrans.p)
 		if self.extras is not None:
 			if "peak" in self.extras:
-				self.extras["peak"] = (zptrans.p(self.extras["peak"][0]), self.extras["peak"][1])
+				self.extras["peak"] = (float(zptrans.p(self.extras["peak"][0])), self.extras["peak"][1])
 			
 	
 	def addautosubticks(self, a, type, transf=None):
-		autosubtickmaker(a, self.majticks, self.medticks, self.minticks, type=type, transf=transf)
-		
+		"""Adds major ticks at the values a and subticks of the given type between them (see autosubticks)"""
+		(pos, cls, failed) = autosubticks(a, type, transf)
+		if np.any(failed):
+			logging.warning("Scale {}: transf failed on {} of {} auto ticks, they are skipped".format(self.name, np.sum(failed), len(failed)))
+		for tickcls in (MAJ, MED, MIN):
+			self.ticks.extend(tickcls, pos[(cls == tickcls) & ~failed])
+
+	def addautoticks(self, fct, zptrans, l, unit=None, minspacing=4.0, labelspacing=40.0, mantissa=5, fmt="{:g}", labels=True):
+		"""
+		Adds nice ticks (in redshift) of the quantity fct(z), chosen by autoticks.autoticks from their spacing on a ruler
+		of length l with this zptrans, and labels (formatted with fmt) at the major ticks.
+		"""
+		import autoticks # here, as the autoticks module uses this one
+		(values, z, cls) = autoticks.autoticks(fct, zptrans, l, unit=unit,
+			minspacing=minspacing, labelspacing=labelspacing, mantissa=mantissa)
+		for tickcls in (MAJ, MED, MIN):
+			self.ticks.extend(tickcls, z[cls == tickcls])
+		if labels:
+			self.addlabels(z[cls == MAJ], [fmt.format(value) for value in values[cls == MAJ].tolist()])
+
+
+	def addpeak(self, inverter, fmt="{}", index=0):
+		"""
+		Sets extras["peak"] to the position (in redshift) of an extremum found by a cosmoinv.BranchedInverter,
+		labelled with the value of the extremum formatted by fmt.
+		"""
+		(zpeak, valpeak) = inverter.peak(index)
+		if self.extras is None:
+			self.extras = {}
+		self.extras["peak"] = (zpeak, fmt.format(valpeak))
+
 	
 	
 	@classmethod
@@ -212,18 +670,32 @@ class Scale(object):
 		return scale
 		
 	
-	def clean(self):
-		"""
-		Removes duplicates
+	def clean(self, atol=1.0e-8, rtol=1.0e-5):
 		"""
-		self.majticks = remove_duplicates(self.majticks)
+		Removes duplicates, in one sort-based pass over each of the ticks and the labels:
+		- of ticks closer than the tolerance, only the one of the highest class is kept (e.g., a major tick wins over a minor one)
+		- of labels closer than the tolerance, only the first one is kept
+		Ticks and labels at non-finite positions (e.g., failed transformations) are also removed.
 		
-		self.labels = remove_duplicate_labels(self.labels)
+		Returns a dict giving the arrays of dropped positions for "maj", "med", "min" and "label".
+		"""
+		(pos, cls, labelidx) = self.ticks.arrays()
+		keep = np.empty(len(pos), dtype=bool)
+		islabel = cls == LABEL
+		keep[~islabel] = dedupmask(pos[~islabel], cls[~islabel], atol, rtol)
+		keep[islabel] = dedupmask(pos[islabel], None, atol, rtol)
 		
+		dropped = dict((kind, pos[np.logical_and(cls == tickcls, ~keep)].copy()) for (kind, tickcls) in TICKCLASSES.items())
+		if not np.all(keep):
+			logging.debug("Scale '{}': clean() dropped {}".format(self.name,
+				", ".join("{} {}".format(len(values), kind) for (kind, values) in dropped.items() if len(values) > 0)))
+		self.ticks.keep(keep)
+		return dropped
 		
 		
 	
 		
+	@profiling.timed("simpledraw")
 	def simpledraw(self, dwg, x0, y0, l, 
 		lw=0.5, tickl=8.0, 
 		labelspace=3.0, titlespace=5.0, labelstyle=None, titlestyle=None,
@@ -238,161 +710,17 @@ class Scale(object):
 		textxshift and textyshift are there to "hack" the text positions in case the
 		"text alignment" is not understood by your SVG reader (e.g., Inkscape)
 		
-		
+		The coordinates are computed by a layout.RulerLayout, see there to save them or use other renderers.
 		"""
 		
-		self.clean()
-		
-		
-		if labelstyle is None:
-			labelstyle = "font-size:10;font-family:Helvetica Neue"
-			
-		if titlestyle is None:
-			titlestyle = "font-size:12;font-family:CMU Serif"
-		
+		import layout # here, as the layout module uses this one
 		
-		def xtrans(p):
-			"""Transforms p into the svg position x
-			"""
-			#assert np.alltrue(p >= 0)
-			#assert np.alltrue(p <= 1)
-			return x0 + np.asarray(p) * l
-
-			
-		# A group for the scale
-		scaleg = dwg.add(dwg.g(id=self.name+'-scale'))
-	
-	
-		# Drawing the main line
-		scaleg.add(dwg.line(start=(x0-lw/2.0, y0), end=(x0+l+lw/2.0, y0), style="stroke:black;stroke-width:{}".format(lw)))
-	
-		# Groups for ticks
-		majticksg = scaleg.add(dwg.g(id=self.name+'-majticks'))
-		majticksg.stroke('black', width=lw)
-		medticksg = scaleg.add(dwg.g(id=self.name+'-medticks'))
-		medticksg.stroke('black', width=lw)
-		minticksg = scaleg.add(dwg.g(id=self.name+'-minticks'))
-		minticksg.stroke('black', width=lw)
-	
-	
-		# Drawing the ticks
-		if switchside:
-			signedtickl = - tickl
-		else:
-			signedtickl = tickl
-		
-		if ticktype is 1:
-			majtickya = y0-lw/2.0
-			majtickyb = y0+signedtickl
-			medtickya = y0-lw/2.0
-			medtickyb = y0+0.75*signedtickl
-			mintickya = y0-lw/2.0
-			mintickyb = y0+0.5*signedtickl
-		elif ticktype is 2:
-			majtickya = y0-lw/2.0
-			majtickyb = y0+signedtickl
-			medtickya = y0-lw/2.0
-			medtickyb = y0+0.666*signedtickl
-			mintickya = y0-lw/2.0
-			mintickyb = y0+0.333*signedtickl
-			
-		else:
-			raise RuntimeError("Unknown ticktype")
-	
-	
-		for x in xtrans(self.majticks):
-			majticksg.add(dwg.line(start=(x, majtickya), end=(x, majtickyb)))
-		for x in xtrans(self.medticks):
-			medticksg.add(dwg.line(start=(x, medtickya), end=(x, medtickyb)))
-		for x in xtrans(self.minticks):
-			minticksg.add(dwg.line(start=(x, mintickya), end=(x, mintickyb)))
-	
-		# Group for the labels
-		# style="font-size:30;font-family:Helvetica, Arial;font-weight:bold;font-style:oblique;stroke:black;stroke-width:1;fill:none"
-		# CMU Serif, Arial
-		labelsg = scaleg.add(
-			dwg.g(id=self.name+'-labels',
-				style=labelstyle
-				)
-			)
-			
-		# Drawing the labels
-		for (p, text) in self.labels:
-			x = xtrans(p) + textshiftx
-			if switchside:
-				y = y0-tickl-labelspace
-			else:
-				y = y0+tickl+labelspace
-				
-			if rotatelabels:
-				if switchside:
-					text_anchor="start"
-				else:
-					text_anchor="end"
-			
-				labelsg.add(
-					dwg.text(text, insert=(x, y),
-						text_anchor=text_anchor, alignment_baseline="central",
-						transform="rotate(-90, {}, {})".format(x, y)
-						)
-					)
-			else:
-				labelsg.add(
-					dwg.text(text, insert=(x, y), 
-						text_anchor="middle", alignment_baseline="hanging")
-					)
-
-	
-		# Drawing the extras, if present
-		if self.extras is not None:
-			if "peak" in self.extras:
-				(peakp, peaklabel) = self.extras["peak"]
-				
-				x = xtrans(peakp)
-				
-				majticksg.add(dwg.line(start=(x, majtickya), end=(x-0.66*tickl, majtickyb)))
-				majticksg.add(dwg.line(start=(x, majtickya), end=(x+0.66*tickl, majtickyb)))
-				
-				xtxt = x + textshiftx
-				
-				if switchside:
-					y = y0-tickl-labelspace
-				else:
-					y = y0+tickl+labelspace
-				
-				if rotatelabels:
-					if switchside:
-						text_anchor="start"
-					else:
-						text_anchor="end"
-			
-					labelsg.add(
-						dwg.text(peaklabel, insert=(xtxt, y),
-							text_anchor=text_anchor, alignment_baseline="central",
-							transform="rotate(-90, {}, {})".format(xtxt, y)
-							)
-						)
-				else:
-					labelsg.add(
-						dwg.text(peaklabel, insert=(xtxt, y), 
-							text_anchor="middle", alignment_baseline="hanging")
-						)
-
-				
-				
-	
-		#And we add a title
-		if switchside:
-			y = y0+titlespace + textshifty
-			alignment_baseline="hanging"
-		else:
-			y = y0-titlespace + textshifty
-			alignment_baseline="auto"
-		titleg = scaleg.add(dwg.g(id=self.name+'-title', text_anchor="start",
-			style=titlestyle))
-		titleg.add(dwg.text(self.title, insert=(x0, y), alignment_baseline=alignment_baseline))
-	
-		return scaleg
+		lay = layout.RulerLayout()
+		lay.addscale(self, x0, y0, l, lw=lw, tickl=tickl,
+			labelspace=labelspace, titlespace=titlespace, labelstyle=labelstyle, titlestyle=titlestyle,
+			rotatelabels=rotatelabels, switchside=switchside, ticktype=ticktype,
+			textshiftx=textshiftx, textshifty=textshifty)
+		return layout.tosvgwrite(lay, dwg)[0]
 	
 
 
@@ -402,6 +730,11 @@ class Scale(object):
 
 def demoruler(filepath="demo.svg"):
 
+		import svgwrite
+		import astropy.units as u
+		import cosmoinv
+		cosmo = getcosmology("Planck15")
+		
 		zptrans = ZPTrans(0.0, 2.0, "sqrt")
 	
 
@@ -429,26 +762,28 @@ def demoruler(filepath="demo.svg"):
 		# Lookback time
 		name = "lbt"
 		title = "Lookback Time [Gyr]"
+		transf = cosmoinv.Inverter(cosmo.lookback_time, u.Gyr)
 		sourceticks = np.arange(1, 10.1, 1)
-		labels = [(z_at_value(cosmo.lookback_time, value * u.Gyr), "{:.0f}".format(value)) for value in sourceticks]
+		labels = list(zip(transf(sourceticks), ["{:.0f}".format(value) for value in sourceticks]))
 		majticks = [value for (value, text) in labels]
 		majticks.append(0.0)
 		labels.append((0.0, "0"))
-		medticks = [z_at_value(cosmo.lookback_time, value * u.Gyr) for value in subticks(sourceticks, 2)]
-		minticks = [z_at_value(cosmo.lookback_time, value * u.Gyr) for value in subticks(sourceticks, 10)]
+		medticks = list(transf(subticks(sourceticks, 2)))
+		minticks = list(transf(subticks(sourceticks, 10)))
 		scale = Scale.fromz(zptrans, name, majticks, medticks, minticks, labels, title)
 		scale.simpledraw(dwg, 50, 40+spacing, 930)
 	
 		# Angular Diam dist
 		name = "angdiam"
 		title = "Angular diameter distance [Gpc]"
+		transf = cosmoinv.Inverter(cosmo.angular_diameter_distance, u.Gpc, zmax=1.5) # left of the peak
 		sourceticks = [0.1, 0.2, 0.4, 0.6, 0.8, 1.0, 1.2, 1.4, 1.6]
-		labels = [(z_at_value(cosmo.angular_diameter_distance, value * u.Gpc, zmax=1.6), "{}".format(value)) for value in sourceticks]
+		labels = list(zip(transf(sourceticks), ["{}".format(value) for value in sourceticks]))
 		majticks = [value for (value, text) in labels]
 		majticks.append(0.0)
 		labels.append((0.0, "0"))
-		medticks = [z_at_value(cosmo.angular_diameter_distance, value * u.Gpc, zmax=1.6) for value in subticks(sourceticks, 2)]
-		minticks = [z_at_value(cosmo.angular_diameter_distance, value * u.Gpc, zmax=1.6) for value in subticks(sourceticks, 10)]
+		medticks = list(transf(subticks(sourceticks, 2)))
+		minticks = list(transf(subticks(sourceticks, 10)))
 		scale = Scale.fromz(zptrans, name, majticks, medticks, minticks, labels, title)
 		scale.simpledraw(dwg, 50, 40+2*spacing, 930)
 	
@@ -457,27 +792,66 @@ def demoruler(filepath="demo.svg"):
 		#textg = dwg.add(dwg.g(id="text", text_anchor="end", style="font-size:12;font-family:CMU Serif"))
 		#textg.add(dwg.text(r"\u039B CDM cosmology, Planck 2015", insert=(980, 180)))
 	
-		dwg.save(pretty=True)
+		with profiling.stage("Drawing.save"):
+			dwg.save(pretty=True)
 	
 	
 
 
+def main(argv=None):
+	"""Command line interface, see python cosmicruler.py --help"""
+	import argparse
+	
+	parser = argparse.ArgumentParser(description="Rulers to measure the universe")
+	parser.add_argument("-v", "--verbose", action="store_true", help="log what is being done")
+	parser.add_argument("--profile", metavar="TRACE", default=None,
+		help="print the time and memory used by each stage, and write them as Chrome trace events to the file TRACE")
+	subparsers = parser.add_subparsers(dest="command")
+	
+	demoparser = subparsers.add_parser("demo", help="draw the demo ruler (default)")
+	demoparser.add_argument("filepath", nargs="?", default="demo.svg", help="svg file to write")
+	
+	buildparser = subparsers.add_parser("build", help="build a ruler from a spec file (toml, yaml or json)")
+	buildparser.add_argument("spec", help="path to the spec file")
+	buildparser.add_argument("-o", "--output", default=None, help="svg file to write, instead of the output given in the spec")
+	buildparser.add_argument("-j", "--processes", type=int, default=None, help="number of processes building scales (default: number of CPUs)")
+	buildparser.add_argument("--no-cache", action="store_true", help="rebuild all scales, without using or filling the scale cache")
+	
+	sweepparser = subparsers.add_parser("sweep", help="build one ruler of a spec file per point of a grid of cosmological parameters")
+	sweepparser.add_argument("spec", help="path to the spec file")
+	sweepparser.add_argument("-g", "--grid", action="append", default=[], metavar="NAME=V1,V2,...",
+		help="values of a parameter of the cosmology (e.g. Om0=0.25,0.3 or w0=-1,-0.9), can be repeated")
+	sweepparser.add_argument("--base", default=None, help="cosmology whose parameters are changed (default: that of each scale)")
+	sweepparser.add_argument("-o", "--output", default=None,
+		help="path of the rulers, formatted with {index}, {params}, {stem} and the parameter names (default: {stem}-{params}.svg)")
+	sweepparser.add_argument("-j", "--processes", type=int, default=None, help="number of processes building rulers (default: number of CPUs)")
+	sweepparser.add_argument("--no-cache", action="store_true", help="rebuild all scales, without using or filling the scale cache")
+	
+	watchparser = subparsers.add_parser("watch", help="build a ruler from a spec file, and rebuild it whenever the spec or its catalogs change")
+	watchparser.add_argument("spec", help="path to the spec file")
+	watchparser.add_argument("-o", "--output", default=None, help="file to write, instead of the output given in the spec")
+	watchparser.add_argument("-i", "--interval", type=float, default=0.5, help="seconds between two checks of the files (default: 0.5)")
+	watchparser.add_argument("--no-cache", action="store_true", help="keep the scales only in memory, without using or filling the scale cache")
+	
+	args = parser.parse_args(argv)
+	verbose = args.verbose or args.command == "watch" # which tells what it rebuilt
+	logging.basicConfig(level=logging.INFO if verbose else logging.WARNING, format="%(levelname)s: %(message)s")
+	
+	with profiling.profile(trace=args.profile) if args.profile else profiling.NULL:
+		if args.command == "build":
+			import ruler # here, as the ruler module uses this one
+			ruler.buildfile(args.spec, output=args.output, processes=args.processes, cache=not args.no_cache)
+		elif args.command == "sweep":
+			import sweep
+			sweep.sweepfile(args.spec, grid=sweep.parsegrid(args.grid), base=args.base, output=args.output,
+				processes=args.processes, cache=not args.no_cache)
+		elif args.command == "watch":
+			import watch
+			watch.watchfile(args.spec, output=args.output, interval=args.interval, cache=not args.no_cache)
+		else:
+			demoruler(getattr(args, "filepath", "demo.svg"))
+
+
 if __name__ == '__main__':
 	
-	
-	majticks = []
-	medticks = []
-	minticks = []
-	
-	autosubtickmaker([1, 2, 3], majticks, medticks, minticks, type="lin")
-	autosubtickmaker([3, 4], majticks, medticks, minticks, type="linmin")
-	autosubtickmaker([10, 100], majticks, medticks, minticks, type="log")
-	
-	print majticks
-	print medticks
-	print minticks
-	
-	
-	demoruler()
-    
-    
\ No newline at end of file
+	main()
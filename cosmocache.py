@@ -0,0 +1,142 @@
+"""
+Persistent on-disk cache of tabulated cosmology functions, to skip the astropy integrations on warm starts.
+github.com/mtewes/cosmicruler
+
+Each table is stored as one .npy file with three rows (z, value, dvalue/dz), which is loaded memory-mapped.
+As the tabulated quantities are monotonic on each branch, the same file serves for the forward function
+(z -> quantity) and its inverse. The file name is a hash of the cosmology parameters, the quantity name,
+the unit and the redshift grid specification.
+"""
+
+import os
+import hashlib
+import contextlib
+import logging
+
+import numpy as np
+
+
+def cachedir():
+	"""Default location of the cache, can be set with the environment variable COSMICRULER_CACHE"""
+	if "COSMICRULER_CACHE" in os.environ:
+		return os.environ["COSMICRULER_CACHE"]
+	return os.path.join(os.path.expanduser("~"), ".cache", "cosmicruler")
+
+
+def cosmoparams(cosmo):
+	"""A string identifying the cosmology by its class and parameter values (but not its name)"""
+	params = getattr(cosmo, "parameters", None)
+	if params is None: # older astropy
+		names = getattr(cosmo, "__parameters__", None)
+		if names is None:
+			return repr(cosmo)
+		params = dict((name, getattr(cosmo, name)) for name in names)
+	items = ["{}={}".format(name, params[name]) for name in sorted(params)]
+	return "{}({})".format(type(cosmo).__name__, ", ".join(items))
+
+
+class TableCache(object):
+	"""Size-bounded directory of cached tables, evicting the least recently used files first."""
+	
+	extension = ".npy"
+
+	def __init__(self, directory=None, maxbytes=200*1024*1024):
+		"""
+		directory : where to store the .npy files (default given by cachedir())
+		maxbytes : once the total size of the cached files exceeds this, old files get deleted
+		"""
+		if directory is None:
+			directory = cachedir()
+		self.directory = directory
+		self.maxbytes = maxbytes
+
+
+	def key(self, cosmo, quantity, unit, grid, method="astropy"):
+		"""Hash identifying a table
+
+		cosmo : astropy cosmology
+		quantity : name of the tabulated quantity, e.g. "lookback_time"
+		unit : unit (or scaling quantity) of the tabulated values
+		grid : tuple describing the redshift grid, e.g. (zmin, zmax, n)
+		method : how the table was computed, "astropy" or "cosmogrid" (see cosmoinv.CosmoGrid)
+		"""
+		spec = "{} | {} | {} | {}".format(cosmoparams(cosmo), quantity, unit, tuple(grid))
+		if method != "astropy": # keeps the keys of the tables cached before there were other methods
+			spec += " | {}".format(method)
+		return hashlib.sha1(spec.encode("utf-8")).hexdigest()
+
+
+	def path(self, key):
+		return os.path.join(self.directory, key + self.extension)
+
+
+	def load(self, key):
+		"""Returns the memory-mapped table (z, value, dvalue/dz) for this key, or None if it is not cached."""
+		filepath = self.path(key)
+		if not os.path.exists(filepath):
+			return None
+		try:
+			table = np.load(filepath, mmap_mode="r")
+		except (IOError, ValueError):
+			logging.warning("Could not read cached table {}, ignoring it".format(filepath))
+			return None
+		os.utime(filepath, None) # marks it as recently used
+		return (table[0], table[1], table[2])
+
+
+	def save(self, key, z, f, d):
+		"""Writes a table to the cache, and evicts old tables if needed"""
+		with self.writing(key) as f_out:
+			np.save(f_out, np.vstack((z, f, d)).astype(np.float64))
+	
+	
+	@contextlib.contextmanager
+	def writing(self, key):
+		"""Context manager giving a binary file handle to write the entry key, which appears atomically once done"""
+		if not os.path.isdir(self.directory):
+			os.makedirs(self.directory)
+		filepath = self.path(key)
+		tmppath = "{}.{}.tmp".format(filepath, os.getpid())
+		with open(tmppath, "wb") as f_out:
+			yield f_out
+		os.replace(tmppath, filepath) # atomic, in case of concurrent writers
+		self.evict()
+
+
+	def files(self):
+		"""List of (last use time, size, path) of the cached tables, oldest first"""
+		if not os.path.isdir(self.directory):
+			return []
+		out = []
+		for filename in os.listdir(self.directory):
+			if not filename.endswith(self.extension):
+				continue
+			filepath = os.path.join(self.directory, filename)
+			try:
+				stat = os.stat(filepath)
+			except OSError:
+				continue
+			out.append((stat.st_mtime, stat.st_size, filepath))
+		return sorted(out)
+
+
+	def evict(self):
+		"""Deletes the least recently used tables until the cache is smaller than maxbytes"""
+		files = self.files()
+		total = sum(size for (mtime, size, filepath) in files)
+		for (mtime, size, filepath) in files[:-1]: # never evicts the newest one
+			if total <= self.maxbytes:
+				break
+			try:
+				os.remove(filepath)
+			except OSError:
+				continue
+			logging.info("Evicted cached table {}".format(filepath))
+			total -= size
+
+
+	def clear(self):
+		"""Deletes all cached tables"""
+		for (mtime, size, filepath) in self.files():
+			os.remove(filepath)
+
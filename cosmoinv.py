@@ -0,0 +1,523 @@
+"""
+Vectorized inversion of cosmological quantities: get the redshifts of many tick values at once.
+github.com/mtewes/cosmicruler
+
+Instead of running one astropy z_at_value root-find per tick, an Inverter tabulates the quantity once on a
+dense redshift grid and then inverts whole arrays of values by monotone interpolation, refined by a few
+vectorized Newton steps on a cubic Hermite interpolant of that table.
+
+Example:
+
+	transf = Inverter(cosmo.lookback_time, u.Gyr)
+	transf([1.0, 2.0, 3.0]) # redshifts of these lookback times, as an array
+	transf(1.0) # works on scalars as well, so it can be used as transf in autosubtickmaker
+
+Non-monotonic quantities (angular diameter distance, kpc per arcmin) are handled by a BranchedInverter,
+which finds the extrema of the tabulation and provides one Inverter per monotonic branch.
+
+The distances and times all derive from two integrals, of 1/E(z) and 1/((1+z)E(z)): a CosmoGrid computes them
+once on the redshift grid (by cumulative Simpson integration), and gives any of these quantities and their inverse.
+"""
+
+import abc
+
+import numpy as np
+
+import profiling
+
+
+def tovalue(q, unit=None):
+	"""Returns the values of q as float64 array, expressed in unit.
+
+	q : an astropy Quantity, or anything array-like
+	unit : an astropy Unit or a Quantity (e.g. 600 kpc/arcmin). If None, the values of q are taken as they are.
+	"""
+	if unit is None:
+		return np.asarray(getattr(q, "value", q), dtype=np.float64)
+	return np.asarray((q / unit).decompose().value, dtype=np.float64)
+
+
+def zgrid(zmin=0.0, zmax=20.0, n=4000, zlow=1.0e-6):
+	"""Redshift grid used to tabulate the quantities.
+
+	The grid is log-spaced (quantities vary fastest at low z), and starts with 0.0 if zmin is 0.
+	zlow is the smallest non-zero redshift of the grid in that case, grids up to zmax <= zlow are linear.
+	"""
+	if zmin <= 0.0 and zmax <= zlow: # e.g. the low prefix of cumintegrals, for a grid starting below zlow
+		return np.linspace(0.0, zmax, n)
+	if zmin <= 0.0:
+		return np.concatenate(([0.0], np.geomspace(zlow, zmax, n-1)))
+	return np.geomspace(zmin, zmax, n)
+
+
+def hermite(z, f, d, zs, i=None):
+	"""Evaluates the cubic Hermite interpolant of a table (z, f, df/dz) and its derivative at zs.
+
+	i : optional indices of the table intervals in which the zs are (computed if not given)
+	Returns (values, derivatives)
+	"""
+	zs = np.asarray(zs, dtype=np.float64)
+	if i is None:
+		i = np.clip(np.searchsorted(z, zs) - 1, 0, len(z) - 2)
+	h = z[i+1] - z[i]
+	t = (zs - z[i]) / h
+	t2 = t * t
+	t3 = t2 * t
+
+	val = (2.0*t3 - 3.0*t2 + 1.0) * f[i] + (t3 - 2.0*t2 + t) * h * d[i] \
+		+ (-2.0*t3 + 3.0*t2) * f[i+1] + (t3 - t2) * h * d[i+1]
+	der = (6.0*t2 - 6.0*t) * (f[i] - f[i+1]) / h + (3.0*t2 - 4.0*t + 1.0) * d[i] + (3.0*t2 - 2.0*t) * d[i+1]
+	return (val, der)
+
+
+@profiling.timed("cosmoinv.tabulate")
+def tabulate(fct, unit=None, zmin=0.0, zmax=20.0, n=4000):
+	"""Evaluates fct on the redshift grid, and returns (z, values) for the finite values only"""
+	z = zgrid(zmin, zmax, n)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		f = tovalue(fct(z), unit)
+	ok = np.isfinite(f) # e.g., the distance modulus at z = 0
+	return (z[ok], f[ok])
+
+
+class Tabulated(abc.ABC):
+	"""Base class for the objects built from a tabulation (z, value, dvalue/dz) of a function of redshift,
+	subclasses implement settable"""
+
+	def __init__(self, fct, unit=None, zmin=0.0, zmax=20.0, n=4000):
+		"""
+		fct : function of redshift, accepting arrays (all astropy cosmology methods do).
+			If None, no tabulation is done, and settable() has to be called (see the fromtable factory function).
+		unit : unit in which values are given to and returned by the object, e.g. u.Gyr or 600 * u.kpc / u.arcmin
+		zmin, zmax : redshift range of the tabulation
+		n : number of points of the tabulation
+		"""
+		self.fct = fct
+		self.unit = unit
+		if fct is not None:
+			self.settable(*tabulate(fct, unit, zmin, zmax, n))
+
+
+	@classmethod
+	def fromtable(cls, z, f, d=None, unit=None, **kwargs):
+		"""
+		Factory function to construct the object from an existing tabulation, without calling any function
+		"""
+		obj = cls(None, unit, **kwargs)
+		obj.settable(z, f, d)
+		return obj
+
+
+	@classmethod
+	def fromcosmo(cls, cosmo, quantity, unit=None, zmin=0.0, zmax=20.0, n=4000, cache=None, **kwargs):
+		"""
+		Factory function to construct the object for a quantity of an astropy cosmology, given by its name.
+
+		cache : a cosmocache.TableCache. If the table is in there, it gets used and astropy is not called at all.
+			Otherwise the tabulation is done and saved into the cache.
+
+		The quantities of GRIDUNITS are tabulated from the CosmoGrid of the cosmology (see cosmogrid), so that
+		the distances and times of a cosmology are all computed from the same integrals, the others with astropy.
+
+		Example: Inverter.fromcosmo(Planck15, "lookback_time", u.Gyr, cache=cosmocache.TableCache())
+		"""
+		fct = getattr(cosmo, quantity)
+		table = None
+		if cache is not None:
+			key = cache.key(cosmo, quantity, unit, (zmin, zmax, n), method="cosmogrid" if quantity in GRIDUNITS else "astropy")
+			table = cache.load(key)
+		if table is None:
+			if quantity in GRIDUNITS:
+				table = cosmogrid(cosmo, zmin, zmax, n).table(quantity, unit)
+			else:
+				(z, f) = tabulate(fct, unit, zmin, zmax, n)
+				table = (z, f, np.gradient(f, z, edge_order=2))
+			if cache is not None:
+				cache.save(key, *table)
+		obj = cls.fromtable(*table, unit=unit, **kwargs)
+		obj.fct = fct
+		return obj
+
+
+	@abc.abstractmethod
+	def settable(self, z, f, d=None):
+		"""Sets the tabulation (z, f) and the derivatives d = df/dz (computed if not given)"""
+
+
+	@property
+	def zmin(self):
+		return self.z[0]
+
+	@property
+	def zmax(self):
+		return self.z[-1]
+
+
+	def forward(self, zs):
+		"""Interpolated value of the function at redshifts zs (in unit)"""
+		return hermite(self.z, self.f, self.d, zs)[0]
+
+
+
+class Inverter(Tabulated):
+	"""Vectorized inverse of a monotonic function of redshift, such as cosmo.lookback_time.
+
+	An Inverter can be called with a scalar or an array of values (in unit), and returns the corresponding redshift(s).
+	Values outside of the tabulated range give NaN in arrays, and raise a ValueError for scalars (like z_at_value does).
+	"""
+
+	def __init__(self, fct, unit=None, zmin=0.0, zmax=20.0, n=4000, niter=8, tol=1.0e-12):
+		"""
+		See Tabulated for the arguments, the function has to be strictly monotonic between zmin and zmax.
+
+		niter : maximum number of Newton steps
+		tol : stop iterating once all redshifts change by less than this
+		"""
+		self.niter = niter
+		self.tol = tol
+		Tabulated.__init__(self, fct, unit, zmin, zmax, n)
+
+
+	def settable(self, z, f, d=None):
+		"""Sets the tabulation (z, f) and the derivatives d = df/dz (computed if not given) used for the inversion"""
+		if len(z) < 3:
+			raise ValueError("Need at least 3 finite tabulated values")
+		steps = np.diff(f)
+		if np.all(steps > 0.0):
+			self.sign = 1.0
+		elif np.all(steps < 0.0):
+			self.sign = -1.0
+		else:
+			raise ValueError("Function is not strictly monotonic between z = {} and {}".format(z[0], z[-1]))
+		if d is None:
+			d = np.gradient(f, z, edge_order=2)
+		self.z = z
+		self.f = f
+		self.d = d
+		self.fsorted = self.sign * f # increasing, for searchsorted
+
+
+	def __call__(self, values):
+		"""Redshifts corresponding to the values (in unit)"""
+		isscalar = np.ndim(values) == 0
+		values = tovalue(values, self.unit if hasattr(values, "unit") else None)
+		y = np.atleast_1d(values)
+		if y.size == 0:
+			return np.empty(y.shape)
+
+		z = self.z
+		ys = self.sign * y
+		inrange = np.logical_and(ys >= self.fsorted[0], ys <= self.fsorted[-1])
+
+		# Interval of the table containing each value, and linear initial guess
+		i = np.clip(np.searchsorted(self.fsorted, ys) - 1, 0, len(z) - 2)
+		f0 = self.f[i]
+		f1 = self.f[i+1]
+		with np.errstate(divide="ignore", invalid="ignore"):
+			t = np.clip((y - f0) / (f1 - f0), 0.0, 1.0)
+		zs = z[i] + t * (z[i+1] - z[i])
+
+		# Vectorized Newton steps on the Hermite interpolant, kept within each interval
+		for it in range(self.niter):
+			(val, der) = hermite(z, self.f, self.d, zs, i)
+			with np.errstate(divide="ignore", invalid="ignore"):
+				step = (val - y) / der
+			step[~np.isfinite(step)] = 0.0
+			newzs = np.clip(zs - step, z[i], z[i+1])
+			change = np.max(np.abs(newzs - zs))
+			zs = newzs
+			if change < self.tol:
+				break
+
+		zs[~inrange] = np.nan
+		if isscalar:
+			if not inrange[0]:
+				raise ValueError("Value {} is outside of the range [{}, {}] covered between z = {} and {}".format(
+					values, np.min(self.f), np.max(self.f), self.zmin, self.zmax))
+			return float(zs[0])
+		return zs
+
+
+
+
+def extrema(z, f, d):
+	"""Finds the local extrema of the Hermite interpolant of a table (z, f, df/dz)
+
+	They are detected (all at once) as sign changes of the tabulated derivative. Within each such interval,
+	the derivative of the interpolant is a quadratic polynomial, whose root gives the exact position.
+
+	Returns (indices of the intervals, redshifts, values) of the extrema.
+	"""
+	j = np.nonzero(d[:-1] * d[1:] < 0.0)[0]
+	h = z[j+1] - z[j]
+	delta = (f[j] - f[j+1]) / h
+	a = 6.0*delta + 3.0*d[j] + 3.0*d[j+1]
+	b = -6.0*delta - 4.0*d[j] - 2.0*d[j+1]
+	c = d[j]
+	with np.errstate(divide="ignore", invalid="ignore"):
+		q = -0.5 * (b + np.copysign(np.sqrt(np.clip(b*b - 4.0*a*c, 0.0, None)), b))
+		t1 = q / a
+		t2 = c / q
+	t = np.where(np.logical_and(t1 >= 0.0, t1 <= 1.0), t1, t2)
+	zext = z[j] + t * h
+	fext = hermite(z, f, d, zext, j)[0]
+	return (j, zext, fext)
+
+
+class BranchedInverter(Tabulated):
+	"""Vectorized inverse of a non-monotonic function of redshift, such as cosmo.angular_diameter_distance.
+
+	The function is tabulated once, and split into monotonic branches at its extrema.
+	Calling a BranchedInverter returns the redshifts on all branches at once, and each branch
+	is an Inverter that can be used as transf for a Scale.
+	"""
+
+	def __init__(self, fct, unit=None, zmin=0.0, zmax=20.0, n=4000, **kwargs):
+		"""
+		See Tabulated for the arguments, the other kwargs (niter, tol) are passed to the Inverters of the branches.
+		"""
+		self.kwargs = kwargs
+		Tabulated.__init__(self, fct, unit, zmin, zmax, n)
+
+
+	def settable(self, z, f, d=None):
+		"""Sets the tabulation, finds the extrema and builds the branches"""
+		if d is None:
+			d = np.gradient(f, z, edge_order=2)
+		self.z = z
+		self.f = f
+		self.d = d
+
+		(j, zext, fext) = extrema(z, f, d)
+		self.extrema = [(float(ze), float(fe), "max" if d[ji] > 0.0 else "min") for (ji, ze, fe) in zip(j, zext, fext)]
+
+		# Each branch is the table between two extrema, with the exact extrema as end points
+		self.branches = []
+		starts = np.concatenate(([0], j+1))
+		ends = np.concatenate((j+1, [len(z)]))
+		for (k, (start, end)) in enumerate(zip(starts, ends)):
+			bz = [z[start:end]]
+			bf = [f[start:end]]
+			bd = [d[start:end]]
+			if k > 0: # begins at an extremum
+				bz.insert(0, [zext[k-1]])
+				bf.insert(0, [fext[k-1]])
+				bd.insert(0, [0.0])
+			if k < len(j): # ends at an extremum
+				bz.append([zext[k]])
+				bf.append([fext[k]])
+				bd.append([0.0])
+			(bz, bf, bd) = (np.concatenate(bz), np.concatenate(bf), np.concatenate(bd))
+			keep = np.concatenate(([True], np.diff(bz) > 0.0)) # extremum on top of a grid point
+			self.branches.append(Inverter.fromtable(bz[keep], bf[keep], bd[keep], unit=self.unit, **self.kwargs))
+
+
+	def __len__(self):
+		return len(self.branches)
+
+
+	def branch(self, i):
+		"""The Inverter of branch i (counting from low redshift), to be used as transf"""
+		return self.branches[i]
+
+
+	def peak(self, i=0):
+		"""(redshift, value) of the i-th extremum"""
+		(zext, fext, kind) = self.extrema[i]
+		return (zext, fext)
+
+
+	def __call__(self, values):
+		"""Redshifts corresponding to the values (in unit) on all branches
+
+		Returns an array of shape (number of branches, number of values), with NaN where a branch does not reach a value.
+		For a scalar value, the array has one entry per branch.
+		"""
+		isscalar = np.ndim(values) == 0
+		y = np.atleast_1d(tovalue(values, self.unit if hasattr(values, "unit") else None))
+		zs = np.vstack([branch(y) for branch in self.branches])
+		if isscalar:
+			return zs[:, 0]
+		return zs
+
+
+
+
+# All distances and times of a cosmology from the same two integrals
+
+# Quantities of CosmoGrid, with the unit in which they are computed
+GRIDUNITS = {
+	"comoving_distance": "Mpc",
+	"comoving_transverse_distance": "Mpc",
+	"angular_diameter_distance": "Mpc",
+	"luminosity_distance": "Mpc",
+	"distmod": "mag",
+	"lookback_time": "Gyr",
+	"lookback_distance": "Mpc",
+	"age": "Gyr",
+	"kpc_proper_per_arcmin": "kpc / arcmin",
+	"kpc_comoving_per_arcmin": "kpc / arcmin",
+	"comoving_volume": "Mpc3",
+}
+
+
+def cumsimpson(y, x):
+	"""Cumulative integrals of y (along its last axis, so for many rows at once) from x[0], starting with 0
+
+	The grid x can be unevenly spaced. The integral over each interval is the mean of those of the parabolas through
+	the interval and the point before or after it (only one of them at the ends), which is exact for cubics.
+	"""
+	h = np.diff(x)
+	(h0, h1) = (h[:-1], h[1:]) # of the pairs of intervals
+	s = h0 + h1
+	# Integrals of the parabola through 3 points over its first interval (forward) and over its second one (backward)
+	forward = (h0 * (3.0*s - h0) / (6.0*s)) * y[..., :-2] + (h0 * (3.0*s - 2.0*h0) / (6.0*h1)) * y[..., 1:-1] \
+		- (h0**3 / (6.0*s*h1)) * y[..., 2:]
+	backward = -(h1**3 / (6.0*s*h0)) * y[..., :-2] + (h1 * (3.0*s - 2.0*h1) / (6.0*h0)) * y[..., 1:-1] \
+		+ (h1 * (3.0*s - h1) / (6.0*s)) * y[..., 2:]
+	parts = np.empty(y.shape[:-1] + (len(h),))
+	parts[..., :-1] = forward
+	parts[..., 1:] += backward
+	parts[..., 1:-1] *= 0.5
+	parts[..., -1] = backward[..., -1]
+	out = np.zeros(y.shape)
+	np.cumsum(parts, axis=-1, out=out[..., 1:])
+	return out
+
+
+def cumintegrals(cosmos, z, nlow=200):
+	"""Integrals from 0 to z of 1/E and of 1/((1+z)E), for each cosmology (rows) at the increasing redshifts z
+
+	If z does not start at 0, the integrals up to z[0] are done on a grid of nlow points.
+	Returns two arrays of shape (number of cosmologies, len(z)), in units of the Hubble distance and time.
+	"""
+	zs = z if z[0] <= 0.0 else np.concatenate((zgrid(0.0, z[0], nlow)[:-1], z))
+	inv = np.vstack([cosmo.inv_efunc(zs) for cosmo in cosmos])
+	(dc, lb) = cumsimpson(np.stack((inv, inv / (1.0 + zs))), zs)[..., len(zs)-len(z):]
+	return (dc, lb)
+
+
+class CosmoGrid(object):
+	"""The distances and times of a cosmology on a redshift grid, computed from two cumulative integrations
+
+	All quantities of GRIDUNITS derive from the integrals of 1/E (comoving distance) and 1/((1+z)E) (lookback time),
+	so the cosmology gets evaluated only once, on the grid. Any of them can then be tabulated, and inverted.
+
+	Example:
+
+		grid = CosmoGrid(Planck15)
+		inv = grid.inverter("lookback_time", u.Gyr) # an Inverter, or a BranchedInverter for non-monotonic quantities
+		grid.values("distmod") # on grid.z
+	"""
+
+	def __init__(self, cosmo, zmin=0.0, zmax=20.0, n=4000, integrals=None):
+		"""
+		cosmo : astropy cosmology
+		zmin, zmax, n : the grid, see zgrid
+		integrals : optional (dc, lb) already computed on this grid by cumintegrals (see stack)
+		"""
+		import astropy.units as u
+
+		self.cosmo = cosmo
+		self.z = zgrid(zmin, zmax, n)
+		self.grid = (zmin, zmax, n)
+		if integrals is None:
+			integrals = [row[0] for row in cumintegrals([cosmo], self.z)]
+		(self.dc, self.lb) = integrals
+		self.dh = cosmo.hubble_distance.to_value(u.Mpc)
+		self.th = cosmo.hubble_time.to_value(u.Gyr)
+
+
+	@classmethod
+	def stack(cls, cosmos, zmin=0.0, zmax=20.0, n=4000):
+		"""List of the CosmoGrids of several cosmologies, integrated all at once"""
+		z = zgrid(zmin, zmax, n)
+		(dc, lb) = cumintegrals(cosmos, z)
+		return [cls(cosmo, zmin, zmax, n, integrals=(dc[i], lb[i])) for (i, cosmo) in enumerate(cosmos)]
+
+
+	@profiling.timed("cosmoinv.CosmoGrid.values")
+	def values(self, quantity, unit=None):
+		"""Values of a quantity (a name of GRIDUNITS) on the grid z, in unit (default: that of GRIDUNITS)"""
+		if quantity not in GRIDUNITS:
+			raise ValueError("CosmoGrid has no quantity {}, known are {}".format(quantity, sorted(GRIDUNITS)))
+		z = self.z
+		dh = self.dh
+		dc = dh * self.dc
+		ok = self.cosmo.Ok0
+		sqrtok = np.sqrt(abs(ok))
+		if ok > 0.0:
+			dm = dh / sqrtok * np.sinh(sqrtok * self.dc)
+		elif ok < 0.0:
+			dm = dh / sqrtok * np.sin(sqrtok * self.dc)
+		else:
+			dm = dc
+		arcmin = np.radians(1.0 / 60.0)
+
+		with np.errstate(divide="ignore", invalid="ignore"):
+			if quantity == "comoving_distance":
+				f = dc
+			elif quantity == "comoving_transverse_distance":
+				f = dm
+			elif quantity == "angular_diameter_distance":
+				f = dm / (1.0 + z)
+			elif quantity == "luminosity_distance":
+				f = dm * (1.0 + z)
+			elif quantity == "distmod":
+				f = 5.0 * np.log10(dm * (1.0 + z)) + 25.0
+			elif quantity == "lookback_time":
+				f = self.th * self.lb
+			elif quantity == "lookback_distance":
+				f = dh * self.lb
+			elif quantity == "age":
+				import astropy.units as u
+				f = self.cosmo.age(0).to_value(u.Gyr) - self.th * self.lb # the integral to infinity, once
+			elif quantity == "kpc_proper_per_arcmin":
+				f = 1000.0 * arcmin * dm / (1.0 + z)
+			elif quantity == "kpc_comoving_per_arcmin":
+				f = 1000.0 * arcmin * dm
+			elif quantity == "comoving_volume":
+				if ok == 0.0:
+					f = 4.0 * np.pi / 3.0 * dm**3
+				else:
+					x = sqrtok * dm / dh
+					arc = np.arcsinh(x) if ok > 0.0 else np.arcsin(x)
+					f = 2.0 * np.pi * dh**3 / ok * (dm / dh * np.sqrt(1.0 + ok * (dm / dh)**2) - arc / sqrtok)
+		if unit is not None:
+			import astropy.units as u
+			f = tovalue(f * u.Unit(GRIDUNITS[quantity]), unit)
+		return f
+
+
+	def table(self, quantity, unit=None):
+		"""Tabulation (z, values, derivatives) of a quantity, as Tabulated.fromtable takes it (finite values only)"""
+		f = self.values(quantity, unit)
+		ok = np.isfinite(f) # e.g., the distance modulus at z = 0
+		(z, f) = (self.z[ok], f[ok])
+		return (z, f, np.gradient(f, z, edge_order=2))
+
+
+	def inverter(self, quantity, unit=None, **kwargs):
+		"""Inverter of a quantity, or BranchedInverter if it is not monotonic, kwargs are passed to them (niter, tol)"""
+		table = self.table(quantity, unit)
+		steps = np.diff(table[1])
+		cls = Inverter if np.all(steps > 0.0) or np.all(steps < 0.0) else BranchedInverter
+		obj = cls.fromtable(*table, unit=unit, **kwargs)
+		obj.fct = getattr(self.cosmo, quantity)
+		return obj
+
+
+GRIDS = {} # the last CosmoGrids made by cosmogrid, by cosmology parameters and grid
+MAXGRIDS = 8
+
+
+def cosmogrid(cosmo, zmin=0.0, zmax=20.0, n=4000):
+	"""CosmoGrid of a cosmology, reused if it is one of the MAXGRIDS last ones"""
+	import cosmocache
+
+	key = (cosmocache.cosmoparams(cosmo), zmin, zmax, n)
+	if key not in GRIDS:
+		if len(GRIDS) >= MAXGRIDS:
+			del GRIDS[next(iter(GRIDS))]
+		GRIDS[key] = CosmoGrid(cosmo, zmin, zmax, n)
+	return GRIDS[key]
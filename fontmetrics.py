@@ -0,0 +1,57 @@
+"""
+Font metrics to estimate the extents of texts without rendering them.
+github.com/mtewes/cosmicruler
+
+Only the widths of the Helvetica (Arial has the same) glyphs of printable ASCII are tabulated, from the Adobe AFM files.
+Other families are estimated with these widths, which is good enough to find overlapping labels.
+
+Example:
+
+	(size, family) = fontmetrics.parsestyle("font-size:24;font-family:Helvetica Neue")
+	fontmetrics.textwidths(["0.1", "10", "1.75"], size) # array of widths, in the units of size
+"""
+
+import re
+
+import numpy as np
+
+
+# Advance widths of the characters 32 to 126, in 1/1000 of the font size
+HELVETICA = np.array([
+	278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278, # space to /
+	556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556, # 0 to ?
+	1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778, # @ to O
+	667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556, # P to _
+	333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556, # ` to o
+	556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584, # p to ~
+], dtype=np.float64)
+
+DEFAULTWIDTH = 556.0 # of the other characters
+ASCENT = 718.0 # above the baseline
+DESCENT = 207.0 # below the baseline
+
+WIDTHS = np.concatenate((np.full(32, DEFAULTWIDTH), HELVETICA, [DEFAULTWIDTH]))
+
+
+def parsestyle(style, size=10.0, family="Helvetica"):
+	"""(font size, font family) of an svg style string such as "font-size:24;font-family:Helvetica Neue", with defaults"""
+	for item in (style or "").split(";"):
+		if ":" not in item:
+			continue
+		(key, value) = [part.strip() for part in item.split(":", 1)]
+		if key == "font-size":
+			size = float(re.match(r"[0-9.]+", value).group(0))
+		elif key == "font-family":
+			family = value
+	return (size, family)
+
+
+def textwidths(texts, size=10.0):
+	"""Widths of the texts (a list of strings) at the given font size, computed all at once"""
+	n = len(texts)
+	lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=n)
+	codes = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32)
+	widths = WIDTHS[np.minimum(codes, len(WIDTHS) - 1)]
+	cumulated = np.concatenate(([0.0], np.cumsum(widths)))
+	ends = np.cumsum(lengths)
+	return (cumulated[ends] - cumulated[ends - lengths]) * size / 1000.0
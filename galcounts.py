@@ -1,13 +1,249 @@
 """
 Helper function to make scales with cumulated number counts up to some redshifts, from a catalog.
+
+Catalogs that do not fit in memory can be streamed in chunks of rows from FITS or Parquet files into
+a CumulativeCounts histogram, which can then be used in place of the catalog:
+
+	counts = galcounts.CumulativeCounts.fromfile("2614.fits", "true_redshift_gal",
+		selection=lambda chunk: chunk["euclid_vis"] < 24.5, columns=["euclid_vis"])
+	scale = galcounts.scale_counts_to_z(counts, catfactor, ...)
+
+Several selections of the same catalog are histogrammed in one pass with CumulativeCounts.fromselections.
 """
 
+import logging
+
+import numpy as np
+
 import cosmicruler
-import astropy.table
+import profiling
 #import matplotlib.pyplot as plt
 
 
 
+def countindices(counts, catfactor=1.0):
+	"""Indices in the sorted catalog of the counts, raises a RuntimeError for counts below 10 galaxies in the catalog"""
+	indices = (np.asarray(counts, dtype=np.float64) * catfactor).astype(np.int64).reshape(-1)
+	if np.any(indices < 10):
+		raise RuntimeError("Out of range: counts {} give less than 10 galaxies in the catalog".format(
+			np.asarray(counts).reshape(-1)[indices < 10]))
+	return indices
+
+
+@profiling.timed("galcounts.sortedz")
+def sortedz(z, indices):
+	"""Order statistics of the redshifts z needed to look up the given count indices (see countindices)
+	
+	Instead of sorting the full array, it gets partitioned once around all the needed ranks (index-1 and index+1).
+	Only these ranks of the returned (partitioned) copy of z are meaningful.
+	"""
+	z = np.asarray(z)
+	indices = np.concatenate([np.asarray(i, dtype=np.int64).reshape(-1) for i in indices])
+	if np.any(indices+1 >= len(z)):
+		raise RuntimeError("Out of range: counts need up to {} galaxies, but the catalog has only {}".format(
+			np.max(indices)+2, len(z)))
+	kth = np.unique(np.concatenate((indices-1, indices+1)))
+	if len(kth) == 0:
+		return z[:0].copy()
+	return np.partition(z, kth)
+
+
+def counts_to_z(orderstats, counts, catfactor=1.0):
+	"""Vectorized lookup of the redshifts up to which the catalog has the given counts
+	
+	orderstats : z partitioned by sortedz (or simply sorted)
+	"""
+	indices = countindices(counts, catfactor)
+	zs = 0.5 * (orderstats[indices-1] + orderstats[indices+1])
+	logging.debug("counts {} -> counts in cat {} -> z {}".format(np.asarray(counts).reshape(-1), indices, zs))
+	return zs
+
+
+def readchunks(filepath, columns, chunksize=1000000, hdu=1):
+	"""Yields dicts of numpy arrays with the given columns of a catalog, chunksize rows at a time
+	
+	FITS files are memory-mapped, so that only the rows of the current chunk and the requested columns get read.
+	Parquet files (.parquet or .pq) are read batch by batch, this requires pyarrow.
+	"""
+	if filepath.endswith(".parquet") or filepath.endswith(".pq"):
+		try:
+			import pyarrow.parquet
+		except ImportError:
+			raise RuntimeError("Reading {} requires pyarrow".format(filepath))
+		parquetfile = pyarrow.parquet.ParquetFile(filepath)
+		for batch in parquetfile.iter_batches(batch_size=chunksize, columns=list(columns)):
+			with profiling.stage("galcounts.readchunk"):
+				chunk = dict((name, batch.column(name).to_numpy(zero_copy_only=False)) for name in columns)
+			yield chunk
+		return
+	
+	import astropy.io.fits
+	with astropy.io.fits.open(filepath, memmap=True) as hdulist:
+		data = hdulist[hdu].data
+		n = len(data)
+		fields = dict((name, data.field(name)) for name in columns)
+		for start in range(0, n, chunksize):
+			# astype makes native-endian in-memory copies of the chunk, so that the file can be closed
+			with profiling.stage("galcounts.readchunk"):
+				chunk = dict((name, field[start:start+chunksize].astype(field.dtype.newbyteorder("="))) for (name, field) in fields.items())
+			yield chunk
+
+
+def catcolumns(filepath, hdu=1):
+	"""Names of the columns of a FITS or Parquet catalog, without reading any data"""
+	if filepath.endswith(".parquet") or filepath.endswith(".pq"):
+		try:
+			import pyarrow.parquet
+		except ImportError:
+			raise RuntimeError("Reading {} requires pyarrow".format(filepath))
+		return pyarrow.parquet.ParquetFile(filepath).schema_arrow.names
+	import astropy.io.fits
+	with astropy.io.fits.open(filepath, memmap=True) as hdulist:
+		return hdulist[hdu].columns.names
+
+
+def expressionnames(expression):
+	"""Names used in a string expression (some of them may be attributes, like np.log10), or [] for functions and None"""
+	if isinstance(expression, str):
+		return list(compile(expression, "<selection>", "eval").co_names)
+	return []
+
+
+def evaluator(expression):
+	"""Turns a string expression of the columns of a chunk into a function of the chunk, leaves functions and None as they are
+
+	The expressions come from spec files: they are numpy expressions of the column names (and np), evaluated without
+	the python builtins, and names starting with __ (such as __import__ or __class__) are refused.
+	"""
+	if not isinstance(expression, str):
+		return expression
+	code = compile(expression, "<selection>", "eval")
+	if any(name.startswith("__") for name in code.co_names):
+		raise ValueError("Selection {} uses names starting with __, which are not allowed".format(expression))
+	def fct(chunk):
+		return eval(code, {"__builtins__": {}, "np": np}, chunk)
+	return fct
+
+
+class CumulativeCounts(object):
+	"""Fine-binned histogram of the redshifts of a (selected) catalog, filled chunk by chunk
+	
+	The cumulative histogram N(<z) replaces the sorted catalog to find the redshift of a count: within a bin
+	the objects are assumed to be uniformly distributed. The memory use only depends on the number of bins.
+	"""
+	
+	def __init__(self, zmin=0.0, zmax=10.0, nbins=100000):
+		"""
+		zmin, zmax : range of the histogram, objects outside are still counted
+		nbins : number of bins, the default gives a resolution of 1e-4 in z
+		"""
+		self.edges = np.linspace(zmin, zmax, nbins+1)
+		self.hist = np.zeros(nbins, dtype=np.int64)
+		self.below = 0 # objects with z < zmin
+		self.above = 0 # objects with z >= zmax (or NaN)
+	
+	@property
+	def nbins(self):
+		return len(self.hist)
+	
+	@property
+	def total(self):
+		return self.below + int(np.sum(self.hist)) + self.above
+	
+	@profiling.timed("galcounts.histogram")
+	def add(self, z):
+		"""Adds an array of redshifts to the histogram"""
+		z = np.asarray(z, dtype=np.float64).reshape(-1)
+		(zmin, zmax) = (self.edges[0], self.edges[-1])
+		inside = np.logical_and(z >= zmin, z < zmax)
+		self.below += int(np.count_nonzero(z < zmin))
+		self.above += int(len(z) - np.count_nonzero(inside) - np.count_nonzero(z < zmin))
+		indices = ((z[inside] - zmin) * (self.nbins / (zmax - zmin))).astype(np.int64)
+		np.minimum(indices, self.nbins-1, out=indices) # rounding at the upper edge
+		self.hist += np.bincount(indices, minlength=self.nbins)
+	
+	def cumulative(self):
+		"""Number of objects with z smaller than each of the edges"""
+		out = np.empty(len(self.edges), dtype=np.int64)
+		out[0] = self.below
+		np.cumsum(self.hist, out=out[1:])
+		out[1:] += self.below
+		return out
+	
+	def counts_to_z(self, counts, catfactor=1.0):
+		"""Redshifts up to which the catalog has the given counts, same conventions as galcounts.counts_to_z"""
+		indices = countindices(counts, catfactor)
+		cum = self.cumulative()
+		if np.any(indices < self.below) or np.any(indices+1 >= cum[-1]):
+			raise RuntimeError("Out of range: counts need between {} and {} galaxies, but the histogram has {} in its z-range".format(
+				np.min(indices), np.max(indices)+2, cum[-1] - self.below))
+		# the index-th object (from 0) is in the bin where N(<z) goes past index+0.5
+		zs = np.interp(indices + 0.5, cum, self.edges)
+		logging.debug("counts {} -> counts in cat {} -> z {}".format(np.asarray(counts).reshape(-1), indices, zs))
+		return zs
+	
+	@classmethod
+	def fromfile(cls, filepath, z_name, selection=None, columns=None, chunksize=1000000, hdu=1, **kwargs):
+		"""Streams a catalog file into a histogram
+		
+		selection : optional function taking a chunk (dict of column arrays) and returning the boolean mask of the objects to count,
+			or an expression as for fromselections
+		columns : other columns needed by the selection
+		kwargs are passed to the constructor (zmin, zmax, nbins)
+		"""
+		return cls.fromselections(filepath, z_name, {"selection": selection}, columns=columns,
+			chunksize=chunksize, hdu=hdu, **kwargs)["selection"]
+	
+	@classmethod
+	def fromselections(cls, filepath, z_name, selections, derived=None, columns=None, chunksize=1000000, hdu=1, **kwargs):
+		"""Streams a catalog file once, into one histogram per selection
+		
+		selections : dict of name -> selection, a selection being either
+			- a string expression of the columns and derived columns, evaluated with numpy as np (and without the python
+			  builtins, see evaluator), e.g. "(euclid_vis < 24.5) & (np.log10(f_halpha) > -15.7)"
+			- a function taking a chunk (dict of column arrays) and returning the boolean mask of the objects to count
+			- None, to count all objects
+		derived : optional dict of name -> expression (string or function, as for selections) of columns to compute for each chunk,
+			before the selections. They are computed once and can use the previous ones.
+		columns : other columns to read, needed by function selections (those of string expressions are found automatically)
+		kwargs are passed to the constructor (zmin, zmax, nbins)
+		
+		Returns a dict of name -> CumulativeCounts, in the order of selections.
+		"""
+		derived = derived or {}
+		expressions = list(derived.values()) + list(selections.values())
+		available = catcolumns(filepath, hdu=hdu)
+		missing = [name for name in [z_name] + list(columns or []) if name not in available]
+		if len(missing) > 0:
+			raise ValueError("{} has no columns {} (it has {})".format(filepath, ", ".join(missing), ", ".join(available)))
+		needed = [z_name] + list(columns or [])
+		for expression in expressions:
+			needed.extend(expressionnames(expression))
+		needed = [name for name in dict.fromkeys(needed) if name in available and name not in derived] # ordered and unique
+		
+		derived = [(name, evaluator(expression)) for (name, expression) in derived.items()]
+		selections = [(name, evaluator(selection)) for (name, selection) in selections.items()]
+		counts = dict((name, cls(**kwargs)) for (name, selection) in selections)
+		nrows = 0
+		for chunk in readchunks(filepath, needed, chunksize=chunksize, hdu=hdu):
+			z = chunk[z_name]
+			nrows += len(z)
+			for (name, fct) in derived:
+				chunk[name] = fct(chunk)
+			for (name, fct) in selections:
+				if fct is None:
+					counts[name].add(z)
+				else:
+					counts[name].add(z[fct(chunk)])
+		for (name, histogram) in counts.items():
+			logging.info("Selection {}: histogrammed {} of {} objects from {}".format(name, histogram.total, nrows, filepath))
+		return counts
+	
+	def n(self, z):
+		"""Number of objects below the redshifts z (interpolated within the bins)"""
+		return np.interp(z, self.edges, self.cumulative())
+
+
 def scale_counts_to_z(cat, catfactor=1.0, 
 	majticks=[0.1, 1.0, 10.0], medticks=[], minticks=[], labels=[(1.0, "1.0")],
 	name="counts", title="Cumulated counts to redshift", z_name="true_redshift_gal"):
@@ -15,7 +251,7 @@ def scale_counts_to_z(cat, catfactor=1.0,
 	
 	Function that builds a scale with "counts" of sources in a catalog up to the redshift.
 	
-	cat: an astropy table
+	cat: an astropy table (or a CumulativeCounts histogram of the catalog)
 	
 	ticks : values of counts that you want to show, in your prefered unit (e.g., gals per arcmin2)
 	labels: count, and label for this count to show (in the same unit)
@@ -23,33 +259,25 @@ def scale_counts_to_z(cat, catfactor=1.0,
 	catfactor: how many gals are in your cat for a unit "count" ?
 		This is a function of area, subsampling, ...
 	
-	
+	The catalog is not modified: only its redshift column is used, and partitioned once (in a copy) for all ticks and labels.
 	"""
 
-
-	cat.sort(z_name)
+	labelcounts = [value for (value, text) in labels]
+	allcounts = [majticks, medticks, minticks, labelcounts]
+	if isinstance(cat, CumulativeCounts):
+		orderstats = None
+	else:
+		orderstats = sortedz(cat[z_name], [countindices(counts, catfactor) for counts in allcounts])
 
 	def find_redshifts(ticks):
 		"""
-		returns a list of redshifts corresponding to the given "count" ticks
+		returns an array of redshifts corresponding to the given "count" ticks
 		"""
-		zs = []
-		for count in ticks:
-			count_in_cat = int(count * catfactor)
-			print("count:", count, " -> count in cat:", count_in_cat)
-
-			if count_in_cat < 10 or count_in_cat > len(cat):
-				raise RuntimeError("Out of range")
-
-			z1 = cat[count_in_cat-1][z_name]
-			z2 = cat[count_in_cat+1][z_name]
-			print(z1, z2)
-		
-			z = 0.5 * (z1 + z2)
-			zs.append(z)
-		
-		assert len(zs) == len(ticks)
-		return zs
+		if orderstats is None:
+			with profiling.stage("galcounts.find_redshifts"):
+				return cat.counts_to_z(ticks, catfactor)
+		with profiling.stage("galcounts.find_redshifts"):
+			return counts_to_z(orderstats, ticks, catfactor)
 		
 	
 	majticks = find_redshifts(majticks) # Those are now in redshift
@@ -57,7 +285,6 @@ def scale_counts_to_z(cat, catfactor=1.0,
 	minticks = find_redshifts(minticks)
 	
 	# Find label positions in redshifts
-	labelcounts = [value for (value, text) in labels]
 	labelzs = find_redshifts(labelcounts)
 	labels = [(z, text) for (z, (value, text)) in zip(labelzs, labels)]
 
@@ -72,6 +299,7 @@ if __name__ == '__main__':
 	
     
 	catpath = "2562.fits"
+	import astropy.table
 	cat = astropy.table.Table.read(catpath)
 	cat = cat[cat["euclid_vis"] < 24.5]
 
@@ -81,7 +309,7 @@ if __name__ == '__main__':
 	catfactor = (overal_square_degrees * 3600) * subsamplefactor
 
 
-	make_count_scale(cat, catfactor, counts=[0.1, 1.0, 10.0])
+	scale = scale_counts_to_z(cat, catfactor, majticks=[0.1, 1.0, 10.0])
 
 
 
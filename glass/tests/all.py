@@ -1,15 +1,14 @@
 import cosmicruler
+import cosmoinv
 import galcounts
 import svgwrite
 
 import astropy.units as u
 from astropy.cosmology import Planck15 as cosmo
-from astropy.cosmology import z_at_value
 
 import astropy.table
 
 import numpy as np
-import scipy.optimize
 
 
 """
@@ -35,21 +34,22 @@ scales.append(cosmicruler.Scale.fromz(zptrans, name, majticks, medticks, mintick
 
 name = "lbt"
 title = "Time to launch [Gyr]"
+transf = cosmoinv.Inverter(cosmo.lookback_time, u.Gyr)
 
 sourceticks = np.arange(1, 10.1, 1)
-labels = [(z_at_value(cosmo.lookback_time, value * u.Gyr), "{:.0f}".format(value)) for value in sourceticks]
+labels = list(zip(transf(sourceticks), ["{:.0f}".format(value) for value in sourceticks]))
 majticks = [value for (value, text) in labels]
 majticks.append(0.0)
 labels.append((0.0, "0"))
-medticks = [z_at_value(cosmo.lookback_time, value * u.Gyr) for value in cosmicruler.subticks(sourceticks, 2)]
-minticks = [z_at_value(cosmo.lookback_time, value * u.Gyr) for value in cosmicruler.subticks(sourceticks, 10)]
+medticks = list(transf(cosmicruler.subticks(sourceticks, 2)))
+minticks = list(transf(cosmicruler.subticks(sourceticks, 10)))
 
 presourceticks = [0.01, 0.1]
-prelabels = [(z_at_value(cosmo.lookback_time, value * u.Gyr), "{}".format(value)) for value in presourceticks]
+prelabels = list(zip(transf(presourceticks), ["{}".format(value) for value in presourceticks]))
 premajticks = [value for (value, text) in prelabels]
 premedticks = []
-preminticks = [z_at_value(cosmo.lookback_time, value * u.Gyr) for value in cosmicruler.subticks(presourceticks, 9)] + \
-	[z_at_value(cosmo.lookback_time, value * u.Gyr) for value in [0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]]
+preminticks = list(transf(cosmicruler.subticks(presourceticks, 9))) + \
+	list(transf([0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]))
 labels = prelabels + labels
 majticks = premajticks + majticks
 medticks = premedticks + medticks
@@ -59,12 +59,15 @@ scales.append(cosmicruler.Scale.fromz(zptrans, name, majticks, medticks, mintick
 
 name = "distmod"
 title = "Distance modulus"
-labels = [(z_at_value(cosmo.distmod, value * u.mag), "{:.0f}".format(value)) for value in np.arange(37.0, 46.1, 1)]
+transf = cosmoinv.Inverter(cosmo.distmod, u.mag)
+sourceticks = np.arange(37.0, 46.1, 1)
+labels = list(zip(transf(sourceticks), ["{:.0f}".format(value) for value in sourceticks]))
 majticks = [value for (value, text) in labels]
-medticks = [z_at_value(cosmo.distmod, value * u.mag) for value in np.arange(37, 46, 0.5)]
-minticks = [z_at_value(cosmo.distmod, value * u.mag) for value in np.arange(37, 46, 0.1)]
+medticks = list(transf(np.arange(37, 46, 0.5)))
+minticks = list(transf(np.arange(37, 46, 0.1)))
 
-prelabels = [(z_at_value(cosmo.distmod, value * u.mag), "{:.0f}".format(value)) for value in [30, 32, 34, 36]]
+presourceticks = [30, 32, 34, 36]
+prelabels = list(zip(transf(presourceticks), ["{:.0f}".format(value) for value in presourceticks]))
 
 premajticks = [value for (value, text) in prelabels]
 premedticks = list(cosmicruler.subticks(premajticks, 2))
@@ -80,23 +83,25 @@ scales.append(cosmicruler.Scale.fromz(zptrans, name, majticks, medticks, mintick
 
 name = "angdiam"
 title = "Angular diameter distance [Gpc]"
-zpeak = scipy.optimize.fmin(lambda z: -cosmo.angular_diameter_distance(z).value, 1.5)[0]
-valpeak = cosmo.angular_diameter_distance(zpeak)
+inv = cosmoinv.BranchedInverter(cosmo.angular_diameter_distance, u.Gpc)
+(zpeak, valpeak) = inv.peak()
 labelpeak = ""
 
 extras={"peak":(zpeak, labelpeak)}
+transf1 = inv.branch(0) # left of peak
+transf2 = inv.branch(1) # right of peak
 
 sourceticks1 = [0.1, 0.2, 0.4, 0.6, 0.8, 1.0, 1.2, 1.4, 1.6]
 labelticks1 = sourceticks1 + [1.7, 1.75, 1.78, 1.79]
-labels1 = [(z_at_value(cosmo.angular_diameter_distance, value * u.Gpc, zmax=zpeak), "{}".format(value)) for value in labelticks1]
+labels1 = list(zip(transf1(labelticks1), ["{}".format(value) for value in labelticks1]))
 majticks1 = [value for (value, text) in labels1]
 majticks1.append(0.0)
 labels1.append((0.0, "0"))
-medticks1 = [z_at_value(cosmo.angular_diameter_distance, value * u.Gpc, zmax=zpeak) for value in cosmicruler.subticks(sourceticks1, 2)]
-minticks1 = [z_at_value(cosmo.angular_diameter_distance, value * u.Gpc, zmax=zpeak) for value in cosmicruler.subticks(sourceticks1, 10)]
+medticks1 = list(transf1(cosmicruler.subticks(sourceticks1, 2)))
+minticks1 = list(transf1(cosmicruler.subticks(sourceticks1, 10)))
 
 sourceticks2 = [1.79, 1.78]
-labels2 = [(z_at_value(cosmo.angular_diameter_distance, value * u.Gpc, zmin=zpeak), "{}".format(value)) for value in sourceticks2]
+labels2 = list(zip(transf2(sourceticks2), ["{}".format(value) for value in sourceticks2]))
 majticks2 = [value for (value, text) in labels2]
 medticks2 = []
 minticks2 = []
@@ -118,31 +123,34 @@ scales.append(cosmicruler.Scale.fromz(zptrans, name, majticks, medticks, mintick
 name = "size"
 title = "VIS pixel scale [kpc] (transverse proper size subtending 0.1 arcsec)"
 f = 600.0 * u.kpc / u.arcmin
-zpeak = scipy.optimize.fmin(lambda z: -cosmo.kpc_proper_per_arcmin(z).value, 1.5)[0]
-valpeak = cosmo.kpc_proper_per_arcmin(zpeak) / f
-labelpeak = "{:.3f}".format(valpeak.value)
+inv = cosmoinv.BranchedInverter(cosmo.kpc_proper_per_arcmin, f)
+(zpeak, valpeak) = inv.peak()
+labelpeak = "{:.3f}".format(valpeak)
 
 extras={"peak":(zpeak, labelpeak)}
+transf1 = inv.branch(0) # left of peak
+transf2 = inv.branch(1) # right of peak
 
 
 sourceticks1 = list(np.arange(0.1, 0.85, 0.1))
 labelticks1 = sourceticks1 + [0.85, 0.86]
-labels1 = [(z_at_value(cosmo.kpc_proper_per_arcmin, value * f, zmax=zpeak), "{}".format(value)) for value in labelticks1]	
+labels1 = list(zip(transf1(labelticks1), ["{}".format(value) for value in labelticks1]))
 majticks1 = [value for (value, text) in labels1]
-medticks1 = [z_at_value(cosmo.kpc_proper_per_arcmin, value * f, zmax=zpeak) for value in cosmicruler.subticks(sourceticks1, 2)]
-minticks1 = [z_at_value(cosmo.kpc_proper_per_arcmin, value * f, zmax=zpeak) for value in cosmicruler.subticks(sourceticks1, 10)]
+medticks1 = list(transf1(cosmicruler.subticks(sourceticks1, 2)))
+minticks1 = list(transf1(cosmicruler.subticks(sourceticks1, 10)))
 
 
 labelticks2 = [0.001, 0.01, 0.1]
-labels2 = [(z_at_value(cosmo.kpc_proper_per_arcmin, value * f, zmax=zpeak), "{}".format(value)) for value in labelticks2]	
+labels2 = list(zip(transf1(labelticks2), ["{}".format(value) for value in labelticks2]))
 majticks2 = [value for (value, text) in labels2]
 medticks2 = []
-minticks2 = [z_at_value(cosmo.kpc_proper_per_arcmin, value * f, zmax=zpeak) for value in cosmicruler.subticks(labelticks2, 9)]
+minticks2 = list(transf1(cosmicruler.subticks(labelticks2, 9)))
 majticks2 = majticks2[:-1]
 labels2 = labels2[:-1]
 
 
-labels3 = [(z_at_value(cosmo.kpc_proper_per_arcmin, value * f, zmin=zpeak), "{}".format(value)) for value in [0.865, 0.86]]
+labelticks3 = [0.865, 0.86]
+labels3 = list(zip(transf2(labelticks3), ["{}".format(value) for value in labelticks3]))
 majticks3 = [value for (value, text) in labels3]
 medticks3 = []
 minticks3 = []
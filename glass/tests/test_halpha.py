@@ -1,4 +1,5 @@
 import cosmicruler
+import galcounts
 import astropy.table
 
 import matplotlib.pyplot as plt
@@ -6,12 +7,11 @@ import numpy as np
 
 
 
-cat = astropy.table.Table.read("2614.fits")
 subsamplefactor = (1./256.) # For 2614
 overal_square_degrees = 5000.0
 catfactor = (overal_square_degrees) * subsamplefactor
 
-print cat.colnames
+print(galcounts.catcolumns("2614.fits"))
 
 """
 "logf_halpha_model1"
@@ -22,28 +22,32 @@ print cat.colnames
 "euclid_vis", "random_index", "true_redshift_gal"
 """
 
-cat["f_halpha_model1_ext"] = 10.0**(cat["logf_halpha_model1_ext"])
-cat["f_halpha_model3_ext"] = 10.0**(cat["logf_halpha_model3_ext"])
-
-
-cat["f_halpha_avg_ext"] = 0.5 * (cat["f_halpha_model1_ext"] + cat["f_halpha_model3_ext"])
-cat["logf_halpha_avg_ext"] = np.log10(cat["f_halpha_avg_ext"])
-
-
-#cat = cat[cat["true_redshift_gal"] < 2.3]
-cat = cat[np.logical_and(cat["true_redshift_gal"] > 0.9, cat["true_redshift_gal"] < 1.82)]
-
-print "VIS < 24.5, per arcmin2 : ", np.sum(cat["euclid_vis"] < 24.5)/(catfactor*3600)
-print "NISP H < 24.0, per arcmin2 : ", np.sum(cat["euclid_nisp_h"] < 24.5)/(catfactor*3600)
-
-
-print "Ha (model1) > 2.e-16, per deg2 : ", np.sum(cat["f_halpha_model1_ext"] > 2.e-16)/(catfactor)
-print "Ha (model3) > 2.e-16, per deg2 : ", np.sum(cat["f_halpha_model3_ext"] > 2.e-16)/(catfactor)
-print "Ha (avg_model) > 2.e-16, per deg2 : ", np.sum(cat["f_halpha_avg_ext"] > 2.e-16)/(catfactor)
-
-print "NISP H < 24.0 and Ha (model1) > 2.e-16, per deg2 : ", np.sum(np.logical_and(cat["euclid_nisp_h"] < 24.0, cat["f_halpha_model1_ext"] > 2.e-16))/(catfactor)
-print "NISP H < 24.0 and Ha (model3) > 2.e-16, per deg2 : ", np.sum(np.logical_and(cat["euclid_nisp_h"] < 24.0, cat["f_halpha_model3_ext"] > 2.e-16))/(catfactor)
-print "NISP H < 24.0 and Ha (avg_model) > 2.e-16, per deg2 : ", np.sum(np.logical_and(cat["euclid_nisp_h"] < 24.0, cat["f_halpha_avg_ext"] > 2.e-16))/(catfactor)
+# One pass over the catalog for all selections, without filtered copies
+counts = galcounts.CumulativeCounts.fromselections("2614.fits", "true_redshift_gal",
+	selections={
+		"VIS < 24.5, per arcmin2": "euclid_vis < 24.5",
+		"NISP H < 24.0, per arcmin2": "euclid_nisp_h < 24.5",
+		"Ha (model1) > 2.e-16, per deg2": "f_halpha_model1_ext > 2.e-16",
+		"Ha (model3) > 2.e-16, per deg2": "f_halpha_model3_ext > 2.e-16",
+		"Ha (avg_model) > 2.e-16, per deg2": "f_halpha_avg_ext > 2.e-16",
+		"NISP H < 24.0 and Ha (model1) > 2.e-16, per deg2": "(euclid_nisp_h < 24.0) & (f_halpha_model1_ext > 2.e-16)",
+		"NISP H < 24.0 and Ha (model3) > 2.e-16, per deg2": "(euclid_nisp_h < 24.0) & (f_halpha_model3_ext > 2.e-16)",
+		"NISP H < 24.0 and Ha (avg_model) > 2.e-16, per deg2": "(euclid_nisp_h < 24.0) & (f_halpha_avg_ext > 2.e-16)",
+		},
+	derived={
+		"f_halpha_model1_ext": "10.0**logf_halpha_model1_ext",
+		"f_halpha_model3_ext": "10.0**logf_halpha_model3_ext",
+		"f_halpha_avg_ext": "0.5 * (f_halpha_model1_ext + f_halpha_model3_ext)",
+		"logf_halpha_avg_ext": "np.log10(f_halpha_avg_ext)",
+		})
+
+#(zmin, zmax) = (0.0, 2.3)
+(zmin, zmax) = (0.9, 1.82)
+
+for (name, histogram) in counts.items():
+	(nmin, nmax) = histogram.n([zmin, zmax])
+	factor = catfactor*3600 if name.endswith("arcmin2") else catfactor
+	print(name, ": ", (nmax - nmin)/factor)
 
 
 "http://euclid2017.london/slides/Wednesday/Session1/NISPStatus-Ealet.pdf"
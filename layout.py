@@ -0,0 +1,424 @@
+"""
+Layout stage: turns Scales and drawing parameters into plain arrays of segments and texts.
+github.com/mtewes/cosmicruler
+
+A RulerLayout holds everything needed to draw a ruler in svg coordinates, without any reference to
+cosmology or to the Scale objects. It can be saved (compact .npz, or .json) and rendered by the
+different backends without recomputing anything.
+
+Example:
+
+	lay = layout.RulerLayout(size=(1180, 1380))
+	lay.rect(insert=(0, 0), size=(1180, 1380), rx=5, ry=5, fill="none", stroke="red")
+	lay.addscale(scale, 12, 90, 1156, lw=2.0, tickl=25.0)
+	lay.save("glass-layout.npz")
+	layout.tosvgwrite(layout.RulerLayout.load("glass-layout.npz"), dwg)
+"""
+
+import re
+import json
+import hashlib
+
+import numpy as np
+
+import cosmicruler
+import fontmetrics
+import profiling
+
+
+# Kinds of segments and texts, in addition to cosmicruler.MAJ, MED, MIN (segments) and LABEL (texts)
+LINE = 4 # the main line of a scale
+TITLE = 5
+
+ANCHORS = ("start", "middle", "end")
+BASELINES = ("auto", "hanging", "central")
+
+SEGMENTFIELDS = ("segments", "segkind", "seggroup")
+TEXTFIELDS = ("textpos", "textrot", "textanchor", "textbaseline", "textkind", "textpriority", "textgroup")
+
+
+class RulerLayout(object):
+	"""Array-based description of a ruler drawing
+
+	segments : (N, 4) float64 array of x1, y1, x2, y2
+	segkind : uint8 kind of each segment (MAJ, MED, MIN or LINE)
+	seggroup : int32 index of the scale (group) of each segment
+	textpos : (M, 2) float64 array of text insertion points
+	textrot : rotation (in degrees, counterclockwise as on screen) of each text around its insertion point
+	textanchor, textbaseline : uint8 indices into ANCHORS and BASELINES
+	textkind : uint8 kind of each text (LABEL or TITLE)
+	textpriority : int32 priority of each text when texts overlap, lower is more important (see placelabels)
+	textgroup : int32 index of the scale (group) of each text
+	texts : list of the strings
+	groups : list of dicts (name, lw, labelstyle, titlestyle), one per scale
+	rects : list of dicts of svg rect attributes (frames)
+	"""
+
+	def __init__(self, size=None):
+		"""size : optional (width, height) of the drawing"""
+		self.size = size
+		self.groups = []
+		self.rects = []
+		self.texts = []
+		self.segments = np.empty((0, 4), dtype=np.float64)
+		self.segkind = np.empty(0, dtype=np.uint8)
+		self.seggroup = np.empty(0, dtype=np.int32)
+		self.textpos = np.empty((0, 2), dtype=np.float64)
+		self.textrot = np.empty(0, dtype=np.float64)
+		self.textanchor = np.empty(0, dtype=np.uint8)
+		self.textbaseline = np.empty(0, dtype=np.uint8)
+		self.textkind = np.empty(0, dtype=np.uint8)
+		self.textpriority = np.empty(0, dtype=np.int32)
+		self.textgroup = np.empty(0, dtype=np.int32)
+
+
+	def rect(self, insert, size, **attributes):
+		"""Adds a rectangle (e.g., a frame), attributes are as for svgwrite (rx, fill, stroke...)"""
+		rect = dict(x=insert[0], y=insert[1], width=size[0], height=size[1])
+		rect.update(attributes)
+		self.rects.append(rect)
+
+
+	def addsegments(self, segments, kind, group):
+		segments = np.asarray(segments, dtype=np.float64).reshape((-1, 4))
+		self.segments = np.concatenate((self.segments, segments))
+		self.segkind = np.concatenate((self.segkind, np.full(len(segments), kind, dtype=np.uint8)))
+		self.seggroup = np.concatenate((self.seggroup, np.full(len(segments), group, dtype=np.int32)))
+
+
+	def addtexts(self, texts, x, y, rot, anchor, baseline, kind, group, priority=0):
+		n = len(texts)
+		pos = np.empty((n, 2))
+		pos[:, 0] = x
+		pos[:, 1] = y
+		self.texts.extend(texts)
+		self.textpos = np.concatenate((self.textpos, pos))
+		for (name, value, dtype) in (("textrot", rot, np.float64), ("textanchor", ANCHORS.index(anchor), np.uint8),
+			("textbaseline", BASELINES.index(baseline), np.uint8), ("textkind", kind, np.uint8),
+			("textpriority", priority, np.int32), ("textgroup", group, np.int32)):
+			setattr(self, name, np.concatenate((getattr(self, name), np.broadcast_to(np.asarray(value, dtype=dtype), n))))
+
+
+	@profiling.timed("layout.addscale")
+	def addscale(self, scale, x0, y0, l,
+		lw=0.5, tickl=8.0,
+		labelspace=3.0, titlespace=5.0, labelstyle=None, titlestyle=None,
+		rotatelabels=False, switchside=False, ticktype=1,
+		textshiftx=0.0, textshifty=0.0):
+		"""Computes the layout of a cosmicruler.Scale (in relative positions p), with the arguments of Scale.simpledraw
+
+		x0 : svg x position of p=0
+		y0 : svg y position of p=0
+		l : svg lenght in x direction
+
+		Returns the index of the group of this scale.
+		"""
+		scale.clean()
+
+		if labelstyle is None:
+			labelstyle = "font-size:10;font-family:Helvetica Neue"
+		if titlestyle is None:
+			titlestyle = "font-size:12;font-family:CMU Serif"
+
+		group = len(self.groups)
+		self.groups.append(dict(name=scale.name, lw=lw, labelstyle=labelstyle, titlestyle=titlestyle))
+
+		# The main line
+		self.addsegments([x0-lw/2.0, y0, x0+l+lw/2.0, y0], LINE, group)
+
+		# The ticks
+		ticky = cosmicruler.tickextent(y0, lw, tickl, switchside, ticktype)
+		for cls in (cosmicruler.MAJ, cosmicruler.MED, cosmicruler.MIN):
+			x = x0 + scale.ticks.positions(cls) * l
+			segments = np.empty((len(x), 4))
+			segments[:, 0] = x
+			segments[:, 1] = ticky[cls][0]
+			segments[:, 2] = x
+			segments[:, 3] = ticky[cls][1]
+			self.addsegments(segments, cls, group)
+
+		# The labels
+		(y, anchor) = cosmicruler.labelplacement(y0, tickl, labelspace, rotatelabels, switchside)
+		if rotatelabels:
+			(rot, baseline) = (90.0, "central")
+		else:
+			(rot, baseline) = (0.0, "hanging")
+		x = x0 + scale.ticks.positions(cosmicruler.LABEL) * l + textshiftx
+		texts = scale.ticks.labeltexts()
+		self.addtexts(texts, x, y, rot, anchor, baseline, cosmicruler.LABEL, group, [labelpriority(text) for text in texts])
+
+		# The extras
+		if scale.extras is not None:
+			if "peak" in scale.extras:
+				(peakp, peaklabel) = scale.extras["peak"]
+				x = x0 + peakp * l
+				(ya, yb) = ticky[cosmicruler.MAJ]
+				self.addsegments([[x, ya, x-0.66*tickl, yb], [x, ya, x+0.66*tickl, yb]], cosmicruler.MAJ, group)
+				self.addtexts([peaklabel], x + textshiftx, y, rot, anchor, baseline, cosmicruler.LABEL, group)
+
+		# The title
+		(y, baseline) = cosmicruler.titleplacement(y0, titlespace, switchside, textshifty)
+		self.addtexts([scale.title], x0, y, 0.0, "start", baseline, TITLE, group)
+
+		return group
+
+
+	def stack(self, scales, x0, y0, dy, l, **kwargs):
+		"""Adds several scales, one below the other, separated by dy. kwargs are passed to addscale."""
+		for (i, scale) in enumerate(scales):
+			self.addscale(scale, x0, y0 + i * dy, l, **kwargs)
+
+
+	def segmentsof(self, group, kind):
+		"""(n, 4) array of the segments of a kind in a group, in the order in which they were added"""
+		return self.segments[np.logical_and(self.seggroup == group, self.segkind == kind)]
+
+
+	def textsof(self, group, kind):
+		"""Indices of the texts of a kind in a group"""
+		return np.nonzero(np.logical_and(self.textgroup == group, self.textkind == kind))[0]
+
+
+	def keeptexts(self, mask):
+		"""Removes the texts where mask is False"""
+		mask = np.asarray(mask, dtype=bool)
+		self.texts = [text for (text, keep) in zip(self.texts, mask) if keep]
+		for name in TEXTFIELDS:
+			setattr(self, name, getattr(self, name)[mask])
+
+
+	def textboxes(self, indices):
+		"""(n, 4) array of the estimated bounding boxes xmin, ymin, xmax, ymax of the texts with the given indices
+
+		The extents come from the font size of their style (see fontmetrics), the anchor, the baseline and the rotation.
+		"""
+		indices = np.asarray(indices, dtype=np.int64)
+		sizes = np.array([[fontmetrics.parsestyle(params["labelstyle"])[0], fontmetrics.parsestyle(params["titlestyle"])[0]]
+			for params in self.groups]).reshape((-1, 2))
+		size = sizes[self.textgroup[indices], (self.textkind[indices] == TITLE).astype(np.int64)]
+		width = fontmetrics.textwidths([self.texts[i] for i in indices], 1.0) * size
+		height = (fontmetrics.ASCENT + fontmetrics.DESCENT) / 1000.0 * size
+
+		# Extent along the text (u) and across it (v, downwards), relative to the insertion point
+		u0 = -width * np.array([0.0, 0.5, 1.0])[self.textanchor[indices]]
+		top = np.array([-fontmetrics.ASCENT, 0.0, -0.5 * (fontmetrics.ASCENT + fontmetrics.DESCENT)]) / 1000.0 # for each of BASELINES
+		v0 = size * top[self.textbaseline[indices]]
+		theta = np.radians(-self.textrot[indices])
+		(cos, sin) = (np.cos(theta), np.sin(theta))
+		(x, y) = (np.empty((len(indices), 4)), np.empty((len(indices), 4)))
+		for (k, (u, v)) in enumerate(((u0, v0), (u0 + width, v0), (u0, v0 + height), (u0 + width, v0 + height))):
+			x[:, k] = self.textpos[indices, 0] + u * cos - v * sin
+			y[:, k] = self.textpos[indices, 1] + u * sin + v * cos
+		return np.stack((x.min(axis=1), y.min(axis=1), x.max(axis=1), y.max(axis=1)), axis=1)
+
+
+	@profiling.timed("layout.placelabels")
+	def placelabels(self, gap=1.0, nudge=0.0):
+		"""Removes the labels that overlap labels of higher priority (lower textpriority, then added first)
+
+		gap : minimal distance between labels, in svg units
+		nudge : labels overlapping only on one side are first moved along x by up to this distance, instead of being removed
+
+		The overlaps are found with a sweep over the labels sorted by position (see overlaps), so this scales to many labels.
+		Returns the number of removed labels.
+		"""
+		labels = np.nonzero(self.textkind == cosmicruler.LABEL)[0]
+		boxes = self.textboxes(labels)
+		boxes[:, :2] -= 0.5 * gap
+		boxes[:, 2:] += 0.5 * gap
+		rank = np.empty(len(labels), dtype=np.int64)
+		rank[np.lexsort((labels, self.textpriority[labels]))] = np.arange(len(labels))
+
+		if nudge > 0.0:
+			shift = nudges(boxes, rank, *overlaps(boxes), maxshift=nudge)
+			self.textpos[labels, 0] += shift
+			boxes[:, 0] += shift
+			boxes[:, 2] += shift
+
+		keep = np.ones(len(self.texts), dtype=bool)
+		keep[labels] = greedykeep(rank, *overlaps(boxes))
+		if not np.all(keep):
+			self.keeptexts(keep)
+		return int(np.sum(~keep))
+
+
+	def extent(self, margin=10.0):
+		"""(width, height) of the drawing: its size, or (if it has none) the extent of the segments, texts and rectangles plus margin"""
+		if self.size is not None:
+			return tuple(float(value) for value in self.size)
+		x = [0.0] + [r["x"] + r["width"] for r in self.rects] + self.segments[:, [0, 2]].ravel().tolist() + self.textpos[:, 0].tolist()
+		y = [0.0] + [r["y"] + r["height"] for r in self.rects] + self.segments[:, [1, 3]].ravel().tolist() + self.textpos[:, 1].tolist()
+		return (max(x) + margin, max(y) + margin)
+
+
+	def grouphash(self, group):
+		"""Hash of everything drawn in a group (a scale), to find out which scales changed between two layouts"""
+		sha = hashlib.sha1(json.dumps(self.groups[group], sort_keys=True).encode("utf-8"))
+		segsel = self.seggroup == group
+		for array in (self.segments[segsel], self.segkind[segsel]):
+			sha.update(np.ascontiguousarray(array).tobytes())
+		textsel = self.textgroup == group
+		for name in TEXTFIELDS[:-2]: # the priorities and groups are not drawn
+			sha.update(np.ascontiguousarray(getattr(self, name)[textsel]).tobytes())
+		sha.update(json.dumps([self.texts[i] for i in np.nonzero(textsel)[0]]).encode("utf-8"))
+		return sha.hexdigest()
+	
+	
+	def rectshash(self):
+		"""Hash of the rectangles (and the size) of the layout"""
+		return hashlib.sha1(json.dumps([self.size, self.rects], sort_keys=True).encode("utf-8")).hexdigest()
+	
+	
+	def save(self, filepath):
+		"""Writes the layout to a .json file, or a compressed .npz file for any other extension"""
+		meta = dict(size=self.size, groups=self.groups, rects=self.rects, texts=self.texts)
+		arrays = dict((name, getattr(self, name)) for name in SEGMENTFIELDS + TEXTFIELDS)
+		if filepath.endswith(".json"):
+			meta.update(dict((name, array.tolist()) for (name, array) in arrays.items()))
+			with open(filepath, "w") as f:
+				json.dump(meta, f)
+		else:
+			np.savez_compressed(filepath, meta=np.array(json.dumps(meta)), **arrays)
+
+
+	@classmethod
+	def load(cls, filepath):
+		"""Reads a layout written by save()"""
+		if filepath.endswith(".json"):
+			with open(filepath) as f:
+				meta = json.load(f)
+			arrays = meta
+		else:
+			with np.load(filepath) as data:
+				arrays = dict((name, data[name]) for name in SEGMENTFIELDS + TEXTFIELDS if name in data)
+				meta = json.loads(str(data["meta"]))
+		if "textpriority" not in arrays: # written before the priorities existed
+			arrays["textpriority"] = np.zeros(len(meta["texts"]))
+		lay = cls(size=meta["size"])
+		lay.groups = meta["groups"]
+		lay.rects = meta["rects"]
+		lay.texts = meta["texts"]
+		for name in SEGMENTFIELDS + TEXTFIELDS:
+			template = getattr(lay, name)
+			setattr(lay, name, np.asarray(arrays[name], dtype=template.dtype).reshape((-1,) + template.shape[1:]))
+		return lay
+
+
+def labelpriority(text):
+	"""Priority of a label, lower is more important: 1 + the number of significant digits of a number, so that round values win"""
+	mantissa = text.strip().lstrip("+-").split("e")[0]
+	if not re.fullmatch(r"[0-9]*\.?[0-9]*", mantissa):
+		return 1 + len(text)
+	return 1 + len(mantissa.replace(".", "").strip("0"))
+
+
+def overlaps(boxes):
+	"""Pairs (a, b) of indices of overlapping boxes (xmin, ymin, xmax, ymax)
+
+	Instead of testing all pairs, the boxes are sorted by xmin, and each one is only tested against those starting
+	before its xmax (found by a binary search), so the cost grows with the number of boxes times the local crowding.
+	"""
+	n = len(boxes)
+	order = np.argsort(boxes[:, 0], kind="stable")
+	xmin = boxes[order, 0]
+	counts = np.maximum(np.searchsorted(xmin, boxes[order, 2], side="left") - np.arange(n) - 1, 0)
+	i = np.repeat(np.arange(n), counts)
+	j = i + 1 + np.arange(len(i)) - np.repeat(np.cumsum(counts) - counts, counts)
+	(a, b) = (order[i], order[j])
+	overlapping = np.logical_and(boxes[a, 1] < boxes[b, 3], boxes[b, 1] < boxes[a, 3])
+	return (a[overlapping], b[overlapping])
+
+
+def greedykeep(rank, a, b):
+	"""Boolean mask of the boxes to keep so that no kept boxes overlap, given the pairs (a, b) of overlapping boxes
+
+	Goes once through the boxes by increasing rank, and keeps each one that does not overlap an already kept one.
+	The neighbours of each box are found in an adjacency array (CSR, sorted by box), so this is linear in the number
+	of boxes and pairs.
+	"""
+	n = len(rank)
+	src = np.concatenate((a, b))
+	dst = np.concatenate((b, a))[np.argsort(src, kind="stable")]
+	indptr = np.zeros(n + 1, dtype=np.int64)
+	np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+	(indptr, dst) = (indptr.tolist(), dst.tolist()) # plain lists are faster to index in the loop
+	keep = np.zeros(n, dtype=bool)
+	removed = bytearray(n)
+	for i in np.argsort(rank, kind="stable").tolist():
+		if removed[i]:
+			continue
+		keep[i] = True
+		for j in dst[indptr[i]:indptr[i+1]]:
+			removed[j] = 1
+	return keep
+
+
+def nudges(boxes, rank, a, b, maxshift):
+	"""Shifts along x of the boxes that would remove their overlaps with the boxes of lower rank, if they are all on
+	the same side and the shift is not larger than maxshift (0 otherwise)
+	"""
+	swap = rank[a] > rank[b] # so that b is the box to move
+	(a, b) = (np.where(swap, b, a), np.where(swap, a, b))
+	toright = boxes[b, 0] + boxes[b, 2] >= boxes[a, 0] + boxes[a, 2]
+	right = np.zeros(len(boxes))
+	left = np.zeros(len(boxes))
+	np.maximum.at(right, b[toright], boxes[a[toright], 2] - boxes[b[toright], 0])
+	np.minimum.at(left, b[~toright], boxes[a[~toright], 0] - boxes[b[~toright], 2])
+	shift = right + left
+	shift[np.logical_and(right > 0.0, left < 0.0)] = 0.0
+	shift[np.abs(shift) > maxshift] = 0.0
+	return shift
+
+
+@profiling.timed("layout.tosvgwrite")
+def tosvgwrite(lay, dwg):
+	"""Renders a RulerLayout with svgwrite, onto the Drawing dwg. Returns the list of the groups of the scales."""
+	for rect in lay.rects:
+		rect = dict(rect)
+		dwg.add(dwg.rect(insert=(rect.pop("x"), rect.pop("y")), size=(rect.pop("width"), rect.pop("height")), **rect))
+
+	scalegs = []
+	for (group, params) in enumerate(lay.groups):
+		name = params["name"]
+		lw = params["lw"]
+		scaleg = dwg.add(dwg.g(id=name+'-scale'))
+		for (x1, y1, x2, y2) in lay.segmentsof(group, LINE).tolist():
+			scaleg.add(dwg.line(start=(x1, y1), end=(x2, y2), style="stroke:black;stroke-width:{}".format(lw)))
+
+		for (kind, suffix) in ((cosmicruler.MAJ, "-majticks"), (cosmicruler.MED, "-medticks"), (cosmicruler.MIN, "-minticks")):
+			ticksg = scaleg.add(dwg.g(id=name+suffix))
+			ticksg.stroke('black', width=lw)
+			for (x1, y1, x2, y2) in lay.segmentsof(group, kind).tolist():
+				ticksg.add(dwg.line(start=(x1, y1), end=(x2, y2)))
+
+		labelsg = scaleg.add(dwg.g(id=name+'-labels', style=params["labelstyle"]))
+		for i in lay.textsof(group, cosmicruler.LABEL):
+			labelsg.add(svgwritetext(lay, dwg, i))
+
+		titleg = scaleg.add(dwg.g(id=name+'-title', text_anchor="start", style=params["titlestyle"]))
+		for i in lay.textsof(group, TITLE):
+			(x, y) = lay.textpos[i].tolist()
+			titleg.add(dwg.text(lay.texts[i], insert=(x, y), alignment_baseline=BASELINES[lay.textbaseline[i]]))
+		scalegs.append(scaleg)
+
+	return scalegs
+
+
+def svgwritefile(lay, filepath, pretty=False):
+	"""Writes a RulerLayout to an svg file with svgwrite, this is the "svgwrite" renderer of cosmicruler.render"""
+	import svgwrite
+	size = ("100%", "100%") if lay.size is None else lay.size
+	dwg = svgwrite.Drawing(filepath, size=size, profile='full', debug=True)
+	tosvgwrite(lay, dwg)
+	with profiling.stage("Drawing.save"):
+		dwg.save(pretty=pretty)
+
+
+def svgwritetext(lay, dwg, i):
+	"""svgwrite text element for text i of the layout"""
+	(x, y) = lay.textpos[i].tolist()
+	kwargs = dict(text_anchor=ANCHORS[lay.textanchor[i]], alignment_baseline=BASELINES[lay.textbaseline[i]])
+	if lay.textrot[i] != 0.0:
+		kwargs["transform"] = "rotate({:g}, {}, {})".format(-lay.textrot[i], x, y)
+	return dwg.text(lay.texts[i], insert=(x, y), **kwargs)
+
@@ -0,0 +1,344 @@
+"""
+PDF renderer: writes a layout.RulerLayout as a one-page PDF, ready for print production.
+github.com/mtewes/cosmicruler
+
+The content stream is written from the arrays of the layout: each class of ticks of a scale is a single path
+(one "m ... l" pair per tick, stroked once), and the stream is compressed. One svg unit (a pixel at 96 dpi) is 0.75 pt.
+
+Texts can use a simple TeX-like markup, so that titles need no manual editing afterwards:
+
+	"H\\alpha{} > 2 \\cdot 10^{-16} erg s^{-1} cm^{-2}"
+
+^{...} and _{...} are superscripts and subscripts (^x for a single character), braces group, and \\alpha ... \\Omega, \\cdot, \\times,
+\\pm, \\sim, \\leq, \\geq and \\infty are symbols (as are the corresponding unicode characters).
+The texts are set in a TrueType font embedded as a subset of the glyphs that are used: the font="path/to/font.ttf"
+given to renderfile, or by default the first of DEFAULTFONTS found on the system. This needs fontTools; without
+it (or with font="Helvetica") the texts use the standard Helvetica font, which every PDF reader has and which is
+not embedded. The symbols are always set in the standard Symbol font.
+
+Example:
+
+	pdfrender.renderfile(lay, "glass.pdf")
+
+or cosmicruler.render(lay, "glass.pdf"), as this is the "pdf" renderer.
+"""
+
+import io
+import os
+import zlib
+import hashlib
+
+import numpy as np
+
+import cosmicruler
+import fontmetrics
+import layout
+import pngrender
+import profiling
+import svgstream
+
+
+PT = 0.75 # points per svg unit
+
+# Symbols of the markup: name, unicode character, code in the Symbol font, width (in 1/1000 of the font size)
+SYMBOLS = [
+	("alpha", "\u03b1", "a", 631), ("beta", "\u03b2", "b", 549), ("gamma", "\u03b3", "g", 411), ("delta", "\u03b4", "d", 494),
+	("epsilon", "\u03b5", "e", 439), ("zeta", "\u03b6", "z", 494), ("eta", "\u03b7", "h", 603), ("theta", "\u03b8", "q", 521),
+	("iota", "\u03b9", "i", 329), ("kappa", "\u03ba", "k", 549), ("lambda", "\u03bb", "l", 549), ("mu", "\u03bc", "m", 576),
+	("nu", "\u03bd", "n", 521), ("xi", "\u03be", "x", 493), ("pi", "\u03c0", "p", 549), ("rho", "\u03c1", "r", 549),
+	("sigma", "\u03c3", "s", 603), ("tau", "\u03c4", "t", 439), ("phi", "\u03c6", "f", 521), ("chi", "\u03c7", "c", 549),
+	("psi", "\u03c8", "y", 686), ("omega", "\u03c9", "w", 686),
+	("Gamma", "\u0393", "G", 603), ("Delta", "\u0394", "D", 612), ("Theta", "\u0398", "Q", 741), ("Lambda", "\u039b", "L", 686),
+	("Xi", "\u039e", "X", 645), ("Pi", "\u03a0", "P", 768), ("Sigma", "\u03a3", "S", 592), ("Phi", "\u03a6", "F", 763),
+	("Psi", "\u03a8", "Y", 795), ("Omega", "\u03a9", "W", 768),
+	("cdot", "\u22c5", "\xd7", 250), ("times", "\u00d7", "\xb4", 549), ("pm", "\u00b1", "\xb1", 549), ("sim", "\u223c", "~", 549),
+	("leq", "\u2264", "\xa3", 549), ("geq", "\u2265", "\xb3", 549), ("infty", "\u221e", "\xa5", 713),
+]
+SYMBOLNAMES = dict((name, char) for (name, char, code, width) in SYMBOLS)
+SYMBOLCODES = dict((char, (code, width)) for (name, char, code, width) in SYMBOLS)
+
+SCRIPTSIZE = 0.7 # font size of superscripts and subscripts, relative to the text
+RISES = (0.0, 0.4, -0.15) # baseline shift of normal text, superscripts and subscripts, relative to the font size
+
+
+def parsemarkup(text):
+	"""List of the runs (string, symbol, script) of a text with markup, where symbol tells if the string is made of
+	SYMBOLS characters, and script is 0 for normal text, 1 for superscripts and 2 for subscripts"""
+	runs = []
+	def add(chars, script):
+		for char in chars:
+			symbol = char in SYMBOLCODES
+			if len(runs) > 0 and runs[-1][1:] == (symbol, script):
+				runs[-1] = (runs[-1][0] + char, symbol, script)
+			else:
+				runs.append((char, symbol, script))
+
+	scripts = [0] # of the nested groups {...}
+	single = None # script of the next token only, after ^ or _ without braces
+	i = 0
+	while i < len(text):
+		char = text[i]
+		if char in "^_" and i + 1 < len(text):
+			if text[i + 1] == "{":
+				scripts.append("^_".index(char) + 1)
+				i += 2
+			else:
+				single = "^_".index(char) + 1
+				i += 1
+			continue
+		if char == "{":
+			scripts.append(scripts[-1])
+			i += 1
+			continue
+		if char == "}" and len(scripts) > 1:
+			scripts.pop()
+			i += 1
+			continue
+		if char == "\\" and i + 1 < len(text):
+			j = i + 1
+			while j < len(text) and text[j].isalpha():
+				j += 1
+			name = text[i+1:j]
+			if name in SYMBOLNAMES:
+				token = SYMBOLNAMES[name]
+				if j < len(text) and text[j] == " ": # the space ending a command, as in TeX (use {} to keep it)
+					j += 1
+			elif j == i + 1: # an escaped character, e.g. \{ or \^
+				(token, j) = (text[j], j + 1)
+			else:
+				(token, j) = (text[i:j], j)
+			add(token, single or scripts[-1])
+			single = None
+			i = j
+			continue
+		add(char, single or scripts[-1])
+		single = None
+		i += 1
+	return runs
+
+
+def pdfstring(data):
+	"""PDF literal string of bytes"""
+	return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)").replace(b"\r", b"\\r") + b")"
+
+
+def pdfnums(*values):
+	"""Space-separated compact numbers, as bytes"""
+	return " ".join(svgstream.num(value) for value in values).encode("ascii")
+
+
+# TrueType fonts embedded by default, the first one that exists is used (Liberation Sans has the widths of Helvetica)
+DEFAULTFONTS = [
+	"/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+	"/usr/share/fonts/liberation-sans/LiberationSans-Regular.ttf",
+	"/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+	"/usr/share/fonts/dejavu/DejaVuSans.ttf",
+	"/System/Library/Fonts/Supplemental/Arial.ttf",
+	"/Library/Fonts/Arial.ttf",
+	"C:\\Windows\\Fonts\\arial.ttf",
+]
+
+
+def defaultfont():
+	"""Path of the TrueType font to embed by default (see DEFAULTFONTS), None for Helvetica if there is none or no fontTools"""
+	try:
+		import fontTools
+	except ImportError:
+		return None
+	for path in DEFAULTFONTS:
+		if os.path.exists(path):
+			return path
+	return None
+
+
+class Font(object):
+	"""A text font of the PDF: the standard Helvetica, or an embedded subset of a TrueType font"""
+
+	def __init__(self, path=None):
+		"""path : TrueType font file to embed, None for Helvetica"""
+		self.path = path
+		self.widths = np.concatenate((fontmetrics.WIDTHS, np.full(128, fontmetrics.DEFAULTWIDTH))) # of the 256 WinAnsi codes
+		self.used = set()
+		if path is not None:
+			from fontTools import ttLib
+			self.ttf = ttLib.TTFont(path)
+			upem = float(self.ttf["head"].unitsPerEm)
+			cmap = self.ttf.getBestCmap()
+			hmtx = self.ttf["hmtx"]
+			for code in range(32, 256):
+				glyph = cmap.get(ord(bytes([code]).decode("cp1252", "replace")))
+				self.widths[code] = hmtx[glyph][0] * 1000.0 / upem if glyph is not None else 0.0
+
+	def encode(self, text):
+		"""WinAnsi bytes of a text (other characters become ?), and records the characters used for the subset"""
+		data = text.encode("cp1252", "replace")
+		self.used.update(data.decode("cp1252"))
+		return data
+
+	def objects(self, first):
+		"""PDF objects of the font (the first is the font dictionary), to be numbered from first"""
+		if self.path is None:
+			return [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"]
+		from fontTools import subset
+
+		options = subset.Options()
+		options.notdef_outline = True
+		options.name_IDs = ["*"]
+		options.drop_tables += ["FFTM"] # FontForge timestamps, which fontTools warns about
+		subsetter = subset.Subsetter(options)
+		subsetter.populate(unicodes=[ord(char) for char in self.used])
+		subsetter.subset(self.ttf)
+		out = io.BytesIO()
+		self.ttf.save(out)
+		data = out.getvalue()
+
+		upem = float(self.ttf["head"].unitsPerEm)
+		scaled = lambda value: int(round(value * 1000.0 / upem))
+		head = self.ttf["head"]
+		hhea = self.ttf["hhea"]
+		capheight = getattr(self.ttf["OS/2"], "sCapHeight", hhea.ascent) if "OS/2" in self.ttf else hhea.ascent
+		psname = (self.ttf["name"].getDebugName(6) or "Font").replace(" ", "")
+		tag = "".join(chr(65 + c % 26) for c in hashlib.sha1("".join(sorted(self.used)).encode("utf-8")).digest()[:6])
+		widths = " ".join("{:g}".format(round(width)) for width in self.widths[32:])
+		return [
+			"<< /Type /Font /Subtype /TrueType /BaseFont /{}+{} /FirstChar 32 /LastChar 255 /Widths [{}] "
+				"/Encoding /WinAnsiEncoding /FontDescriptor {} 0 R >>".format(tag, psname, widths, first + 1).encode("ascii"),
+			"<< /Type /FontDescriptor /FontName /{}+{} /Flags 32 /FontBBox [{} {} {} {}] /ItalicAngle 0 /Ascent {} /Descent {} "
+				"/CapHeight {} /StemV 80 /FontFile2 {} 0 R >>".format(tag, psname, scaled(head.xMin), scaled(head.yMin),
+				scaled(head.xMax), scaled(head.yMax), scaled(hhea.ascent), scaled(hhea.descent), scaled(capheight), first + 2).encode("ascii"),
+			stream(data, Length1=len(data)),
+		]
+
+
+def stream(data, **entries):
+	"""PDF stream object of data, compressed"""
+	data = zlib.compress(data, 6)
+	entries = "".join(" /{} {}".format(key, value) for (key, value) in entries.items())
+	return "<< /Length {} /Filter /FlateDecode{} >>\nstream\n".format(len(data), entries).encode("ascii") + data + b"\nendstream"
+
+
+def segmentspath(segments):
+	"""Path operators drawing (n, 4) segments x1, y1, x2, y2, all at once"""
+	if len(segments) == 0:
+		return b""
+	columns = [svgstream.nums(segments[:, k]) for k in range(4)]
+	ops = columns[0]
+	for (sep, column) in zip((" ", " m ", " "), columns[1:]):
+		ops = np.char.add(np.char.add(ops, sep), column)
+	return (" l\n".join(ops.tolist()) + " l\nS\n").encode("ascii")
+
+
+def rectpath(x, y, w, h, rx=0.0, ry=0.0):
+	"""Path operators of a rectangle, with rounded corners of radii rx and ry (as in svg)"""
+	rx = min(rx or ry, 0.5 * w)
+	ry = min(ry or rx, 0.5 * h)
+	if rx <= 0.0 or ry <= 0.0:
+		return pdfnums(x, y, w, h) + b" re\n"
+	(kx, ky) = (0.4477 * rx, 0.4477 * ry) # control points of the quarter ellipses, 1 - 0.5523
+	ops = [pdfnums(x + rx, y) + b" m", pdfnums(x + w - rx, y) + b" l",
+		pdfnums(x + w - kx, y, x + w, y + ky, x + w, y + ry) + b" c", pdfnums(x + w, y + h - ry) + b" l",
+		pdfnums(x + w, y + h - ky, x + w - kx, y + h, x + w - rx, y + h) + b" c", pdfnums(x + rx, y + h) + b" l",
+		pdfnums(x + kx, y + h, x, y + h - ky, x, y + h - ry) + b" c", pdfnums(x, y + ry) + b" l",
+		pdfnums(x, y + ky, x + kx, y, x + rx, y) + b" c", b"h"]
+	return b"\n".join(ops) + b"\n"
+
+
+def rgb(color):
+	"""PDF color components (from 0 to 1) of an RGB tuple"""
+	return pdfnums(*[c / 255.0 for c in color])
+
+
+def textops(font, text, x, y, size, rot=0.0, anchor=0, baseline=0):
+	"""Text object drawing a text with markup at (x, y), with anchor and baseline given as indices into layout.ANCHORS and BASELINES"""
+	runs = []
+	width = 0.0
+	for (string, symbol, script) in parsemarkup(text):
+		runsize = size * (SCRIPTSIZE if script else 1.0)
+		if symbol:
+			codes = [SYMBOLCODES[char] for char in string]
+			data = "".join(code for (code, w) in codes).encode("latin-1")
+			width += runsize * sum(w for (code, w) in codes) / 1000.0
+		else:
+			data = font.encode(string)
+			width += runsize * np.sum(font.widths[np.frombuffer(data, dtype=np.uint8)]) / 1000.0
+		runs.append((b"/F2" if symbol else b"/F1", runsize, RISES[script] * size, data))
+
+	# The text matrix, in the flipped (svg-like) coordinates of the page: the text runs along angle a, its up is -v
+	a = np.radians(-rot)
+	(cos, sin) = (np.cos(a), np.sin(a))
+	u = -width * (0.0, 0.5, 1.0)[anchor]
+	v = size * (0.0, fontmetrics.ASCENT, 0.5 * (fontmetrics.ASCENT - fontmetrics.DESCENT))[baseline] / 1000.0
+	ops = [b"BT", pdfnums(cos, sin, sin, -cos, x + u * cos - v * sin, y + u * sin + v * cos) + b" Tm"]
+	for (name, runsize, rise, data) in runs:
+		ops.append(name + b" " + pdfnums(runsize) + b" Tf " + pdfnums(rise) + b" Ts " + pdfstring(data) + b" Tj")
+	ops.append(b"ET\n")
+	return b"\n".join(ops)
+
+
+@profiling.timed("pdfrender.content")
+def content(lay, font):
+	"""Content stream (uncompressed) drawing the layout, in svg units"""
+	out = []
+	for rect in lay.rects:
+		(x, y, w, h) = [float(rect[key]) for key in ("x", "y", "width", "height")]
+		path = rectpath(x, y, w, h, float(rect.get("rx", 0.0)), float(rect.get("ry", 0.0)))
+		fill = pngrender.parsecolor(rect.get("fill"), default=(0, 0, 0))
+		stroke = pngrender.parsecolor(rect.get("stroke"), default=None)
+		sw = float(rect.get("stroke_width", rect.get("stroke-width", 1.0)))
+		if fill is not None:
+			out.append(b"q " + rgb(fill) + b" rg\n" + path + b"f Q\n")
+		if stroke is not None:
+			out.append(b"q " + rgb(stroke) + b" RG " + pdfnums(sw) + b" w\n" + path + b"S Q\n")
+
+	for (group, params) in enumerate(lay.groups):
+		out.append(pdfnums(params["lw"]) + b" w\n")
+		for kind in (layout.LINE, cosmicruler.MAJ, cosmicruler.MED, cosmicruler.MIN):
+			out.append(segmentspath(lay.segmentsof(group, kind)))
+		for (kind, style) in ((cosmicruler.LABEL, params["labelstyle"]), (layout.TITLE, params["titlestyle"])):
+			size = fontmetrics.parsestyle(style)[0]
+			for i in lay.textsof(group, kind):
+				anchor = 0 if kind == layout.TITLE else lay.textanchor[i] # titles are drawn with text-anchor start
+				out.append(textops(font, lay.texts[i], lay.textpos[i, 0], lay.textpos[i, 1], size, lay.textrot[i],
+					anchor, lay.textbaseline[i]))
+	return b"".join(out)
+
+
+def document(objects):
+	"""PDF file of the objects (bytes), numbered from 1, the first being the catalog"""
+	out = io.BytesIO()
+	out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+	offsets = []
+	for (number, obj) in enumerate(objects, start=1):
+		offsets.append(out.tell())
+		out.write("{} 0 obj\n".format(number).encode("ascii") + obj + b"\nendobj\n")
+	xref = out.tell()
+	out.write("xref\n0 {}\n0000000000 65535 f \n".format(len(objects) + 1).encode("ascii"))
+	out.write("".join("{:010d} 00000 n \n".format(offset) for offset in offsets).encode("ascii"))
+	out.write("trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n".format(len(objects) + 1, xref).encode("ascii"))
+	return out.getvalue()
+
+
+def renderfile(lay, filepath, font=None):
+	"""Writes a layout.RulerLayout as PDF, this is the "pdf" renderer of cosmicruler.render
+
+	font : TrueType font file, embedded as subset, for all texts except the symbols (default: see defaultfont),
+		or "Helvetica" for the standard font
+	"""
+	if font is None:
+		font = defaultfont()
+	font = Font(None if font == "Helvetica" else font)
+	(width, height) = lay.extent(margin=30.0)
+	# The page is in points with y upwards, the content is drawn in svg units with y downwards
+	data = pdfnums(PT, 0, 0, -PT, 0, height * PT) + b" cm\n" + content(lay, font)
+	with profiling.stage("pdfrender.write"):
+		objects = [
+			b"<< /Type /Catalog /Pages 2 0 R >>",
+			b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+			b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 " + pdfnums(width * PT, height * PT) + b"] /Contents 4 0 R "
+				b"/Resources << /Font << /F1 6 0 R /F2 5 0 R >> >> >>",
+			stream(data),
+			b"<< /Type /Font /Subtype /Type1 /BaseFont /Symbol >>",
+		]
+		objects.extend(font.objects(len(objects) + 1)) # the text font, now that all texts are encoded
+		with open(filepath, "wb") as f:
+			f.write(document(objects))
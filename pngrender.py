@@ -0,0 +1,265 @@
+"""
+Raster renderer: draws a layout.RulerLayout into a numpy image, and writes it as PNG, for quick previews.
+github.com/mtewes/cosmicruler
+
+Everything is done with numpy (and zlib for the PNG): the ticks of each class are drawn at once, by computing
+the anti-aliased coverage of all their pixels as one array and scattering it into the image. Texts are drawn
+with a small 5x7 pixel font, scaled to the font size and cached as an atlas of anti-aliased glyphs.
+
+Example:
+
+	pngrender.renderfile(lay, "glass.png", dpi=150)
+
+or cosmicruler.render(lay, "glass.png"), as this is the "png" renderer.
+"""
+
+import zlib
+import struct
+import functools
+
+import numpy as np
+
+import cosmicruler
+import layout
+import profiling
+
+
+# The 5x7 glyphs of the characters 32 to 126, as 7 rows (from the top, the last on the baseline) of 5 bits (the highest is the leftmost pixel)
+GLYPHS = (
+	"00000000000000", "04040404000004", "0A0A0A00000000", "0A0A1F0A1F0A0A", "040F140E051E04", "18190204081303", # space ! " # $ %
+	"0C12140815120D", "0C040800000000", "02040808080402", "08040202020408", "0004150E150400", "0004041F040400", # & ' ( ) * +
+	"000000000C0408", "0000001F000000", "00000000000C0C", "00010204081000", "0E11131519110E", "040C040404040E", # , - . / 0 1
+	"0E11010204081F", "1F02040201110E", "02060A121F0202", "1F101E0101110E", "0608101E11110E", "1F010204080808", # 2 3 4 5 6 7
+	"0E11110E11110E", "0E11110F01020C", "000C0C000C0C00", "000C0C000C0408", "02040810080402", "00001F001F0000", # 8 9 : ; < =
+	"08040201020408", "0E110102040004", "0E11010D15150E", "0E1111111F1111", "1E11111E11111E", "0E11101010110E", # > ? @ A B C
+	"1C12111111121C", "1F10101E10101F", "1F10101E101010", "0E11101711110F", "1111111F111111", "0E04040404040E", # D E F G H I
+	"0702020202120C", "11121418141211", "1010101010101F", "111B1515111111", "11111915131111", "0E11111111110E", # J K L M N O
+	"1E11111E101010", "0E11111115120D", "1E11111E141211", "0F10100E01011E", "1F040404040404", "1111111111110E", # P Q R S T U
+	"11111111110A04", "1111111515150A", "11110A040A1111", "1111110A040404", "1F01020408101F", "0E08080808080E", # V W X Y Z [
+	"00100804020100", "0E02020202020E", "040A1100000000", "0000000000001F", "08040200000000", "00000E010F110F", # \ ] ^ _ ` a
+	"1010161911111E", "00000E1010110E", "01010D1311110F", "00000E111F100E", "0609081C080808", "000F11110F010E", # b c d e f g
+	"10101619111111", "04000C0404040E", "0200060202120C", "10101214181412", "0C04040404040E", "00001A15151111", # h i j k l m
+	"00001619111111", "00000E1111110E", "00001E111E1010", "00000D130F0101", "00001619101010", "00000E100E011E", # n o p q r s
+	"08081C08080906", "0000111111130D", "00001111110A04", "0000111115150A", "0000110A040A11", "000011110F010E", # t u v w x y
+	"00001F0204081F", "02040408040402", "04040404040404", "08040402040408", "0000000D120000", # z { | } ~
+)
+
+# 8 rows for the lowercase letters that go below the baseline
+DESCENDERS = {"g": "00000F11110F010E", "j": "020006020202120C", "p": "00001E11111E1010", "q": "00000F11110F0101",
+	"y": "00001111110F010E"}
+
+COLORS = {"black": (0, 0, 0), "white": (255, 255, 255), "red": (255, 0, 0), "green": (0, 128, 0), "blue": (0, 0, 255),
+	"gray": (128, 128, 128), "grey": (128, 128, 128)}
+
+
+def parsecolor(color, default=(0, 0, 0)):
+	"""RGB tuple of an svg color (a name of COLORS or #rrggbb), None for "none" """
+	if color is None:
+		return default
+	color = str(color).strip().lower()
+	if color == "none":
+		return None
+	if color.startswith("#") and len(color) == 7:
+		return tuple(int(color[i:i+2], 16) for i in (1, 3, 5))
+	return COLORS.get(color, default)
+
+
+def coverage(a, b):
+	"""Fraction of each pixel covered by the intervals [a, b] (arrays of n pixel coordinates)
+
+	Returns (first pixel, (n, k) array of the coverages of the k pixels from the first one).
+	"""
+	first = np.floor(a).astype(np.int64)
+	k = int(np.max(np.ceil(b) - first)) if len(a) > 0 else 0
+	pixels = first[:, None] + np.arange(max(k, 1))
+	return (first, np.clip(np.minimum(b[:, None], pixels + 1) - np.maximum(a[:, None], pixels), 0.0, 1.0))
+
+
+def sizebatches(*spans):
+	"""Index arrays of batches of shapes with similar spans (arrays of their sizes in pixels along each axis)
+
+	The spans are rounded up to powers of 2, so that padding the shapes of a batch to the largest one at most
+	doubles their size along each axis: a long line is not drawn in the same batch as short ticks.
+	"""
+	key = np.zeros(len(spans[0]), dtype=np.int64)
+	for span in spans:
+		key = 64 * key + np.ceil(np.log2(np.maximum(span, 1.0))).astype(np.int64)
+	order = np.argsort(key, kind="stable")
+	cuts = np.nonzero(np.diff(key[order]))[0] + 1
+	return np.split(order, cuts) if len(key) > 0 else []
+
+
+class Canvas(object):
+	"""RGB image, painted with anti-aliased rectangles, segments and texts"""
+
+	def __init__(self, width, height, scale=1.0, background=(255, 255, 255)):
+		"""width, height : size in pixels, scale : pixels per svg unit"""
+		self.width = width
+		self.height = height
+		self.scale = scale
+		self.image = np.empty((height, width, 3), dtype=np.float32)
+		self.image[:] = background
+		self.alpha = np.zeros(height * width, dtype=np.float32) # coverage of the current layer
+
+	def scatter(self, y0, x0, values):
+		"""Adds values (n, ky, kx) at the pixels from (y0, x0) (arrays of n) to the current layer, keeping the maximum coverage"""
+		(n, ky, kx) = values.shape
+		y = y0[:, None, None] + np.arange(ky)[None, :, None]
+		x = x0[:, None, None] + np.arange(kx)[None, None, :]
+		inside = (y >= 0) & (y < self.height) & (x >= 0) & (x < self.width) & (values > 0.0)
+		np.maximum.at(self.alpha, (y * self.width + x)[inside], values[inside])
+
+	def paint(self, color):
+		"""Paints the current layer with color, and starts a new one"""
+		alpha = self.alpha.reshape((self.height, self.width))
+		for (channel, value) in enumerate(color): # one channel at a time, keeping the temporaries small
+			self.image[:, :, channel] *= 1.0 - alpha
+			self.image[:, :, channel] += alpha * np.float32(value)
+		self.alpha[:] = 0.0
+
+	def rectangles(self, x1, y1, x2, y2):
+		"""Axis-aligned rectangles (arrays of svg coordinates), in batches of similar sizes (see sizebatches)"""
+		s = self.scale
+		(xa, xb) = (np.minimum(x1, x2) * s, np.maximum(x1, x2) * s)
+		(ya, yb) = (np.minimum(y1, y2) * s, np.maximum(y1, y2) * s)
+		for batch in sizebatches(xb - xa, yb - ya):
+			(xfirst, xcov) = coverage(xa[batch], xb[batch])
+			(yfirst, ycov) = coverage(ya[batch], yb[batch])
+			self.scatter(yfirst, xfirst, ycov[:, :, None] * xcov[:, None, :])
+
+	def segments(self, segments, lw):
+		"""Segments (n, 4) of width lw: vertical and horizontal ones are rectangles, the others use their distance to the pixels"""
+		(x1, y1, x2, y2) = segments.T
+		vertical = x1 == x2
+		horizontal = np.logical_and(y1 == y2, ~vertical)
+		w = 0.5 * lw
+		self.rectangles(x1[vertical] - w, y1[vertical], x2[vertical] + w, y2[vertical])
+		self.rectangles(x1[horizontal], y1[horizontal] - w, x2[horizontal], y2[horizontal] + w)
+		others = segments[~np.logical_or(vertical, horizontal)] * self.scale
+		if len(others) == 0:
+			return
+		w *= self.scale
+		span = np.maximum(np.abs(others[:, 2] - others[:, 0]), np.abs(others[:, 3] - others[:, 1]))
+		for batch in sizebatches(span):
+			(x1, y1, x2, y2) = others[batch].T
+			x0 = np.floor(np.minimum(x1, x2) - w - 1.0).astype(np.int64)
+			y0 = np.floor(np.minimum(y1, y2) - w - 1.0).astype(np.int64)
+			k = int(np.max(span[batch]) + 2.0 * w + 3.0)
+			px = x0[:, None, None] + np.arange(k)[None, None, :] + 0.5 - x1[:, None, None] # pixel centers relative to the start
+			py = y0[:, None, None] + np.arange(k)[None, :, None] + 0.5 - y1[:, None, None]
+			(dx, dy) = ((x2 - x1)[:, None, None], (y2 - y1)[:, None, None])
+			t = np.clip((px * dx + py * dy) / (dx * dx + dy * dy), 0.0, 1.0)
+			distance = np.hypot(px - t * dx, py - t * dy)
+			self.scatter(y0, x0, np.clip(w + 0.5 - distance, 0.0, 1.0))
+
+	def texts(self, texts, x, y, size, rot, anchor, baseline):
+		"""Draws texts at (x, y) in svg units (arrays), with anchors and baselines given as indices into layout.ANCHORS and BASELINES
+
+		The rotations are rounded to multiples of 90 degrees. All texts of the same length and rotation are drawn at once.
+		"""
+		s = self.scale
+		gscale = round(4.0 * size * s * 0.718 / 7.0) / 4.0 # glyph pixel size, so that capitals are as high as in Helvetica
+		if gscale <= 0.0 or len(texts) == 0:
+			return
+		atlas = glyphatlas(gscale)
+		(n, gh, gw) = atlas.shape
+		lengths = np.array([len(text) for text in texts])
+		codes = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+		codes = np.where(np.logical_and(codes >= 32, codes <= 126), codes, ord("?")) - 32
+		starts = np.cumsum(lengths) - lengths
+		quarters = np.round(np.asarray(rot) / 90.0).astype(np.int64) % 4
+		(x, y) = (np.asarray(x, dtype=np.float64) * s, np.asarray(y, dtype=np.float64) * s)
+		for (length, quarter) in set(zip(lengths.tolist(), quarters.tolist())):
+			if length == 0:
+				continue
+			sel = np.nonzero(np.logical_and(lengths == length, quarters == quarter))[0]
+			glyphs = codes[starts[sel, None] + np.arange(length)] # (m, length)
+			strips = atlas[glyphs].transpose((0, 2, 1, 3)).reshape((len(sel), gh, length * gw)) # the glyphs side by side
+			strips = np.rot90(strips, quarter, axes=(1, 2))
+			# top left corners of the rotated strips, from the corners of the text rectangles rotated around the insertion points
+			u0 = -length * gw * np.array((0.0, 0.5, 1.0))[np.asarray(anchor)[sel]]
+			v0 = np.array((-7.0 * gscale, 0.0, -3.5 * gscale))[np.asarray(baseline)[sel]]
+			theta = np.radians(-90.0 * quarter)
+			(cos, sin) = (np.cos(theta), np.sin(theta))
+			u = np.stack((u0, u0, u0 + length * gw, u0 + length * gw))
+			v = np.stack((v0, v0 + gh, v0, v0 + gh))
+			left = np.round(x[sel] + np.min(u * cos - v * sin, axis=0)).astype(np.int64)
+			top = np.round(y[sel] + np.min(u * sin + v * cos, axis=0)).astype(np.int64)
+			self.scatter(top, left, strips)
+
+	def png(self, level=3):
+		"""PNG file content of the image (8 bit RGB), with zlib compression level"""
+		rows = np.empty((self.height, 1 + 3 * self.width), dtype=np.uint8)
+		rows[:, 0] = 0 # no filter
+		rows[:, 1:] = np.clip(self.image + 0.5, 0, 255).astype(np.uint8).reshape((self.height, -1))
+		def chunk(kind, data):
+			return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+		return b"".join((b"\x89PNG\r\n\x1a\n",
+			chunk(b"IHDR", struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0)),
+			chunk(b"IDAT", zlib.compress(rows.tobytes(), level)),
+			chunk(b"IEND", b"")))
+
+
+@functools.lru_cache(maxsize=16)
+def glyphatlas(gscale):
+	"""(95, h, w) array of the anti-aliased glyphs (coverage from 0 to 1) at gscale pixels per font pixel, in cells of 6x8 font pixels"""
+	glyphs = [DESCENDERS.get(chr(32 + i), glyph + "00") for (i, glyph) in enumerate(GLYPHS)]
+	bits = np.array([[int(glyph[i:i+2], 16) for i in range(0, 16, 2)] for glyph in glyphs])
+	cells = np.zeros((len(glyphs), 8, 6))
+	cells[:, :, :5] = (bits[:, :, None] >> np.arange(4, -1, -1)) & 1
+	# Box-filtered resampling: coverage of each output pixel by each font pixel, along both axes
+	(h, w) = (int(np.ceil(8 * gscale)), int(np.ceil(6 * gscale)))
+	def weights(n, k):
+		(first, cov) = coverage(np.arange(k) * gscale, (np.arange(k) + 1.0) * gscale)
+		out = np.zeros((n, k))
+		for j in range(cov.shape[1]):
+			sel = first + j < n
+			out[(first + j)[sel], np.arange(k)[sel]] = cov[sel, j]
+		return out
+	(wy, wx) = (weights(h, 8), weights(w, 6))
+	return np.clip(np.einsum("yi,gij,xj->gyx", wy, cells, wx), 0.0, 1.0)
+
+
+@profiling.timed("pngrender.draw")
+def draw(lay, dpi=96.0):
+	"""Canvas with the layout drawn at dpi (an svg unit being a pixel at 96 dpi)"""
+	import fontmetrics
+
+	scale = dpi / 96.0
+	(width, height) = lay.extent(margin=30.0)
+	canvas = Canvas(int(np.ceil(width * scale)), int(np.ceil(height * scale)), scale)
+
+	for rect in lay.rects:
+		(x, y, w, h) = [float(rect[key]) for key in ("x", "y", "width", "height")]
+		fill = parsecolor(rect.get("fill"), default=(0, 0, 0))
+		if fill is not None:
+			canvas.rectangles(np.array([x]), np.array([y]), np.array([x + w]), np.array([y + h]))
+			canvas.paint(fill)
+		stroke = parsecolor(rect.get("stroke"), default=None)
+		if stroke is not None:
+			sw = 0.5 * float(rect.get("stroke_width", rect.get("stroke-width", 1.0)))
+			canvas.rectangles(np.array([x - sw, x - sw, x - sw, x + w - sw]), np.array([y - sw, y + h - sw, y - sw, y - sw]),
+				np.array([x + w + sw, x + w + sw, x + sw, x + w + sw]), np.array([y + sw, y + h + sw, y + h + sw, y + h + sw]))
+			canvas.paint(stroke)
+
+	for (group, params) in enumerate(lay.groups):
+		for kind in (layout.LINE, cosmicruler.MAJ, cosmicruler.MED, cosmicruler.MIN):
+			segments = lay.segmentsof(group, kind)
+			if len(segments) > 0:
+				canvas.segments(segments, params["lw"])
+		sizes = {cosmicruler.LABEL: fontmetrics.parsestyle(params["labelstyle"])[0], layout.TITLE: fontmetrics.parsestyle(params["titlestyle"])[0]}
+		for kind in (cosmicruler.LABEL, layout.TITLE):
+			indices = lay.textsof(group, kind)
+			anchor = np.zeros(len(indices), dtype=np.int64) if kind == layout.TITLE else lay.textanchor[indices] # titles are drawn with text-anchor start
+			canvas.texts([lay.texts[i] for i in indices], lay.textpos[indices, 0], lay.textpos[indices, 1], sizes[kind],
+				lay.textrot[indices], anchor, lay.textbaseline[indices])
+	canvas.paint((0, 0, 0))
+	return canvas
+
+
+def renderfile(lay, filepath, dpi=96.0, level=3):
+	"""Writes a layout.RulerLayout as PNG, this is the "png" renderer of cosmicruler.render"""
+	canvas = draw(lay, dpi)
+	with profiling.stage("pngrender.write"):
+		with open(filepath, "wb") as f:
+			f.write(canvas.png(level))
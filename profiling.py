@@ -0,0 +1,155 @@
+"""
+Opt-in instrumentation of the stages of a ruler build: wall time, number of calls and peak memory.
+github.com/mtewes/cosmicruler
+
+The modules mark their stages with
+
+	with profiling.stage("simpledraw"):
+		...
+
+which costs next to nothing while profiling is off. To switch it on, either set the environment variable
+COSMICRULER_PROFILE (to the path of the trace file to write, or to 1 for cosmicruler-trace.json), or use
+
+	with profiling.profile(trace="trace.json"):
+		...build a ruler...
+
+Both print a summary table of the stages to stderr, and write a trace in the Chrome trace event format
+(open it in chrome://tracing or https://ui.perfetto.dev). Memory is tracked with tracemalloc, which slows
+things down a bit. Stages running in worker processes (see ruler.build) are not recorded, use one process.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import contextlib
+import tracemalloc
+
+
+enabled = False
+records = {} # stage name -> [calls, total time, max peak memory]
+events = [] # Chrome trace events
+stack = [] # open stages, as lists [start memory, peak memory of the children]
+
+t0 = time.perf_counter() # origin of the trace
+
+NULL = contextlib.nullcontext()
+
+
+def stage(name):
+	"""Context manager recording a stage (a no-op if profiling is off)"""
+	if not enabled:
+		return NULL
+	return _recording(name)
+
+
+@contextlib.contextmanager
+def _recording(name):
+	mem = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+	frame = [mem, mem]
+	stack.append(frame)
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		duration = time.perf_counter() - start
+		stack.pop()
+		peak = frame[1]
+		if tracemalloc.is_tracing():
+			peak = max(peak, tracemalloc.get_traced_memory()[1])
+			tracemalloc.reset_peak() # so that the peaks of the following stages are their own
+		if stack:
+			stack[-1][1] = max(stack[-1][1], peak)
+		record = records.setdefault(name, [0, 0.0, 0])
+		record[0] += 1
+		record[1] += duration
+		record[2] = max(record[2], peak - frame[0])
+		events.append(dict(name=name, cat="cosmicruler", ph="X", pid=os.getpid(), tid=0,
+			ts=(start - t0) * 1.0e6, dur=duration * 1.0e6, args=dict(peakmemory=peak - frame[0])))
+
+
+def timed(name):
+	"""Decorator recording each call of a function as a stage"""
+	def decorator(fct):
+		@functools.wraps(fct)
+		def wrapper(*args, **kwargs):
+			with stage(name):
+				return fct(*args, **kwargs)
+		return wrapper
+	return decorator
+
+
+def wrap(fct, name):
+	"""Returns fct itself if profiling is off, and otherwise a version of it recorded as a stage (e.g., for a transf)"""
+	if not enabled or fct is None:
+		return fct
+	return timed(name)(fct)
+
+
+def start():
+	"""Switches profiling on, forgetting earlier records"""
+	global enabled, t0
+	records.clear()
+	del events[:]
+	t0 = time.perf_counter()
+	if not tracemalloc.is_tracing():
+		tracemalloc.start()
+	enabled = True
+
+
+def stop():
+	"""Switches profiling off"""
+	global enabled
+	enabled = False
+	if tracemalloc.is_tracing():
+		tracemalloc.stop()
+
+
+def summary(f=None):
+	"""Prints the table of the stages, by decreasing total time"""
+	f = f or sys.stderr
+	f.write("{:<36} {:>8} {:>11} {:>11} {:>13}\n".format("stage", "calls", "total [s]", "mean [ms]", "peak mem [MB]"))
+	for (name, (calls, total, peak)) in sorted(records.items(), key=lambda item: -item[1][1]):
+		f.write("{:<36} {:>8} {:>11.4f} {:>11.3f} {:>13.2f}\n".format(name, calls, total, 1000.0 * total / calls, peak / 1.0e6))
+
+
+def savetrace(filepath):
+	"""Writes the recorded stages as Chrome trace events"""
+	with open(filepath, "w") as f:
+		json.dump(dict(traceEvents=events, displayTimeUnit="ms"), f)
+
+
+@contextlib.contextmanager
+def profile(trace=None, table=True):
+	"""Context manager profiling what runs inside it, then prints the summary table and writes the trace (if a path is given)"""
+	start()
+	try:
+		yield
+	finally:
+		stop()
+		if table:
+			summary()
+		if trace is not None:
+			savetrace(trace)
+
+
+def _fromenv():
+	value = os.environ.get("COSMICRULER_PROFILE", "")
+	if value in ("", "0"):
+		return
+	if os.environ.setdefault("COSMICRULER_PROFILE_PID", str(os.getpid())) != str(os.getpid()):
+		return # a worker process started by the profiled one
+	trace = "cosmicruler-trace.json" if value == "1" else value
+	pid = os.getpid()
+	start()
+	def finish():
+		if os.getpid() != pid: # a forked worker
+			return
+		stop()
+		summary()
+		savetrace(trace)
+	atexit.register(finish)
+
+_fromenv()
@@ -0,0 +1,425 @@
+"""
+Assembly of rulers from declarative scale specifications, building the scales in parallel.
+github.com/mtewes/cosmicruler
+
+A spec is a dict describing one scale, in redshift (the zptrans gets applied later, when drawing):
+
+	{"name": "lbt", "title": "Time to launch [Gyr]", "kind": "cosmo", "quantity": "lookback_time", "unit": "Gyr",
+		"steps": [
+			{"values": [0.5, 1, 2, 3], "subticks": "lin2"},
+			{"values": [0.0, 0.5], "subticks": "lin5", "labels": False},
+		]}
+
+kind :
+	"redshift" : the values are redshifts
+	"cosmo" : the values are those of an astropy cosmology quantity (method name), in unit (a string such as "Gyr"
+		or "600 kpc / arcmin"), of the cosmology given by "cosmology" (default "Planck15", see cosmicruler.getcosmology).
+		Non-monotonic quantities need "branched": True, and "peak": a format for the label of the extremum.
+	"counts" : the values are cumulated counts of a catalog (see galcounts), with the keys "catalog" (path),
+		"z" (redshift column), "catfactor", "selection" and "derived" (expressions as for galcounts.CumulativeCounts.fromselections).
+
+Each step adds, for its "values" (inverted to redshifts on the branch "branch" of a branched quantity):
+	labels (unless "labels" is False), with the texts "texts" or formatted with "fmt" (default "{}"),
+	"subticks" : automatic subticks of this type (a name such as "lin2", "lin3", "lin5", "lin210", "log2" or "log10",
+		a list of fractions of the intervals, or a table of such lists "med" and "min", see cosmicruler.autosubticks),
+		"none" giving only major ticks at the values,
+	"ticks" : plain ticks of this kind ("maj", "med" or "min") at the values, or, if "divide" is given, at the
+		cosmicruler.subticks dividing the intervals between the values into that many parts.
+Values (or plain ticks) that the scale cannot invert, e.g. outside of its tabulated range, raise a ValueError.
+
+A step {"auto": true} instead chooses nice ticks and labels by itself, from their spacing on the ruler (see autoticks.py),
+with the keys "minspacing" (default 4), "labelspacing" (default 40), "mantissa" (5 or 2), "fmt" (default "{:g}") and "labels".
+This needs the "zptrans" (as in a spec file) and the length "l" of the ruler in the spec of the scale, which buildfile adds.
+
+Example:
+
+	scales = ruler.build(specs) # list of cosmicruler.Scale, in the order of the specs
+
+A whole ruler (zptrans, drawing parameters and scales) can be described in a spec file (toml, yaml or json), see buildfile
+and glass/glass.toml, and built from the command line with
+
+	python cosmicruler.py build glass/glass.toml
+
+Built scales are cached by a hash of their spec, so that only the scales whose spec changed get rebuilt (changing
+a title does not need a rebuild).
+"""
+
+import os
+import json
+import hashlib
+import logging
+import importlib.metadata
+import concurrent.futures
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+import cosmicruler
+import cosmoinv
+import cosmocache
+import galcounts
+import profiling
+
+
+def parseunit(text):
+	"""Unit from a string, which can include a scale (e.g. "Gyr", or "600 kpc / arcmin"), None stays None"""
+	if text is None:
+		return None
+	import astropy.units as u
+	return u.Unit(text)
+
+
+def transfs(spec, scale, memo=None):
+	"""Functions of the quantity of a spec: (list of the functions giving the redshifts of values, one per branch,
+	function giving the values at redshifts), and adds the extras to the scale
+
+	memo : optional dict in which the inverters and the counts of catalogs are kept, to reuse them for other specs
+	"""
+	kind = spec.get("kind", "redshift")
+	if memo is None:
+		memo = {}
+	if kind == "redshift":
+		return ([None], cosmicruler.identity)
+
+	elif kind == "cosmo":
+		branched = spec.get("branched", False)
+		key = memokey(spec)
+		if key not in memo:
+			cosmo = cosmicruler.getcosmology(spec.get("cosmology", "Planck15"))
+			unit = parseunit(spec.get("unit"))
+			cache = cosmocache.TableCache() if spec.get("cache", True) else None
+			cls = cosmoinv.BranchedInverter if branched else cosmoinv.Inverter
+			memo[key] = cls.fromcosmo(cosmo, spec["quantity"], unit, cache=cache)
+		inv = memo[key]
+		if branched:
+			if "peak" in spec:
+				scale.addpeak(inv, spec["peak"])
+			return ([inv.branch(i) for i in range(len(inv))], inv.forward)
+		return ([inv], inv.forward)
+
+	elif kind == "counts":
+		key = memokey(spec)
+		if key not in memo:
+			memo[key] = galcounts.CumulativeCounts.fromselections(spec["catalog"], spec.get("z", "true_redshift_gal"),
+				{"selection": spec.get("selection")}, derived=spec.get("derived"))["selection"]
+		counts = memo[key]
+		catfactor = spec.get("catfactor", 1.0)
+		def transf(values):
+			return counts.counts_to_z(values, catfactor).reshape(np.shape(values))
+		def forward(z):
+			return counts.n(z) / catfactor
+		return ([transf], forward)
+
+	raise ValueError("Unknown kind of scale {}".format(kind))
+
+
+def memokey(spec):
+	"""Key of the inverter (cosmo specs) or the counts (counts specs) of a spec in the memo of transfs,
+	including the size and time of the catalog file"""
+	kind = spec.get("kind", "redshift")
+	parts = [kind]
+	if kind == "cosmo":
+		parts += [spec.get(key) for key in ("cosmology", "quantity", "unit", "branched")]
+	elif kind == "counts":
+		stat = os.stat(spec["catalog"])
+		parts += [spec.get(key) for key in ("catalog", "z", "selection", "derived")] + [stat.st_size, stat.st_mtime]
+	return json.dumps(parts, sort_keys=True)
+
+
+def checkinverted(spec, values, z):
+	"""Returns the redshifts z of the values, raising a ValueError if some values could not be inverted (NaN z),
+	as they are outside of the tabulated range (or not reached by the branch)"""
+	z = np.asarray(z, dtype=np.float64)
+	bad = ~np.isfinite(z)
+	if np.any(bad):
+		raise ValueError("Scale {}: the values {} are outside of the range of the scale".format(spec["name"],
+			", ".join("{:g}".format(value) for value in np.asarray(values, dtype=np.float64)[bad].tolist())))
+	return z
+
+
+@profiling.timed("ruler.buildscale")
+def buildscale(spec, memo=None):
+	"""Builds the Scale (in redshift) described by a spec, memo is passed to transfs"""
+	scale = cosmicruler.Scale(name=spec["name"], title=spec.get("title", spec["name"]))
+	(branches, forward) = transfs(spec, scale, memo)
+
+	for step in spec.get("steps", []):
+		if step.get("auto", False):
+			if "zptrans" not in spec or "l" not in spec:
+				raise ValueError("Scale {}: auto ticks need the zptrans and l of the ruler in the spec".format(spec["name"]))
+			scale.addautoticks(forward, zptransfromspec(spec["zptrans"]), spec["l"],
+				minspacing=step.get("minspacing", 4.0), labelspacing=step.get("labelspacing", 40.0),
+				mantissa=step.get("mantissa", 5), fmt=step.get("fmt", "{:g}"), labels=step.get("labels", True))
+			continue
+		transf = branches[step.get("branch", 0)]
+		values = [float(value) for value in step["values"]]
+		z = np.asarray(values) if transf is None else checkinverted(spec, values, transf(values))
+
+		if step.get("labels", True):
+			texts = step.get("texts", [step.get("fmt", "{}").format(value) for value in step["values"]])
+			scale.addlabels(z, texts)
+		if "subticks" in step:
+			subtype = None if step["subticks"] == "none" else step["subticks"]
+			scale.addautosubticks(values, subtype, transf)
+		if "ticks" in step:
+			if "divide" in step:
+				tickvalues = cosmicruler.subticks(values, step["divide"])
+				tickz = tickvalues if transf is None else checkinverted(spec, tickvalues, transf(tickvalues))
+			else:
+				tickz = z
+			scale.addticks(tickz, step["ticks"])
+
+	return scale
+
+
+def toshared(spec):
+	"""Builds a scale, and returns its ticks in a shared memory block, to avoid pickling the arrays
+
+	The block contains n positions (float64), n label indices (int32) and n classes (uint8).
+	"""
+	scale = buildscale(spec)
+	(pos, cls, labelidx) = scale.ticks.arrays()
+	n = len(pos)
+	shm = shared_memory.SharedMemory(create=True, size=max(1, 13*n))
+	(a, b) = (8*n, 12*n)
+	np.ndarray(n, dtype=np.float64, buffer=shm.buf[:a])[:] = pos
+	np.ndarray(n, dtype=np.int32, buffer=shm.buf[a:b])[:] = labelidx
+	np.ndarray(n, dtype=np.uint8, buffer=shm.buf[b:b+n])[:] = cls
+	shm.close()
+	return dict(shm=shm.name, n=n, texts=scale.ticks.texts, name=scale.name, title=scale.title, extras=scale.extras)
+
+
+def fromshared(result):
+	"""Scale from the result of toshared, copying the ticks out of the shared memory block and releasing it"""
+	shm = shared_memory.SharedMemory(name=result["shm"])
+	try:
+		n = result["n"]
+		(a, b) = (8*n, 12*n)
+		ticks = cosmicruler.TickTable.fromarrays(
+			np.ndarray(n, dtype=np.float64, buffer=shm.buf[:a]),
+			np.ndarray(n, dtype=np.uint8, buffer=shm.buf[b:b+n]),
+			np.ndarray(n, dtype=np.int32, buffer=shm.buf[a:b]),
+			result["texts"])
+	finally:
+		shm.close()
+		shm.unlink()
+	scale = cosmicruler.Scale(name=result["name"], title=result["title"], extras=result["extras"])
+	scale.ticks = ticks
+	return scale
+
+
+def build(specs, processes=None):
+	"""Builds the scales of the specs, in parallel processes, and returns them in the order of the specs
+
+	processes : number of worker processes (default: number of CPUs). With 1, the scales are built one after the other here.
+	"""
+	specs = list(specs)
+	if processes == 1 or len(specs) < 2:
+		return [buildscale(spec) for spec in specs]
+
+	resource_tracker.ensure_running() # shared by the workers, so that the blocks they create can be unlinked here
+	with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+		futures = [executor.submit(toshared, spec) for spec in specs]
+		scales = []
+		error = None
+		for (spec, future) in zip(specs, futures):
+			try:
+				result = future.result()
+			except Exception as e:
+				logging.warning("Building scale {} failed: {}".format(spec.get("name"), e))
+				error = error or e
+				continue
+			scales.append(fromshared(result)) # releases the blocks of all successful workers, even after an error
+		if error is not None:
+			raise error
+	return scales
+
+
+# Incremental builds: each scale is cached under a hash of its spec
+
+SPECVERSION = 2 # to be increased when the meaning of the specs changes, to invalidate cached scales
+
+
+def spechash(spec):
+	"""Hash of everything the ticks of a scale depend on: its spec (but the title), the astropy version (for the cosmologies),
+	and the catalog file (size and time)"""
+	parts = [str(SPECVERSION), json.dumps(dict(spec, title=None), sort_keys=True)]
+	kind = spec.get("kind", "redshift")
+	if kind == "cosmo":
+		name = spec.get("cosmology", "Planck15")
+		if isinstance(name, dict): # a base cosmology with changed parameters, which are in the spec
+			name = name.get("base", "Planck15")
+		if name in cosmicruler.COSMOLOGIES:
+			parts.append(cosmocache.cosmoparams(cosmicruler.getcosmology(name)))
+		else: # the parameters of the astropy realizations only change with astropy (which is slow to import)
+			parts.append("astropy {}".format(importlib.metadata.version("astropy")))
+	elif kind == "counts":
+		stat = os.stat(spec["catalog"])
+		parts.append("{} {}".format(stat.st_size, stat.st_mtime))
+	return hashlib.sha1(" | ".join(parts).encode("utf-8")).hexdigest()
+
+
+class ScaleCache(cosmocache.TableCache):
+	"""Size-bounded directory of built scales (.npz files of their tick arrays), keyed by spechash"""
+
+	extension = ".npz"
+
+	def __init__(self, directory=None, maxbytes=50*1024*1024):
+		if directory is None:
+			directory = os.path.join(cosmocache.cachedir(), "scales")
+		cosmocache.TableCache.__init__(self, directory, maxbytes)
+
+	def load(self, key):
+		"""Returns the cached Scale, or None"""
+		filepath = self.path(key)
+		if not os.path.exists(filepath):
+			return None
+		try:
+			with np.load(filepath) as data:
+				meta = json.loads(str(data["meta"]))
+				ticks = cosmicruler.TickTable.fromarrays(data["pos"], data["cls"], data["labelidx"], meta["texts"])
+		except (IOError, ValueError, KeyError):
+			logging.warning("Could not read cached scale {}, ignoring it".format(filepath))
+			return None
+		os.utime(filepath, None)
+		extras = meta["extras"]
+		if extras is not None and "peak" in extras:
+			extras["peak"] = tuple(extras["peak"])
+		scale = cosmicruler.Scale(name=meta["name"], title=meta["title"], extras=extras)
+		scale.ticks = ticks
+		return scale
+
+	def save(self, key, scale):
+		(pos, cls, labelidx) = scale.ticks.arrays()
+		meta = dict(name=scale.name, title=scale.title, extras=scale.extras, texts=scale.ticks.texts)
+		with self.writing(key) as f_out:
+			np.savez(f_out, pos=pos, cls=cls, labelidx=labelidx, meta=np.array(json.dumps(meta)))
+
+
+def buildcached(specs, cache=None, processes=None):
+	"""Like build, but only builds the scales that are not in the cache (a ScaleCache, by default the one in cachedir)"""
+	specs = list(specs)
+	if cache is None:
+		cache = ScaleCache()
+	keys = [spechash(spec) for spec in specs]
+	scales = [cache.load(key) for key in keys]
+	for (spec, scale) in zip(specs, scales):
+		if scale is not None:
+			scale.title = spec.get("title", spec["name"])
+	todo = [i for (i, scale) in enumerate(scales) if scale is None]
+	logging.info("Building {} of {} scales, the others are cached".format(len(todo), len(specs)))
+	for (i, scale) in zip(todo, build([specs[i] for i in todo], processes=processes)):
+		cache.save(keys[i], scale)
+		scales[i] = scale
+	return scales
+
+
+# Spec files
+
+def readspec(filepath):
+	"""Reads a ruler spec from a .toml, .yaml or .json file"""
+	if filepath.endswith(".toml"):
+		try:
+			import tomllib
+		except ImportError: # python < 3.11
+			import tomli as tomllib
+		with open(filepath, "rb") as f:
+			return tomllib.load(f)
+	with open(filepath) as f:
+		if filepath.endswith(".yaml") or filepath.endswith(".yml"):
+			import yaml
+			return yaml.safe_load(f)
+		return json.load(f)
+
+
+def zptransfromspec(spec):
+	"""ZPTrans (or PiecewiseZPTrans, if zbreaks are given) from the zptrans table of a ruler spec"""
+	spec = dict(spec)
+	if "zbreaks" in spec:
+		return cosmicruler.PiecewiseZPTrans(**spec)
+	return cosmicruler.ZPTrans(**spec)
+
+
+def layoutfromspec(rulerspec, scales):
+	"""Applies the zptrans to the scales (built from rulerspec["scales"]) and stacks them into a layout.RulerLayout"""
+	import layout
+
+	zptrans = zptransfromspec(rulerspec.get("zptrans", {}))
+	draw = dict(rulerspec.get("draw", {}))
+	lay = layout.RulerLayout(size=rulerspec.get("size"))
+	if "frame" in rulerspec:
+		frame = dict(rulerspec["frame"])
+		lay.rect(insert=(frame.pop("x", 0), frame.pop("y", 0)), size=(frame.pop("width"), frame.pop("height")), **frame)
+	for scale in scales:
+		scale.apply_zptrans(zptrans)
+	lay.stack(scales, draw.pop("x0", 10.0), draw.pop("y0", 50.0), draw.pop("dy", 100.0), draw.pop("l", 1000.0), **draw)
+	if "labels" in rulerspec:
+		nremoved = lay.placelabels(**rulerspec["labels"])
+		logging.info("Removed {} overlapping labels".format(nremoved))
+	return lay
+
+
+def buildfile(filepath, output=None, processes=None, cache=True):
+	"""Builds the ruler described by a spec file, and writes it (to output, or to the output given in the spec)
+
+	The spec file contains the scales (as described above, from top to bottom), and optionally:
+		output : path of the svg (or svgz) to write, and layout : path of a .npz or .json file to save the layout to
+		size : (width, height) of the drawing, frame : attributes of a rectangle (x, y, width, height, rx, stroke...)
+		zptrans : arguments of cosmicruler.ZPTrans (or PiecewiseZPTrans)
+		draw : x0, y0, dy, l and the other arguments of layout.RulerLayout.addscale
+		labels : gap and nudge, to remove (or move) overlapping labels with layout.RulerLayout.placelabels
+
+	Relative paths in the spec (catalogs, outputs) are relative to the directory of the spec file, the output argument
+	is used as it is (relative to the current directory).
+	Returns the layout.RulerLayout.
+	"""
+	rulerspec = readspec(filepath)
+	specdir = os.path.dirname(os.path.abspath(filepath))
+	if output is None:
+		output = os.path.join(specdir, rulerspec.get("output", os.path.splitext(os.path.basename(filepath))[0] + ".svg"))
+	return buildruler(rulerspec, specdir, output, processes=processes, cache=cache)
+
+
+def buildruler(rulerspec, specdir, output, processes=None, cache=True):
+	"""Builds a ruler spec (as read by readspec) and writes it to output, relative paths of the spec are relative to specdir"""
+	specs = scalespecs(rulerspec, specdir)
+	if cache:
+		scales = buildcached(specs, processes=processes)
+	else:
+		scales = build(specs, processes=processes)
+
+	lay = layoutfromspec(rulerspec, scales)
+	writeruler(lay, rulerspec, specdir, output)
+	return lay
+
+
+def scalespecs(rulerspec, specdir):
+	"""The specs of the scales of a ruler spec, ready to be built: catalog paths relative to specdir, and what auto ticks need"""
+	specs = []
+	for spec in rulerspec["scales"]:
+		spec = dict(spec)
+		if "catalog" in spec:
+			spec["catalog"] = os.path.join(specdir, spec["catalog"])
+		if any(step.get("auto", False) for step in spec.get("steps", [])): # these ticks depend on the drawing
+			spec.setdefault("zptrans", rulerspec.get("zptrans", {}))
+			spec.setdefault("l", rulerspec.get("draw", {}).get("l", 1000.0))
+		specs.append(spec)
+	return specs
+
+
+def writeruler(lay, rulerspec, specdir, output):
+	"""Saves the layout of a ruler (if the spec asks for it, relative to specdir), and writes the ruler to output
+
+	Existing svg files are updated, re-rendering only the scales that changed. Returns the number of re-rendered scales.
+	"""
+	import svgstream
+
+	if "layout" in rulerspec:
+		lay.save(os.path.join(specdir, rulerspec["layout"]))
+	if cosmicruler.RENDEREREXTENSIONS.get(os.path.splitext(output)[1].lower()) == "svg":
+		nchanged = svgstream.update(output, lay) # only re-renders the scales that changed
+		logging.info("Wrote {} ({} of {} scales re-rendered)".format(output, nchanged, len(lay.groups)))
+		return nchanged
+	cosmicruler.render(lay, output)
+	logging.info("Wrote {}".format(output))
+	return len(lay.groups)
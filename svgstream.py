@@ -0,0 +1,299 @@
+"""
+Streaming SVG writer, an alternative to svgwrite for large rulers.
+github.com/mtewes/cosmicruler
+
+The SVG is written directly to a file handle from the tick arrays of the scales, without building
+(and validating) an object tree first. Each class of ticks of a scale is a single <path> with a
+multi-segment d attribute, instead of one <line> per tick.
+
+Example:
+
+	with svgstream.SVGStream("glass.svg") as svg:
+		svg.rect(insert=(0, 0), size=(1180, 1380), rx=5, ry=5, fill="none", stroke="red")
+		svg.drawscale(scale, 12, 90, 1156, lw=2.0, tickl=25.0)
+
+or, to render a precomputed layout.RulerLayout:
+
+	with svgstream.SVGStream("glass.svg") as svg:
+		svg.drawlayout(layout.RulerLayout.load("glass-layout.npz"))
+
+To write a modified layout to an existing file, re-rendering only the scales that changed:
+
+	svgstream.update("glass.svg", lay)
+"""
+
+import io
+import os
+import re
+import gzip
+import urllib.parse
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+
+import cosmicruler
+import layout
+import profiling
+
+
+def attrs(**attributes):
+	"""Formats keyword arguments as SVG attributes (underscores become dashes, None values are skipped)"""
+	return "".join(" {}={}".format(name.replace("_", "-"), quoteattr(str(value)))
+		for (name, value) in attributes.items() if value is not None)
+
+
+def num(x, precision=3):
+	"""Compact string of a number"""
+	out = "{:.{}f}".format(x, precision).rstrip("0").rstrip(".")
+	if out == "-0":
+		return "0"
+	return out
+
+
+def nums(x, precision=3):
+	"""Vectorized num(), returns an array of strings"""
+	out = np.char.rstrip(np.char.rstrip(np.char.mod("%.{}f".format(precision), x), "0"), ".")
+	out[out == "-0"] = "0"
+	return out
+
+
+def pathd(x, ya, yb, precision=3):
+	"""d attribute of a path drawing vertical segments from ya to yb at all positions x (in increasing order)
+	
+	Only the first segment is absolute, the others use relative moves. These are computed from
+	the rounded absolute positions, so that rounding errors do not accumulate.
+	"""
+	x = np.round(np.sort(np.asarray(x, dtype=np.float64)), precision)
+	if len(x) == 0:
+		return ""
+	back = num(ya - yb, precision)
+	if not back.startswith("-"):
+		back = " " + back
+	segment = "{}v{}".format(back, num(yb - ya, precision))
+	first = "M{} {}V{}".format(num(x[0], precision), num(ya, precision), num(yb, precision))
+	moves = np.char.add(np.char.add("m", nums(np.diff(x), precision)), segment)
+	return first + "".join(moves.tolist())
+
+
+def segmentsd(segments, precision=3):
+	"""d attribute of a path drawing (n, 4) segments x1, y1, x2, y2
+	
+	The vertical segments having the same y1 and y2 as the first one (i.e., the ticks) are written compactly by pathd.
+	"""
+	if len(segments) == 0:
+		return ""
+	(x1, y1, x2, y2) = segments.T
+	ticks = np.logical_and(np.logical_and(x1 == x2, y1 == y1[0]), y2 == y2[0])
+	d = pathd(x1[ticks], y1[0], y2[0], precision)
+	others = ["M{} {}L{} {}".format(*[num(c, precision) for c in segment]) for segment in segments[~ticks].tolist()]
+	return d + "".join(others)
+
+
+class SVGStream(object):
+	"""Writes SVG elements directly to a file, can be used as a context manager"""
+
+	def __init__(self, filepath, size=None, precision=3, header=True):
+		"""
+		filepath : path of the file to write (gzip-compressed if it ends with .svgz), or an open text file handle
+		size : optional (width, height) of the drawing
+		precision : number of decimals of the coordinates
+		header : if False, the xml header and the svg root element are not written (to render parts of a drawing)
+		"""
+		if hasattr(filepath, "write"):
+			self.f = filepath
+			self.ownfile = False
+		else:
+			self.f = openfile(filepath, "w")
+			self.ownfile = True
+		self.precision = precision
+		self.header = header
+
+		if header:
+			(width, height) = ("100%", "100%") if size is None else size
+			self.f.write('<?xml version="1.0" encoding="utf-8" ?>\n')
+			self.f.write('<svg baseProfile="full" version="1.1"{} xmlns="http://www.w3.org/2000/svg">\n'.format(
+				attrs(width=width, height=height)))
+
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+
+	def close(self):
+		"""Finishes the SVG (and closes the file if we opened it)"""
+		if self.f is None:
+			return
+		if self.header:
+			self.f.write("</svg>\n")
+		if self.ownfile:
+			self.f.close()
+		self.f = None
+
+
+	def write(self, text):
+		"""Writes raw SVG"""
+		self.f.write(text)
+
+
+	def rect(self, insert, size, **attributes):
+		"""Writes a rectangle, attributes are as for svgwrite (e.g. rx, fill, stroke)"""
+		self.f.write("<rect{} />\n".format(attrs(x=insert[0], y=insert[1], width=size[0], height=size[1], **attributes)))
+
+
+	def text(self, text, insert, **attributes):
+		self.f.write("<text{}>{}</text>\n".format(attrs(x=num(insert[0], self.precision), y=num(insert[1], self.precision),
+			**attributes), escape(text)))
+
+
+	def drawscale(self, scale, x0, y0, l, **kwargs):
+		"""Writes a cosmicruler.Scale, arguments and resulting groups are the same as for Scale.simpledraw"""
+		lay = layout.RulerLayout()
+		lay.addscale(scale, x0, y0, l, **kwargs)
+		self.drawlayout(lay)
+
+
+	@profiling.timed("svgstream.drawlayout")
+	def drawlayout(self, lay):
+		"""Writes all rectangles and scales of a layout.RulerLayout
+		
+		The rectangles and each scale are written between comment markers <!-- begin name hash --> and <!-- end name -->,
+		where hash is that of their content, so that update() can later replace only the scales that changed
+		(the names are quoted, see markername).
+		"""
+		self.drawrects(lay)
+		for group in range(len(lay.groups)):
+			self.drawgroup(lay, group)
+
+
+	def drawrects(self, lay):
+		"""Writes the rectangles of a layout"""
+		self.f.write("<!-- begin rects {} -->\n".format(lay.rectshash()))
+		for rect in lay.rects:
+			self.rect(insert=(rect["x"], rect["y"]), size=(rect["width"], rect["height"]),
+				**dict((key, value) for (key, value) in rect.items() if key not in ("x", "y", "width", "height")))
+		self.f.write("<!-- end rects -->\n")
+
+
+	def drawgroup(self, lay, group):
+		"""Writes the group of one scale of a layout"""
+		prec = self.precision
+		write = self.f.write
+		params = lay.groups[group]
+		name = params["name"]
+		lw = params["lw"]
+
+		grouphash = lay.grouphash(group)
+		write("<!-- begin {}-scale {} -->\n".format(markername(name), grouphash))
+		write("<g{}>\n".format(attrs(id=name+"-scale", data_hash=grouphash)))
+		for (x1, y1, x2, y2) in lay.segmentsof(group, layout.LINE).tolist():
+			write("<line{} />\n".format(attrs(x1=num(x1, prec), y1=num(y1, prec), x2=num(x2, prec), y2=num(y2, prec),
+				style="stroke:black;stroke-width:{}".format(lw))))
+
+		# The ticks, one path per class
+		for (kind, suffix) in ((cosmicruler.MAJ, "-majticks"), (cosmicruler.MED, "-medticks"), (cosmicruler.MIN, "-minticks")):
+			d = segmentsd(lay.segmentsof(group, kind), prec)
+			write("<g{}>".format(attrs(id=name+suffix, stroke="black", stroke_width=lw)))
+			if len(d) > 0:
+				write("<path{} />".format(attrs(d=d, fill="none")))
+			write("</g>\n")
+
+		# The labels
+		write("<g{}>\n".format(attrs(id=name+"-labels", style=params["labelstyle"])))
+		for i in lay.textsof(group, cosmicruler.LABEL):
+			(x, y) = (num(lay.textpos[i, 0], prec), num(lay.textpos[i, 1], prec))
+			anchor = layout.ANCHORS[lay.textanchor[i]]
+			baseline = layout.BASELINES[lay.textbaseline[i]]
+			if lay.textrot[i] != 0.0:
+				write('<text alignment-baseline="{}" text-anchor="{}" transform="rotate({:g}, {}, {})" x="{}" y="{}">{}</text>\n'.format(
+					baseline, anchor, -lay.textrot[i], x, y, x, y, escape(lay.texts[i])))
+			else:
+				write('<text alignment-baseline="{}" text-anchor="{}" x="{}" y="{}">{}</text>\n'.format(
+					baseline, anchor, x, y, escape(lay.texts[i])))
+		write("</g>\n")
+
+		# The title
+		write("<g{}>\n".format(attrs(id=name+"-title", style=params["titlestyle"], text_anchor="start")))
+		for i in lay.textsof(group, layout.TITLE):
+			self.text(lay.texts[i], lay.textpos[i], alignment_baseline=layout.BASELINES[lay.textbaseline[i]])
+		write("</g>\n")
+
+		write("</g>\n")
+		write("<!-- end {}-scale -->\n".format(markername(name)))
+
+
+def renderfile(lay, filepath, precision=3):
+	"""Writes a layout.RulerLayout to an svg (or svgz) file, this is the "svg" renderer of cosmicruler.render"""
+	with SVGStream(filepath, size=lay.size, precision=precision) as svg:
+		svg.drawlayout(lay)
+
+
+def markername(name):
+	"""Scale name as written in the begin and end markers: percent-quoted, so that it has no spaces (and no "--",
+	which is not allowed in xml comments)"""
+	return urllib.parse.quote(name, safe="").replace("-", "%2D")
+
+
+BLOCK = re.compile(r"<!-- begin (\S+) (\w+) -->\n.*?<!-- end \1 -->\n", re.DOTALL)
+
+
+def openfile(filepath, mode="r", compressed=None):
+	"""Text file handle, gzip-compressed if compressed is True, or (by default) for .svgz files"""
+	if compressed is None:
+		compressed = filepath.endswith(".svgz")
+	if compressed:
+		return gzip.open(filepath, mode + "t")
+	return open(filepath, mode)
+
+
+@profiling.timed("svgstream.update")
+def update(filepath, lay, precision=3):
+	"""Writes a layout.RulerLayout to filepath, re-rendering only the scales that changed since it was written by drawlayout
+	
+	The scales whose hash is the same as in the existing file are copied as they are. If the file does not exist, or if the
+	header, the rectangles or the names and order of the scales changed, the whole file gets written.
+	Returns the number of re-rendered scales.
+	"""
+	def render(fct, *args):
+		out = io.StringIO()
+		fct(SVGStream(out, precision=precision, header=False), *args)
+		return out.getvalue()
+	
+	if not os.path.exists(filepath):
+		old = None
+	else:
+		with openfile(filepath) as f:
+			old = f.read()
+	
+	expected = [("rects", lay.rectshash())] + [(markername(params["name"]) + "-scale", lay.grouphash(group)) for (group, params) in enumerate(lay.groups)]
+	blocks = [] if old is None else list(BLOCK.finditer(old))
+	
+	headerout = io.StringIO()
+	SVGStream(headerout, size=lay.size, precision=precision)
+	header = headerout.getvalue()
+	
+	if old is None or [block.group(1) for block in blocks] != [name for (name, grouphash) in expected] \
+		or old[:blocks[0].start()] != header or old[blocks[-1].end():] != "</svg>\n":
+		with SVGStream(filepath, size=lay.size, precision=precision) as svg:
+			svg.drawlayout(lay)
+		return len(lay.groups)
+	
+	parts = [header]
+	nchanged = 0
+	for (block, (name, grouphash), group) in zip(blocks, expected, [None] + list(range(len(lay.groups)))):
+		if block.group(2) == grouphash:
+			parts.append(block.group(0))
+		elif group is None:
+			parts.append(render(SVGStream.drawrects, lay))
+		else:
+			parts.append(render(SVGStream.drawgroup, lay, group))
+			nchanged += 1
+	parts.append("</svg>\n")
+	
+	tmppath = "{}.{}.tmp".format(filepath, os.getpid())
+	with openfile(tmppath, "w", compressed=filepath.endswith(".svgz")) as f:
+		f.write("".join(parts))
+	os.replace(tmppath, filepath)
+	return nchanged
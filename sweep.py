@@ -0,0 +1,181 @@
+"""
+Cosmology parameter sweeps: one ruler per point of a grid of cosmological parameters.
+github.com/mtewes/cosmicruler
+
+From the command line, with the ruler spec file of a single ruler:
+
+	python cosmicruler.py sweep glass/glass.toml --grid Om0=0.25,0.3,0.35 --grid w0=-1,-0.9
+
+or with a sweep table in the spec file:
+
+	[sweep]
+	base = "Planck15"
+	output = "glass-{params}.svg"
+	Om0 = [0.25, 0.3, 0.35]
+	w0 = [-1.0, -0.9]
+
+Each point of the grid gives the cosmo scales the cosmology {"base": base, "Om0": 0.25, "w0": -1.0}
+(see cosmicruler.getcosmology), the other scales stay the same for all rulers.
+
+Before the rulers get built, the tables of the cosmo quantities are computed for all points at once: 1/E(z) of all
+the cosmologies is evaluated on the common redshift grid of cosmoinv, and the integrals giving the distances and
+times are done by a single cumulative integration over the stacked rows (see cosmoinv.CosmoGrid.stack). These
+tables are put into the cosmocache.TableCache, where the Inverters of the scales find them instead of calling astropy.
+The rulers are then built and written by parallel processes, one ruler per process.
+"""
+
+import os
+import json
+import logging
+import itertools
+import concurrent.futures
+
+import cosmicruler
+import cosmoinv
+import cosmocache
+import profiling
+import ruler
+
+
+GRID = (0.0, 20.0, 4000) # zmin, zmax and n of the tables, the defaults of cosmoinv.Tabulated.fromcosmo (part of the cache keys)
+
+
+def parsegrid(items):
+	"""Grid from command line items such as "Om0=0.25,0.3,0.35", as dict of lists"""
+	grid = {}
+	for item in items:
+		(name, values) = item.split("=", 1)
+		grid[name.strip()] = [float(value) for value in values.split(",")]
+	return grid
+
+
+def gridpoints(grid):
+	"""List of the points (dicts of parameter values) of a grid given as dict of lists, the last parameter varying fastest"""
+	names = list(grid)
+	return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def paramstring(point):
+	"""Short string of the parameter values of a point, for file names"""
+	return "_".join("{}={:g}".format(name, value) for (name, value) in point.items())
+
+
+def seedtables(cosmologies, quantities, cache=None):
+	"""Computes the tables of the (quantity, unit) pairs for all cosmologies (names or dicts for cosmicruler.getcosmology)
+	in one batch, and saves those that are not yet in the cache (a cosmocache.TableCache, by default the one in cachedir).
+
+	Quantities that are not in cosmoinv.GRIDUNITS are skipped, the scales will tabulate them with astropy.
+	Returns the number of saved tables.
+	"""
+	if cache is None:
+		cache = cosmocache.TableCache()
+	cosmos = [cosmicruler.getcosmology(cosmology) for cosmology in cosmologies]
+	todo = [] # (cosmology index, quantity, unit, key) of the missing tables
+	for (i, cosmo) in enumerate(cosmos):
+		for (quantity, unit) in quantities:
+			if quantity not in cosmoinv.GRIDUNITS:
+				continue
+			key = cache.key(cosmo, quantity, ruler.parseunit(unit), GRID, method="cosmogrid")
+			if not os.path.exists(cache.path(key)):
+				todo.append((i, quantity, unit, key))
+	if len(todo) == 0:
+		return 0
+
+	used = sorted(set(i for (i, quantity, unit, key) in todo))
+	with profiling.stage("sweep.integrate"):
+		grids = dict(zip(used, cosmoinv.CosmoGrid.stack([cosmos[i] for i in used], *GRID)))
+	for (i, quantity, unit, key) in todo:
+		cache.save(key, *grids[i].table(quantity, ruler.parseunit(unit)))
+	return len(todo)
+
+
+def pointspec(rulerspec, point, base=None):
+	"""Ruler spec for one point of the grid: the cosmo scales get the cosmology base (or their own) with the parameters of the point"""
+	rulerspec = dict(rulerspec)
+	rulerspec.pop("sweep", None)
+	rulerspec.pop("layout", None) # would be the same file for all points
+	scales = []
+	for spec in rulerspec["scales"]:
+		spec = dict(spec)
+		if spec.get("kind", "redshift") == "cosmo":
+			cosmology = spec.get("cosmology", "Planck15")
+			cosmology = dict(cosmology) if isinstance(cosmology, dict) else dict(base=cosmology)
+			if base is not None:
+				cosmology["base"] = base
+			cosmology.update(point)
+			spec["cosmology"] = cosmology
+		scales.append(spec)
+	rulerspec["scales"] = scales
+	return rulerspec
+
+
+def buildpoint(rulerspec, specdir, output, cache=True):
+	"""Builds and writes the ruler of one point (in a worker process), returns the output path"""
+	ruler.buildruler(rulerspec, specdir, output, processes=1, cache=cache)
+	return output
+
+
+@profiling.timed("sweep")
+def sweep(rulerspec, specdir, grid=None, base=None, output=None, processes=None, cache=True):
+	"""Builds one ruler per point of a parameter grid, and returns the list of (point, output path)
+
+	rulerspec : ruler spec (see ruler.buildfile), its optional sweep table gives the defaults of the other arguments
+	specdir : directory to which the relative paths of the spec are relative
+	grid : dict of lists of parameter values, e.g. {"Om0": [0.25, 0.3], "w0": [-1.0, -0.9]}, added to those of the sweep table
+	base : name of the cosmology whose parameters are changed (default: the cosmology of each scale, or Planck15)
+	output : path of the rulers, formatted with index, params (see paramstring), stem, and the parameters by name
+		(by default the output of the sweep table, relative to specdir)
+	processes : number of processes building the rulers (default: number of CPUs)
+	cache : if False, the scales are not taken from (nor saved to) the ruler.ScaleCache (the tables are always cached)
+	"""
+	settings = dict(rulerspec.get("sweep", {}))
+	(specbase, specoutput) = (settings.pop("base", None), settings.pop("output", "{stem}-{params}.svg")) # not parameters
+	base = specbase if base is None else base
+	output = os.path.join(specdir, specoutput) if output is None else output
+	settings.update(grid or {})
+	grid = settings
+	stem = os.path.splitext(rulerspec.get("output", "ruler.svg"))[0]
+
+	points = gridpoints(grid)
+	jobs = []
+	for (index, point) in enumerate(points):
+		spec = pointspec(rulerspec, point, base)
+		jobs.append((spec, output.format(index=index, params=paramstring(point), stem=stem, **point)))
+	if len(set(path for (spec, path) in jobs)) != len(jobs):
+		raise ValueError("The output {} gives the same path to several rulers".format(output))
+	logging.info("Sweeping {} points of {}".format(len(points), ", ".join(grid)))
+
+	cosmologies = {}
+	quantities = set()
+	for (spec, path) in jobs:
+		for scale in spec["scales"]:
+			if scale.get("kind", "redshift") == "cosmo" and scale.get("cache", True):
+				cosmologies[json.dumps(scale["cosmology"], sort_keys=True)] = scale["cosmology"]
+				quantities.add((scale["quantity"], scale.get("unit")))
+	nseeded = seedtables(list(cosmologies.values()), sorted(quantities, key=str))
+	logging.info("Computed {} tables of {} cosmologies in one batch".format(nseeded, len(cosmologies)))
+
+	if processes == 1 or len(jobs) < 2:
+		return [(point, buildpoint(spec, specdir, path, cache)) for (point, (spec, path)) in zip(points, jobs)]
+
+	with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+		futures = [executor.submit(buildpoint, spec, specdir, path, cache) for (spec, path) in jobs]
+		out = []
+		error = None
+		for (point, future) in zip(points, futures):
+			try:
+				out.append((point, future.result()))
+			except Exception as e:
+				logging.warning("Building the ruler of {} failed: {}".format(paramstring(point), e))
+				error = error or e
+		if error is not None:
+			raise error
+	return out
+
+
+def sweepfile(filepath, grid=None, base=None, output=None, processes=None, cache=True):
+	"""Like sweep, for a ruler spec file (relative paths are relative to its directory)"""
+	rulerspec = ruler.readspec(filepath)
+	rulerspec.setdefault("output", os.path.splitext(os.path.basename(filepath))[0] + ".svg")
+	return sweep(rulerspec, os.path.dirname(os.path.abspath(filepath)), grid=grid, base=base, output=output,
+		processes=processes, cache=cache)
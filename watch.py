@@ -0,0 +1,143 @@
+"""
+Watch mode: rebuilds a ruler whenever its spec file or its catalogs change, keeping what it can in memory.
+github.com/mtewes/cosmicruler
+
+From the command line (stop it with Ctrl-C):
+
+	python cosmicruler.py watch glass/glass.toml
+
+The process keeps astropy imported, and keeps the counts of the catalogs, the inverters of the cosmology quantities
+and the built scales (in redshift) in memory. After a change, only the scales whose spec or catalog changed get rebuilt,
+and only the scales whose drawing changed get re-rendered into the svg (see svgstream.update), other formats are
+rendered again. The files are polled for changes of their time or size.
+"""
+
+import os
+import copy
+import time
+import logging
+
+import cosmicruler
+import galcounts
+import profiling
+import ruler
+
+
+def prefetchcounts(specs, memo):
+	"""Puts the counts of the counts specs that are not yet in memo into it, streaming each catalog only once for all its selections"""
+	groups = {} # (catalog, z, derived) -> (derived, list of the specs)
+	for spec in specs:
+		if spec.get("kind", "redshift") == "counts" and ruler.memokey(spec) not in memo:
+			group = (spec["catalog"], spec.get("z", "true_redshift_gal"), repr(spec.get("derived")))
+			groups.setdefault(group, (spec.get("derived"), []))[1].append(spec)
+	for ((catalog, z, _), (derived, group)) in groups.items():
+		counts = galcounts.CumulativeCounts.fromselections(catalog, z,
+			dict((spec["name"], spec.get("selection")) for spec in group), derived=derived)
+		for spec in group:
+			memo[ruler.memokey(spec)] = counts[spec["name"]]
+
+
+class Watcher(object):
+	"""Builds a ruler spec file, and rebuilds it when the spec or its catalogs change"""
+
+	def __init__(self, filepath, output=None, cache=True):
+		"""
+		filepath : path of the spec file
+		output : file to write, instead of the output given in the spec
+		cache : if False, the scales are not taken from (nor saved to) the ruler.ScaleCache, they are only kept in memory
+		"""
+		self.filepath = filepath
+		self.output = None if output is None else os.path.abspath(output)
+		self.cache = ruler.ScaleCache() if cache else None
+		self.memo = {} # inverters and counts, see ruler.transfs
+		self.scales = {} # spechash -> built scale
+		self.paths = [filepath] # watched files
+		self.stamps = {}
+		self.specs = [] # of the scales of the last build
+
+	def stamp(self):
+		"""Dict of path -> (time, size) of the watched files, missing files (e.g., while an editor saves them) are skipped"""
+		stamps = {}
+		for path in self.paths:
+			try:
+				stat = os.stat(path)
+			except OSError:
+				continue
+			stamps[path] = (stat.st_mtime, stat.st_size)
+		return stamps
+
+	def changed(self):
+		"""True if a watched file changed since the last build"""
+		stamps = self.stamp()
+		return any(stamps[path] != self.stamps.get(path) for path in stamps)
+
+	@profiling.timed("watch.build")
+	def build(self):
+		"""Builds the ruler, reusing the scales and transformations in memory. Returns the layout.RulerLayout."""
+		starttime = time.time()
+		stamps = self.stamp() # before reading, so that changes during the build trigger another one
+		self.stamps = stamps
+		rulerspec = ruler.readspec(self.filepath)
+		specdir = os.path.dirname(os.path.abspath(self.filepath))
+		output = self.output or os.path.join(specdir, rulerspec.get("output", os.path.splitext(os.path.basename(self.filepath))[0] + ".svg"))
+		specs = ruler.scalespecs(rulerspec, specdir)
+		self.paths = [self.filepath] + sorted(set(spec["catalog"] for spec in specs if "catalog" in spec))
+		self.stamps = self.stamp()
+		self.stamps.update(stamps)
+
+		self.specs = specs
+		keys = [ruler.spechash(spec) for spec in specs] # without the titles, which are set when drawing
+		todo = [i for (i, key) in enumerate(keys) if key not in self.scales]
+		if self.cache is not None:
+			for i in list(todo):
+				scale = self.cache.load(keys[i])
+				if scale is not None:
+					self.scales[keys[i]] = scale
+					todo.remove(i)
+		prefetchcounts([specs[i] for i in todo], self.memo)
+		for i in todo:
+			scale = ruler.buildscale(specs[i], self.memo)
+			if self.cache is not None:
+				self.cache.save(keys[i], scale)
+			self.scales[keys[i]] = scale
+
+		# Only what the current spec uses is kept
+		self.scales = dict((key, self.scales[key]) for key in keys)
+		memokeys = set(ruler.memokey(spec) for spec in specs)
+		self.memo = dict((key, value) for (key, value) in self.memo.items() if key in memokeys)
+
+		scales = [copy.deepcopy(self.scales[key]) for key in keys] # as apply_zptrans changes them
+		for (spec, scale) in zip(specs, scales):
+			scale.title = spec.get("title", spec["name"])
+		lay = ruler.layoutfromspec(rulerspec, scales)
+		nrendered = ruler.writeruler(lay, rulerspec, specdir, output)
+		logging.info("Rebuilt {} and re-rendered {} of {} scales in {:.2f} s".format(len(todo), nrendered, len(keys), time.time() - starttime))
+		return lay
+
+	def warm(self):
+		"""Loads the counts and inverters of all scales of the last build into memory (those of scales that came from the
+		ScaleCache are not there yet), so that the next changes are quick"""
+		prefetchcounts(self.specs, self.memo)
+		for spec in self.specs:
+			if spec.get("kind", "redshift") == "cosmo":
+				ruler.transfs(spec, cosmicruler.Scale(name=spec["name"]), self.memo)
+
+	def run(self, interval=0.5):
+		"""Builds the ruler, then polls the files every interval seconds and rebuilds it after each change, until interrupted"""
+		while True:
+			try:
+				self.build()
+				self.warm()
+			except Exception as e: # e.g., a spec being edited, the next change will tell
+				logging.error("Building {} failed: {}".format(self.filepath, e))
+			logging.info("Watching {}".format(", ".join(self.paths)))
+			while not self.changed():
+				time.sleep(interval)
+
+
+def watchfile(filepath, output=None, interval=0.5, cache=True):
+	"""Builds a ruler spec file and rebuilds it whenever it or its catalogs change, until interrupted (Ctrl-C)"""
+	try:
+		Watcher(filepath, output=output, cache=cache).run(interval)
+	except KeyboardInterrupt:
+		logging.info("Stopped watching {}".format(filepath))